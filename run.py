@@ -1,4 +1,7 @@
-from swiftsuru import conf, app
+from swiftsuru import conf, app, dbclient, tasks
+
+dbclient.bootstrap()
+tasks.start()
 
 app.run(
     host=conf.HOST,
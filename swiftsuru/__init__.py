@@ -1,3 +1,11 @@
+import os
+
+# Cooperative workers need the standard library patched before any module
+# creates its locks, threads or sockets
+if os.environ.get("WEB_WORKER_CLASS") == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+
 # Disable HTTPS verification warnings.
 from requests.packages import urllib3
 urllib3.disable_warnings()
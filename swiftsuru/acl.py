@@ -0,0 +1,169 @@
+"""
+Permits Tsuru units to reach Keystone and Swift through the ACL API.
+
+Permits are given per /24 network of the units, so most units land on a
+network that is already permitted. Granted (network, destination) pairs
+are kept on MongoDB and in memory, and new ones are queued on MongoDB and
+sent by the background task of any process with a single commit, so binds
+never wait for the ACL API and queued permits survive worker restarts.
+"""
+import socket
+import time
+
+from datetime import datetime, timedelta
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.cache import TTLCache
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.scheduler import PeriodicTask
+
+try:
+    from aclapiclient import Client, L4Opts
+except ImportError:
+    Client = L4Opts = None
+
+
+logger = utils.get_logger(__name__)
+
+# Addresses of Keystone and Swift hosts
+dns_cache = TTLCache(conf.ACLAPI_DNS_CACHE_TTL)
+
+# Pairs known to be permitted, filled from MongoDB and by the PermitWorker
+granted = TTLCache()
+
+# Pairs queued on MongoDB by this process, not to be queued again on every bind
+queued = TTLCache(conf.ACLAPI_GRANTED_RELOAD_INTERVAL)
+
+_client = None
+
+
+def aclapi_cli():
+    global _client
+
+    if Client is None:
+        raise RuntimeError("aclapiclient is not installed")
+
+    if _client is None:
+        _client = Client(conf.ACLAPI_USER, conf.ACLAPI_PASS, conf.ACLAPI_URL)
+
+    return _client
+
+
+def resolve(host):
+    address = dns_cache.get(host)
+
+    if address is None:
+        address = socket.gethostbyname(host)
+        dns_cache.set(host, address)
+
+    return address
+
+
+def destinations():
+    return [("keystone", conf.KEYSTONE_HOST, conf.KEYSTONE_PORT),
+            ("swift api", conf.SWIFT_API_HOST, conf.SWIFT_API_PORT)]
+
+
+def unit_permits(unit_host):
+    """
+    Permits needed by a unit, keyed by "<network>/24><address>:<port>".
+    """
+    source = "{}/24".format(utils.format_for_network_mask(unit_host))
+    permits = {}
+
+    for name, host, port in destinations():
+        dest = "{}/32".format(resolve(host))
+        key = "{}>{}:{}".format(source, dest, port)
+        permits[key] = {"name": name,
+                        "source": source,
+                        "dest": dest,
+                        "port": port,
+                        "unit_host": unit_host}
+
+    return permits
+
+
+def permit_unit(unit_host):
+    """
+    Queues the permits of a unit not granted yet. Returns how many were queued.
+    """
+    permits = unit_permits(unit_host)
+    new = dict((key, permit) for key, permit in permits.items()
+               if not granted.get(key) and not queued.get(key))
+
+    metrics.incr("aclapi.permit.known", len(permits) - len(new))
+
+    if new:
+        db_cli = SwiftsuruDBClient()
+
+        for key, permit in new.items():
+            db_cli.queue_acl_permit(key, permit)
+            queued.set(key, True)
+
+    metrics.incr("aclapi.permit.queued", len(new))
+    return len(new)
+
+
+class PermitWorker(PeriodicTask):
+    """
+    Takes the permits queued on MongoDB and commits them at once. Permits
+    granted by other processes are reloaded every
+    ACLAPI_GRANTED_RELOAD_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        super(PermitWorker, self).__init__(conf.ACLAPI_BATCH_INTERVAL)
+        self._loaded_at = None
+
+    def load_granted(self, db_cli):
+        for key in db_cli.list_acl_permits():
+            granted.set(key, True)
+
+        self._loaded_at = time.time()
+
+    def run_once(self):
+        db_cli = SwiftsuruDBClient()
+
+        if self._loaded_at is None or time.time() - self._loaded_at >= conf.ACLAPI_GRANTED_RELOAD_INTERVAL:
+            self.load_granted(db_cli)
+
+        stale_before = datetime.utcnow() - timedelta(seconds=conf.ACLAPI_STALE_AFTER)
+        claimed = db_cli.claim_acl_permits(stale_before, conf.ACLAPI_BATCH_SIZE)
+
+        if not claimed:
+            return
+
+        pending = dict((permit.pop("_id"), permit) for permit in claimed)
+
+        try:
+            self.send(db_cli, pending)
+        except Exception:
+            db_cli.release_acl_permits(list(pending))
+            raise
+
+    def send(self, db_cli, pending):
+        new = dict((key, permit) for key, permit in pending.items() if not granted.get(key))
+
+        if new:
+            client = aclapi_cli()
+
+            with metrics.timer("aclapi.batch"):
+                for permit in new.values():
+                    logger.info("Permitting {} access to {} from {}".format(
+                        permit["name"], permit["dest"], permit["source"]))
+
+                    client.add_tcp_permit_access(
+                        desc="{} access (swift service) for tsuru unit: {}".format(permit["name"], permit["unit_host"]),
+                        source=permit["source"],
+                        dest=permit["dest"],
+                        l4_opts=L4Opts("eq", permit["port"], "dest"))
+
+                client.commit()
+
+            metrics.incr("aclapi.permit.granted", len(new))
+            metrics.incr("aclapi.commits")
+
+        # Permits already granted are only taken off the queue
+        for key in pending:
+            db_cli.add_acl_permit(key)
+            granted.set(key, True)
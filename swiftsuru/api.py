@@ -6,19 +6,37 @@ Definition of routes and implementation of an API which provides:
 http://docs.tsuru.io/en/0.5.3/services/api.html
 http://docs.tsuru.io/en/0.5.3/services/build.html
 """
+import atexit
+import hashlib
 import json
+import os
 import socket
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
 
 from flask import Response, Blueprint, request, jsonify
 
-from swiftsuru import utils, conf
+from swiftsuru import utils, conf, metrics, acl, cors, health, provisioning, warm_pool
 from swiftsuru.keystone_client import KeystoneClient
-from swiftsuru.swift_client import SwiftClient
-from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.dbclient import SwiftsuruDBClient, plan_cache
+from swiftsuru.cache import TTLCache, SingleFlight
+from swiftsuru.status import instance_status, UP, PENDING, MISSING
+from swiftsuru.usage import usage_status
 
 logger = utils.get_logger(__name__)
 api = Blueprint("swift", __name__)
 
+# Last successful bind response of each instance, with the time it was built
+bind_responses = TTLCache()
+# Identical binds in flight at the same time share one execution
+bind_flights = SingleFlight()
+
+# Thread pools of this process by name, with the pid that built them
+_pools = {}
+_pools_lock = threading.Lock()
+
 
 @api.route("/resources", methods=["POST"])
 def add_instance():
@@ -29,8 +47,13 @@ def add_instance():
     - Creates a new Container on the Tenant chose by the plan
     - Grant r/w permission for the new user on this new container
     - Saves on MongoDB the Service Intances infos
+
+    Those steps run in background, see swiftsuru/provisioning.py. The
+    instance is answered with 201 as soon as its job is queued, and
+    GET /resources/<name>/provisioning tells its progress.
     """
-    return "This service is deprecated. Please, use swift-prod or swift-qa.", 500
+    if conf.SERVICE_DEPRECATED:
+        return "This service is deprecated. Please, use swift-prod or swift-qa.", 500
 
     try:
         db_cli = SwiftsuruDBClient()
@@ -57,47 +80,35 @@ def add_instance():
     team = data["team"]
     team = team if not isinstance(team, list) else team[0]
 
-    username = "{}_{}".format(team, name)
-    password = utils.generate_password()
-
-    try:
-        keystone = KeystoneClient(tenant=tenant)
-        keystone.create_user(name=username,
-                             password=password,
-                             project_name=tenant,
-                             role_name=conf.KEYSTONE_DEFAULT_ROLE,
-                             enabled=True)
-    except Exception, err:
-        err_msg = 'Fail to create user on Keystone: {}'.format(err)
-        logger.error(err_msg)
+    job = db_cli.get_job(name)
 
-        return "Internal error: Failed to create instance", 500
+    # Names of deleted instances are taken until the reaper archives them
+    existing = db_cli.get_instance(name, include_deleted=True)
 
-    container_name = utils.generate_container_name()
-    tenant_user = "{}:{}".format(tenant, username)
-    headers = {
-        "X-Container-Write": "{}".format(tenant_user),
-        "X-Container-Read": ".r:*,{}".format(tenant_user)
-    }
+    if existing or (job and job["status"] in ("pending", "running")):
+        return "Instance already exists", 409
 
     try:
-        client = SwiftClient(keystone)
-        client.create_container(container_name, headers)
-        # Container created to allow the use of undelete middleware
-        client.create_container('.trash-{}'.format(container_name), headers)
+        warm = db_cli.claim_warm_instance(plan)
+
+        if warm:
+            try:
+                # User and containers created ahead of time by the warm pool
+                db_cli.add_instance(name, team, warm["container"],
+                                    plan, warm["user"], warm["password"],
+                                    tenant=warm["tenant"], endpoints=warm["endpoints"])
+            except Exception:
+                # Slots left claimed when this fails too are released by
+                # the next run of the warm pool filler
+                warm_pool.release_slot(db_cli, warm)
+                raise
+
+            db_cli.remove_warm_instance(warm["_id"])
+            metrics.incr("warm_pool.claimed")
+        else:
+            metrics.incr("warm_pool.empty")
+            provisioning.enqueue_instance(name, team, plan, tenant)
     except Exception, err:
-        # TODO: remove user created on Keystone
-        err_msg = 'Fail to create container on Swift: {}'.format(err)
-        logger.error(err_msg)
-
-        return "Internal error: Failed to create instance", 500
-
-    try:
-        db_cli.add_instance(name, team, container_name,
-                            plan, username, password)
-    except Exception, err:
-        # TODO: remove user created on Keystone
-        # TODO: remove container created on Swift
         err_msg = 'Fail to add instance on MongoDB: {}'.format(err)
         logger.error(err_msg)
 
@@ -107,6 +118,61 @@ def add_instance():
     return "", 201
 
 
+@api.route("/resources/<instance_name>/provisioning")
+def show_provisioning(instance_name):
+    """
+    Progress of the creation of a Swift Service Instance.
+    """
+    db_cli = SwiftsuruDBClient()
+    job = db_cli.get_job(instance_name)
+
+    if not job:
+        # Instances claimed from the warm pool are ready without a job
+        if db_cli.get_instance(instance_name):
+            return jsonify({"name": instance_name, "status": "done"}), 200
+
+        return "Instance not found", 404
+
+    return jsonify(provisioning.job_status(job)), 200
+
+
+@api.route("/resources/<instance_name>/usage")
+def show_usage(instance_name):
+    """
+    Bytes and objects stored by a Swift Service Instance, as measured by
+    the last sweep. Never reaches Swift.
+    """
+    usage = SwiftsuruDBClient().get_instance_usage(instance_name)
+
+    if usage is None:
+        return "Instance not found", 404
+
+    if not usage:
+        return "Usage not measured yet", 202
+
+    return jsonify(usage_status(instance_name, usage)), 200
+
+
+@api.route("/resources/<instance_name>/status")
+def show_status(instance_name):
+    """
+    Status of a Swift Service Instance polled by Tsuru: 204 when up, 202
+    while pending and 500 when down. Answered from the last probe.
+    """
+    status = instance_status(instance_name)
+
+    if status["state"] == UP:
+        return "", 204
+
+    if status["state"] == PENDING:
+        return "", 202
+
+    if status["state"] == MISSING:
+        return "Instance not found", 404
+
+    return status.get("reason") or "Instance is down", 500
+
+
 @api.route("/resources/<instance_name>", methods=["DELETE"])
 def remove_instance(instance_name):
     """
@@ -125,49 +191,203 @@ def remove_instance(instance_name):
 
 
 def _bind(instance_name, app_host=None):
+    """
+    Binds using the last known good response of the instance when building
+    a fresh one takes longer than BIND_LATENCY_BUDGET seconds. The fresh
+    bind keeps running in background and replaces the cached response.
+    """
+    response, status_code = _bind_result(instance_name, app_host)
 
-    ip = socket.gethostbyname(socket.gethostname())
-    logger.info('Starting bind to instance <{}> at unit {}'.format(instance_name, ip))
+    if status_code == 201:
+        return jsonify(response), status_code
+
+    return response, status_code
+
+
+def _bind_result(instance_name, app_host=None):
+    cached = bind_responses.get(instance_name)
+
+    if cached is None:
+        return _fresh_bind(instance_name, app_host)
+
+    return _bind_within_budget(instance_name, app_host, cached)
 
-    db_cli = SwiftsuruDBClient()
-    instance = db_cli.get_instance(instance_name)
+
+def _fresh_bind(instance_name, app_host=None):
+    (response, status_code), shared = bind_flights.do((instance_name, app_host),
+                                                      _bind_instance, instance_name, app_host)
+
+    if shared:
+        metrics.incr("bind.coalesced")
+        return response, status_code
+
+    if status_code == 201:
+        bind_responses.set(instance_name, (response, time.time()))
+    else:
+        bind_responses.delete(instance_name)
+
+    return response, status_code
+
+
+def _bind_within_budget(instance_name, app_host, cached):
+    result = {}
+    done = threading.Event()
+
+    def refresh():
+        try:
+            result["response"] = _fresh_bind(instance_name, app_host)
+        except Exception, err:
+            logger.error('Fail to refresh bind of <{}>: {}'.format(instance_name, err))
+        finally:
+            done.set()
+
+    get_refresh_pool().apply_async(refresh)
+
+    if done.wait(conf.BIND_LATENCY_BUDGET) and "response" in result:
+        return result["response"]
+
+    response, built_at = cached
+    stale_age = time.time() - built_at
+
+    metrics.incr("bind.stale_served")
+    metrics.observe("bind.stale_age", stale_age)
+
+    log_msg = 'Serving stale bind of <{}> built {:.0f}s ago'
+    logger.warning(log_msg.format(instance_name, stale_age))
+
+    return response, 201
+
+
+def _get_pool(name, size):
+    """
+    Threads do not survive a fork, so each process builds its own pools.
+    """
+    with _pools_lock:
+        pool, pid = _pools.get(name, (None, None))
+
+        if pool is None or pid != os.getpid():
+            pool = ThreadPool(size)
+            _pools[name] = (pool, os.getpid())
+
+        return pool
+
+
+def get_bind_pool():
+    """
+    Bounded pool running the independent steps of binds.
+    """
+    return _get_pool("bind", conf.BIND_WORKERS)
+
+
+def get_refresh_pool():
+    """
+    Bounded pool refreshing cached binds in background. Refreshes wait for
+    steps run on the bind pool, so they never run on it themselves.
+    """
+    return _get_pool("refresh", conf.BIND_REFRESH_WORKERS)
+
+
+@atexit.register
+def close_bind_pool():
+    """
+    Lets the refreshes and steps in flight finish and stops the threads of
+    the bind pools. Pools inherited through a fork have no threads left and
+    are only dropped.
+    """
+    # Refreshes first, as they still submit steps to the bind pool
+    for name in ("refresh", "bind"):
+        with _pools_lock:
+            pool, pid = _pools.pop(name, (None, None))
+
+        if pool is not None and pid == os.getpid():
+            pool.close()
+            pool.join()
+
+
+def _run_step(name, func, *args):
+    """
+    Starts a bind step on the bind pool, timing it as bind.step.<name>.
+    """
+    def timed():
+        with metrics.timer("bind.step.{}".format(name)):
+            return func(*args)
+
+    return get_bind_pool().apply_async(timed)
+
+
+def _unit_ip():
+    return socket.gethostbyname(socket.gethostname())
+
+
+def _bind_instance(instance_name, app_host=None):
+    app_hosts = [app_host] if app_host else []
+    instance, response, _ = _build_bind(instance_name, app_hosts)
 
     if not instance:
-        logger.info('Instance <{}> not found on MongoDB'.format(instance_name))
         return "Instance not found", 500
 
-    container = instance.get("container")
-    plan = instance.get("plan")
+    return response, 201
 
-    db_plan = db_cli.get_plan(plan)
-    tenant = db_plan.get("tenant")
 
-    log_msg = 'Instance found: container={}, plan={}, tenant={}'
-    logger.info(log_msg.format(container, plan, tenant))
+def _build_bind(instance_name, app_hosts=()):
+    """
+    Returns the instance, its bind response and the error of the CORS
+    update of app_hosts, if any. The instance is None when not found.
+    """
+    cors_error = None
 
-    keystone = KeystoneClient(tenant=tenant)
-    endpoints = keystone.get_storage_endpoints()
+    with metrics.timer("bind.total"):
+        # The unit address is only logged, so it is resolved during the lookup
+        ip_step = _run_step("resolve_unit", _unit_ip)
 
-    if app_host:
-        try:
-            cors_url = utils.format_cors_url(app_host)
+        logger.info('Starting bind to instance <{}>'.format(instance_name))
 
-            client = SwiftClient(keystone)
-            client.set_cors(container, cors_url)
+        db_cli = SwiftsuruDBClient()
+        with metrics.timer("bind.step.lookup"):
+            instance = db_cli.get_bind_info(instance_name)
 
-            log_msg = 'CORS set on <{}> to <{}>'
-            logger.debug(log_msg.format(container, app_host))
-        except Exception, err:
-            # TODO: remove user created on Keystone
-            err_msg = 'Fail to set CORS to container on Swift: {}'.format(err)
-            logger.error(err_msg)
+        if not instance:
+            logger.info('Instance <{}> not found on MongoDB'.format(instance_name))
+            return None, None, None
+
+        container = instance.get("container")
+        plan = instance.get("plan")
+        tenant = instance.get("tenant")
+
+        log_msg = 'Instance found: container={}, plan={}, tenant={}'
+        logger.info(log_msg.format(container, plan, tenant))
+
+        # CORS and endpoints depend only on the instance, so they run side by side
+        cors_step = None
+        if app_hosts:
+            cors_step = _run_step("cors", cors.add_hosts, instance, list(app_hosts))
 
-            # Este returno 500 esta comentado pois quando o header de CORS ultrapassa
-            # os 256 caracteres, entra nesta exception e nao continua a fazer o bind
+        # Keystone is only needed for instances whose endpoints were not stored yet
+        endpoints = instance.get("endpoints")
 
-            # return "Internal error: Failed to bind instance", 500
+        if not endpoints:
+            with metrics.timer("bind.step.endpoints"):
+                endpoints = KeystoneClient(tenant=tenant).get_storage_endpoints()
 
-    response = {
+        response = _bind_response(instance, endpoints)
+
+        if cors_step is not None:
+            cors_error = _wait_cors(cors_step, container, app_hosts)
+
+    try:
+        ip = ip_step.get()
+    except Exception:
+        ip = "<unknown>"
+
+    logger.info('Bind to <{}> finished at unit {}'.format(instance_name, ip))
+
+    return instance, response, cors_error
+
+
+def _bind_response(instance, endpoints):
+    container = instance.get("container")
+
+    return {
         "SWIFT_ADMIN_URL": '{}/{}'.format(endpoints["adminURL"],
                                           container),
         "SWIFT_PUBLIC_URL": '{}/{}'.format(endpoints["publicURL"],
@@ -176,14 +396,32 @@ def _bind(instance_name, app_host=None):
                                              container),
         "SWIFT_AUTH_URL": getattr(conf, 'KEYSTONE_URL'),
         "SWIFT_CONTAINER": container,
-        "SWIFT_TENANT": tenant,
+        "SWIFT_TENANT": instance.get("tenant"),
         "SWIFT_USER": instance.get("user"),
         "SWIFT_PASSWORD": instance.get("password")
     }
 
-    logger.info('Bind to <{}> finished'.format(instance_name))
 
-    return jsonify(response), 201
+def _wait_cors(cors_step, container, app_hosts):
+    try:
+        cors_step.get()
+
+        log_msg = 'CORS set on <{}> to <{}>'
+        logger.debug(log_msg.format(container, ", ".join(app_hosts)))
+    except cors.CorsHeaderTooLarge, err:
+        # The bind still works, only the app host is not allowed by CORS
+        logger.error('Fail to set CORS to container on Swift: {}'.format(err))
+        return err
+    except Exception, err:
+        # TODO: remove user created on Keystone
+        err_msg = 'Fail to set CORS to container on Swift: {}'.format(err)
+        logger.error(err_msg)
+
+        # Este returno 500 esta comentado pois quando o header de CORS ultrapassa
+        # os 256 caracteres, entra nesta exception e nao continua a fazer o bind
+
+        # return "Internal error: Failed to bind instance", 500
+        return err
 
 
 @api.route("/resources/<instance_name>/bind-app", methods=["POST"])
@@ -208,19 +446,18 @@ def bind_app(instance_name):
 def bind_unit(instance_name):
     """
     Binds a Tsuru unit to Swift, also adds a permit access on the used ACL.
+    Permits are sent in background, see swiftsuru/acl.py.
     """
     response, status_code = _bind(instance_name)
 
     if conf.ENABLE_ACLAPI:
         unit_host = request.form.get("unit-host")
 
-        logger.info('Starting ACL API for unit host <{}>'.format(unit_host))
-
-        utils.permit_keystone_access(unit_host)
-        utils.permit_swift_access(unit_host)
-        utils.aclapi_cli().commit()
-
-        logger.info('Finished ACL API for unit host <{}>'.format(unit_host))
+        try:
+            queued = acl.permit_unit(unit_host)
+            logger.info('{} ACL API permits queued for unit host <{}>'.format(queued, unit_host))
+        except Exception, err:
+            logger.error('Fail to queue ACL API permits of unit host <{}>: {}'.format(unit_host, err))
 
     logger.info('bind-unit: Returning response status code <{}>'.format(status_code))
     return response, status_code
@@ -235,24 +472,13 @@ def _unbind(instance_name, app_host):
     logger.info('Starting unbind to instance <{}> at unit {}'.format(instance_name, ip))
 
     db_cli = SwiftsuruDBClient()
-    instance = db_cli.get_instance(instance_name)
+    instance = db_cli.get_bind_info(instance_name)
 
     if not instance:
         return "Instance not found", 404
 
-    container = instance.get("container")
-    plan = instance.get("plan")
-
-    db_plan = db_cli.get_plan(plan)
-    tenant = db_plan.get("tenant")
-
-    keystone = KeystoneClient(tenant=tenant)
-
     try:
-        cors_url = utils.format_cors_url(app_host)
-
-        client = SwiftClient(keystone)
-        client.unset_cors(container, cors_url)
+        cors.remove_hosts(instance, [app_host])
     except Exception, err:
         # TODO: remove user created on Keystone
         err_msg = 'Fail to set CORS to container on Swift: {}'.format(err)
@@ -285,28 +511,222 @@ def unbind_unit(instance_name):
     return "", 200
 
 
+def _batch_hosts(field):
+    """
+    Hosts of a batch request, sent as repeated form fields.
+    """
+    hosts = [host for host in request.form.getlist(field) if host]
+    return sorted(set(hosts))
+
+
+def _batch_results(field, hosts, status_code, error=None):
+    results = []
+
+    for host in hosts:
+        result = {field: host, "status": status_code}
+
+        if error is not None:
+            result["error"] = str(error)
+
+        results.append(result)
+
+    return results
+
+
+@api.route("/resources/<instance_name>/bind-app/batch", methods=["POST"])
+def bind_apps(instance_name):
+    """
+    Binds many app hosts to a Swift Service Instance at once.
+
+    The instance is looked up and CORS is updated only once for all
+    hosts. Returns the bind variables and the result of each host: hosts
+    whose CORS update failed are answered with a 500 and the error, while
+    the bind variables stay valid.
+    """
+    app_hosts = _batch_hosts("app-host")
+
+    if not app_hosts:
+        return "You must send at least one app-host", 400
+
+    with metrics.timer("bind.batch"):
+        instance, response, cors_error = _build_bind(instance_name, app_hosts)
+
+    if not instance:
+        bind_responses.delete(instance_name)
+        return "Instance not found", 500
+
+    bind_responses.set(instance_name, (response, time.time()))
+    metrics.incr("bind.batch.hosts", len(app_hosts))
+
+    host_status = 201 if cors_error is None else 500
+    body = {"env": response,
+            "results": _batch_results("app-host", app_hosts, host_status, cors_error)}
+
+    logger.info('bind-app batch: {} hosts bound to <{}>'.format(len(app_hosts), instance_name))
+    return jsonify(body), 201
+
+
+@api.route("/resources/<instance_name>/bind/batch", methods=["POST"])
+def bind_units(instance_name):
+    """
+    Binds many Tsuru units to Swift at once, queueing the ACL permits of
+    all of them.
+    """
+    unit_hosts = _batch_hosts("unit-host")
+
+    if not unit_hosts:
+        return "You must send at least one unit-host", 400
+
+    with metrics.timer("bind.batch"):
+        response, status_code = _bind_result(instance_name)
+
+    if status_code != 201:
+        return response, status_code
+
+    results = []
+
+    if conf.ENABLE_ACLAPI:
+        for unit_host in unit_hosts:
+            try:
+                acl.permit_unit(unit_host)
+                results.append({"unit-host": unit_host, "status": 201})
+            except Exception, err:
+                logger.error('Fail to queue ACL API permits of unit host <{}>: {}'.format(unit_host, err))
+                results.append({"unit-host": unit_host, "status": 500, "error": str(err)})
+    else:
+        results = _batch_results("unit-host", unit_hosts, 201)
+
+    metrics.incr("bind.batch.hosts", len(unit_hosts))
+
+    logger.info('bind-unit batch: {} units bound to <{}>'.format(len(unit_hosts), instance_name))
+    return jsonify({"env": response, "results": results}), 201
+
+
+@api.route("/resources/<instance_name>/bind-app/batch", methods=["DELETE"])
+def unbind_apps(instance_name):
+    """
+    Unbinds many app hosts of a Swift Service Instance with a single CORS
+    update.
+    """
+    app_hosts = _batch_hosts("app-host")
+
+    if not app_hosts:
+        return "You must send at least one app-host", 400
+
+    db_cli = SwiftsuruDBClient()
+    instance = db_cli.get_bind_info(instance_name)
+
+    if not instance:
+        return "Instance not found", 404
+
+    try:
+        cors.remove_hosts(instance, app_hosts)
+        results = _batch_results("app-host", app_hosts, 200)
+    except Exception, err:
+        err_msg = 'Fail to set CORS to container on Swift: {}'.format(err)
+        logger.error(err_msg)
+
+        results = _batch_results("app-host", app_hosts, 500, err)
+
+    return jsonify({"results": results}), 200
+
+
+@api.route("/resources/<instance_name>/bind/batch", methods=["DELETE"])
+def unbind_units(instance_name):
+    """
+    Unbinds many Tsuru units of a Swift Service Instance.
+    """
+    unit_hosts = _batch_hosts("unit-host")
+
+    return jsonify({"results": _batch_results("unit-host", unit_hosts, 200)}), 200
+
+
+@api.route("/admin/instances")
+def export_instances():
+    """
+    Streams instances as newline delimited JSON, without credentials, in
+    pages of up to `limit` instances sorted by name. The next page starts
+    after the last name received, sent as `marker`; a page shorter than
+    `limit` is the last one. `plan` filters the instances of a plan.
+    """
+    try:
+        limit = int(request.args.get("limit", conf.ADMIN_LIST_LIMIT))
+    except ValueError:
+        return "limit must be a number", 400
+
+    limit = max(1, min(limit, conf.ADMIN_LIST_LIMIT))
+    instances = SwiftsuruDBClient().iter_instances(plan=request.args.get("plan"),
+                                                   marker=request.args.get("marker"),
+                                                   limit=limit)
+
+    def lines():
+        for instance in instances:
+            yield json.dumps(instance, default=str) + "\n"
+
+    return Response(lines(), mimetype="application/x-ndjson"), 200
+
+
 @api.route("/healthcheck")
 def healthcheck():
     """
-    Swift Service API healthcheck.
+    Swift Service API healthcheck. With deep=1, answers the last results of
+    the background probes of MongoDB, Keystone and Swift, and 503 unless
+    all of them are ok.
     """
+    if request.args.get("deep") not in (None, "", "0"):
+        result = health.report()
+        status_code = 200 if result["status"] == health.OK else 503
+
+        return jsonify(result), status_code
+
     return "WORKING", 200
 
 
+@api.route("/metrics")
+def show_metrics():
+    """
+    In-process counters and timings of this API worker.
+    """
+    return jsonify(metrics.snapshot()), 200
+
+
 @api.route("/resources/plans")
 def list_plans():
     """
     List all plans availables on Swift.
     """
-    db_cli = SwiftsuruDBClient()
-    plans = []
+    body, etag = _plans_response()
+
+    if etag in request.if_none_match:
+        content = Response(status=304)
+        content.set_etag(etag)
 
-    for plan in db_cli.list_plans():
-        plans.append({
-            "name": plan.get("name"),
-            "description": plan.get("description")
-        })
+        return content
 
-    content = Response(json.dumps(plans), mimetype="application/json")
+    content = Response(body, mimetype="application/json")
+    content.set_etag(etag)
 
     return content, 200
+
+
+def _plans_response():
+    """
+    Serialized plans list and its ETag, kept along with the cached plans.
+    """
+    cached = plan_cache.get("response")
+
+    if cached is None:
+        db_cli = SwiftsuruDBClient()
+        plans = []
+
+        for plan in db_cli.list_plans():
+            plans.append({
+                "name": plan.get("name"),
+                "description": plan.get("description")
+            })
+
+        body = json.dumps(plans)
+        cached = (body, hashlib.md5(body).hexdigest())
+        plan_cache.set("response", cached)
+
+    return cached
@@ -3,6 +3,18 @@ import sys
 
 from os import environ
 
+
+def flag(name, default=False):
+    """
+    Boolean setting: "1", "true", "yes" and "on" turn it on, anything else off.
+    """
+    value = environ.get(name)
+
+    if value is None:
+        return default
+
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
 # Swiftsuru settings
 DEBUG = environ.get("DEBUG", False)
 
@@ -19,6 +31,101 @@ LOG_HANDLER = handler
 HOST = "0.0.0.0"
 PORT = int(environ.get("PORT", "8888"))
 
+# production server, see swiftsuru/server.py
+WEB_WORKERS = int(environ.get("WEB_WORKERS", "4"))
+WEB_THREADS = int(environ.get("WEB_THREADS", "8"))
+# "gevent" serves many requests per process on greenlets
+WEB_WORKER_CLASS = environ.get("WEB_WORKER_CLASS", "gthread")
+# requests in flight per gevent worker
+WEB_WORKER_CONNECTIONS = int(environ.get("WEB_WORKER_CONNECTIONS", "500"))
+# workers are replaced after this many requests, 0 disables it
+WEB_MAX_REQUESTS = int(environ.get("WEB_MAX_REQUESTS", "5000"))
+WEB_MAX_REQUESTS_JITTER = int(environ.get("WEB_MAX_REQUESTS_JITTER", "500"))
+WEB_TIMEOUT = int(environ.get("WEB_TIMEOUT", "60"))
+WEB_GRACEFUL_TIMEOUT = int(environ.get("WEB_GRACEFUL_TIMEOUT", "30"))
+WEB_KEEPALIVE = int(environ.get("WEB_KEEPALIVE", "5"))
+
+# background removal of the containers and users of deleted instances, off by default
+REAPER_ENABLED = environ.get("REAPER_ENABLED", False)
+# seconds a deleted instance is kept, and can be restored, before being reaped
+REAPER_GRACE_PERIOD = int(environ.get("REAPER_GRACE_PERIOD", "604800"))
+REAPER_INTERVAL = int(environ.get("REAPER_INTERVAL", "300"))
+REAPER_JITTER = int(environ.get("REAPER_JITTER", "60"))
+REAPER_BATCH_SIZE = int(environ.get("REAPER_BATCH_SIZE", "20"))
+REAPER_CONCURRENCY = int(environ.get("REAPER_CONCURRENCY", "4"))
+# objects per Swift bulk delete request, at most the max_deletes_per_request of Swift
+REAPER_BULK_DELETE_SIZE = int(environ.get("REAPER_BULK_DELETE_SIZE", "1000"))
+# instances taken this many seconds ago by a reaper that never finished are taken again
+REAPER_STALE_AFTER = int(environ.get("REAPER_STALE_AFTER", "3600"))
+
+# background measuring of the bytes and objects stored by each instance
+USAGE_SWEEP_ENABLED = environ.get("USAGE_SWEEP_ENABLED", True)
+USAGE_SWEEP_INTERVAL = int(environ.get("USAGE_SWEEP_INTERVAL", "900"))
+USAGE_SWEEP_JITTER = int(environ.get("USAGE_SWEEP_JITTER", "60"))
+# tenants swept at the same time, each tenant sweeps its instances one by one
+USAGE_SWEEP_CONCURRENCY = int(environ.get("USAGE_SWEEP_CONCURRENCY", "4"))
+# instances a sweeper claims at once, other processes sweep the next ones
+USAGE_SWEEP_BATCH_SIZE = int(environ.get("USAGE_SWEEP_BATCH_SIZE", "100"))
+
+# background probing of the containers and Keystone users of instances,
+# served by GET /resources/<name>/status
+STATUS_PROBE_ENABLED = environ.get("STATUS_PROBE_ENABLED", True)
+STATUS_PROBE_INTERVAL = int(environ.get("STATUS_PROBE_INTERVAL", "120"))
+STATUS_PROBE_JITTER = int(environ.get("STATUS_PROBE_JITTER", "30"))
+STATUS_PROBE_CONCURRENCY = int(environ.get("STATUS_PROBE_CONCURRENCY", "4"))
+# instances a prober claims at once, other processes probe the next ones
+STATUS_PROBE_BATCH_SIZE = int(environ.get("STATUS_PROBE_BATCH_SIZE", "100"))
+# seconds a worker keeps the status of an instance read from MongoDB
+STATUS_CACHE_TTL = int(environ.get("STATUS_CACHE_TTL", "30"))
+
+# background probes of MongoDB, Keystone and Swift, served by /healthcheck?deep=1
+HEALTH_PROBE_ENABLED = environ.get("HEALTH_PROBE_ENABLED", True)
+HEALTH_PROBE_INTERVAL = int(environ.get("HEALTH_PROBE_INTERVAL", "10"))
+HEALTH_PROBE_JITTER = int(environ.get("HEALTH_PROBE_JITTER", "2"))
+HEALTH_PROBE_TIMEOUT = float(environ.get("HEALTH_PROBE_TIMEOUT", "5"))
+# probes kept to compute latency percentiles
+HEALTH_LATENCY_WINDOW = int(environ.get("HEALTH_LATENCY_WINDOW", "100"))
+# results older than this many seconds count as failing
+HEALTH_STALE_AFTER = int(environ.get("HEALTH_STALE_AFTER", "60"))
+
+# POST /resources answers that the service is deprecated
+SERVICE_DEPRECATED = environ.get("SERVICE_DEPRECATED", True)
+
+# background creation of instances, see swiftsuru/provisioning.py, off by
+# default and never started while SERVICE_DEPRECATED is set
+PROVISIONING_ENABLED = flag("PROVISIONING_ENABLED")
+PROVISIONING_WORKERS = int(environ.get("PROVISIONING_WORKERS", "2"))
+PROVISIONING_POLL_INTERVAL = int(environ.get("PROVISIONING_POLL_INTERVAL", "2"))
+PROVISIONING_POLL_JITTER = int(environ.get("PROVISIONING_POLL_JITTER", "1"))
+PROVISIONING_MAX_ATTEMPTS = int(environ.get("PROVISIONING_MAX_ATTEMPTS", "3"))
+# running jobs not updated for this many seconds are claimed again
+PROVISIONING_STALE_AFTER = int(environ.get("PROVISIONING_STALE_AFTER", "300"))
+# instances created ahead of time per plan, unless set on the plan itself,
+# off by default and never started while SERVICE_DEPRECATED is set
+WARM_POOL_ENABLED = flag("WARM_POOL_ENABLED")
+WARM_POOL_DEPTH = int(environ.get("WARM_POOL_DEPTH", "0"))
+WARM_POOL_CONCURRENCY = int(environ.get("WARM_POOL_CONCURRENCY", "2"))
+WARM_POOL_INTERVAL = int(environ.get("WARM_POOL_INTERVAL", "30"))
+WARM_POOL_JITTER = int(environ.get("WARM_POOL_JITTER", "10"))
+# slots left filling or claimed, and plans left being filled, for this many
+# seconds are dropped or released
+WARM_POOL_STALE_AFTER = int(environ.get("WARM_POOL_STALE_AFTER", "600"))
+
+# seconds a bind waits for its dependencies before the last
+# known good response of the instance is served instead
+BIND_LATENCY_BUDGET = float(environ.get("BIND_LATENCY_BUDGET", "2.0"))
+# threads running the independent steps of binds, per process
+BIND_WORKERS = int(environ.get("BIND_WORKERS", "8"))
+# threads refreshing cached binds past their latency budget, per process
+BIND_REFRESH_WORKERS = int(environ.get("BIND_REFRESH_WORKERS", "2"))
+
+# times a CORS header is written again when its registry changed meanwhile
+CORS_WRITE_ATTEMPTS = int(environ.get("CORS_WRITE_ATTEMPTS", "3"))
+# Swift refuses metadata values longer than max_meta_value_length
+CORS_MAX_HEADER_SIZE = int(environ.get("CORS_MAX_HEADER_SIZE", "256"))
+# schemes every bound host is allowed with
+CORS_SCHEMES = environ.get("CORS_SCHEMES", "http,https").split(",")
+
 # swift stuff needed to perform operations on it
 AUTH_URL = environ.get("SWIFT_AUTH_URL", "http://127.0.0.1:8080/auth/v1")
 USER = environ.get("SWIFT_USER", "test:tester")
@@ -26,10 +133,25 @@ KEY = environ.get("SWIFT_KEY", "testing")
 SWIFT_API = environ.get("SWIFT_API", "http://127.0.0.1:35357")
 SWIFT_API_HOST = SWIFT_API.split("://")[1].split(":")[0]
 SWIFT_API_PORT = SWIFT_API.split("://")[1].split(":")[1].split("/")[0]
+SWIFT_AUTH_CACHE_TTL = int(environ.get("SWIFT_AUTH_CACHE_TTL", "3600"))
+# idle keep-alive connections kept per storage URL
+SWIFT_POOL_MAX_SIZE = int(environ.get("SWIFT_POOL_MAX_SIZE", "10"))
+SWIFT_POOL_IDLE_TIMEOUT = int(environ.get("SWIFT_POOL_IDLE_TIMEOUT", "60"))
 
 # mongo settings
 MONGODB_ENDPOINT = environ.get("MONGODB_ENDPOINT", "127.0.0.1:27017")
 MONGODB_DATABASE = environ.get("MONGODB_DATABASE", "swiftsuru")
+MONGODB_MAX_POOL_SIZE = int(environ.get("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_CONNECT_TIMEOUT_MS = int(environ.get("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(environ.get("MONGODB_SOCKET_TIMEOUT_MS", "10000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(environ.get("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(environ.get("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGODB_COMMAND_METRICS = environ.get("MONGODB_COMMAND_METRICS", True)
+PLAN_CACHE_TTL = int(environ.get("PLAN_CACHE_TTL", "300"))
+# documents read per round trip when iterating over instances
+MONGODB_BATCH_SIZE = int(environ.get("MONGODB_BATCH_SIZE", "500"))
+# instances per page of GET /admin/instances
+ADMIN_LIST_LIMIT = int(environ.get("ADMIN_LIST_LIMIT", "1000"))
 
 # keystone settings
 KEYSTONE_URL = environ.get("KEYSTONE_URL", "https://127.0.0.1:5000/v2.0")
@@ -40,9 +162,35 @@ KEYSTONE_VERSION = 2
 KEYSTONE_PASSWORD = environ.get("KEYSTONE_PASSWORD", "password")
 KEYSTONE_DEFAULT_ROLE = "_member_"
 KEYSTONE_SSL_NO_VERIFY = environ.get("KEYSTONE_SSL_NO_VERIFY", True)
+# HTTP connections to Keystone shared by every tenant of a process
+KEYSTONE_POOL_CONNECTIONS = int(environ.get("KEYSTONE_POOL_CONNECTIONS", "4"))
+KEYSTONE_POOL_MAXSIZE = int(environ.get("KEYSTONE_POOL_MAXSIZE", "20"))
+KEYSTONE_POOL_BLOCK = environ.get("KEYSTONE_POOL_BLOCK", False)
+KEYSTONE_TIMEOUT = float(environ.get("KEYSTONE_TIMEOUT", "10"))
+# tokens are renewed this many seconds before they expire
+KEYSTONE_TOKEN_EXPIRY_MARGIN = int(environ.get("KEYSTONE_TOKEN_EXPIRY_MARGIN", "300"))
+# shares tokens between workers through the MongoDB "tokens" collection
+KEYSTONE_TOKEN_SHARED_CACHE = environ.get("KEYSTONE_TOKEN_SHARED_CACHE", False)
+# object-store endpoints parsed from the catalog, per tenant
+KEYSTONE_ENDPOINT_CACHE_TTL = int(environ.get("KEYSTONE_ENDPOINT_CACHE_TTL", "3600"))
+# background authentication of every tenant found on plans
+KEYSTONE_PREWARM_ENABLED = environ.get("KEYSTONE_PREWARM_ENABLED", True)
+KEYSTONE_PREWARM_INTERVAL = int(environ.get("KEYSTONE_PREWARM_INTERVAL", "60"))
+KEYSTONE_PREWARM_JITTER = int(environ.get("KEYSTONE_PREWARM_JITTER", "10"))
+KEYSTONE_PREWARM_MARGIN = int(environ.get("KEYSTONE_PREWARM_MARGIN", "900"))
+KEYSTONE_PREWARM_CONCURRENCY = int(environ.get("KEYSTONE_PREWARM_CONCURRENCY", "4"))
 
 # aclapi settings
 ACLAPI_URL = environ.get("ACLAPI_URL", "https://aclapi.com")
 ACLAPI_USER = environ.get("ACLAPI_USER", "thatsme")
 ACLAPI_PASS = environ.get("ACLAPI_PASS", "verysecurepass")
 ENABLE_ACLAPI = environ.get("ENABLE_ACLAPI", False)
+# seconds between commits of the queued permits
+ACLAPI_BATCH_INTERVAL = float(environ.get("ACLAPI_BATCH_INTERVAL", "1"))
+ACLAPI_DNS_CACHE_TTL = int(environ.get("ACLAPI_DNS_CACHE_TTL", "300"))
+# permits queued on MongoDB sent by each commit
+ACLAPI_BATCH_SIZE = int(environ.get("ACLAPI_BATCH_SIZE", "100"))
+# seconds after which permits being sent by a dead process are sent again
+ACLAPI_STALE_AFTER = int(environ.get("ACLAPI_STALE_AFTER", "300"))
+# seconds between reloads of the permits granted by other processes
+ACLAPI_GRANTED_RELOAD_INTERVAL = int(environ.get("ACLAPI_GRANTED_RELOAD_INTERVAL", "300"))
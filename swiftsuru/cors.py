@@ -0,0 +1,297 @@
+"""
+CORS origins of service instance containers.
+
+The hosts bound to each instance are registered on its MongoDB document
+(cors_hosts) and the container header is rendered from that set, so Swift
+is only written when the set actually changes.
+"""
+import threading
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.keystone_client import KeystoneClient
+from swiftsuru.swift_client import SwiftClient
+
+
+logger = utils.get_logger(__name__)
+
+# Origin allowing every other one on a CORS header
+ALL_ORIGINS = "*"
+
+
+class CorsHeaderTooLarge(Exception):
+
+    def __init__(self, container, size):
+        msg = "CORS header of <{}> would have {} bytes, above the limit of {}"
+        super(CorsHeaderTooLarge, self).__init__(msg.format(container, size, conf.CORS_MAX_HEADER_SIZE))
+        self.container = container
+        self.size = size
+
+
+def compact_hosts(hosts):
+    """
+    Dedupes and sorts hosts. Swift only matches exact origins or a bare
+    "*", so hosts are never collapsed into wildcard domains, and a header
+    above CORS_MAX_HEADER_SIZE raises CorsHeaderTooLarge instead.
+    """
+    return sorted(set(host.strip().lower() for host in hosts if host.strip()))
+
+
+def compact_origins(hosts, schemes=None):
+    """
+    Origins of every host with each of the schemes, CORS_SCHEMES by
+    default. ["https"] renders a single origin per host instead of an http
+    and an https one.
+    """
+    schemes = conf.CORS_SCHEMES if schemes is None else schemes
+    origins = []
+
+    for host in compact_hosts(hosts):
+        if host == ALL_ORIGINS:
+            origins.append(host)
+        else:
+            origins.extend("{}://{}".format(scheme, host) for scheme in schemes)
+
+    return origins
+
+
+def render_origins(hosts, schemes=None):
+    """
+    Header value allowing every host with each of the schemes.
+    """
+    return " ".join(compact_origins(hosts, schemes))
+
+
+def encoded_size(header_value):
+    return len(header_value.encode("utf-8"))
+
+
+def parse_hosts(header_value):
+    """
+    Hosts found on the origins of a CORS header value.
+    """
+    hosts = []
+
+    for origin in header_value.split():
+        # A bare "*" allows every origin and is kept as it is
+        host = origin.split("://", 1)[-1] if origin != ALL_ORIGINS else origin
+
+        if host and host not in hosts:
+            hosts.append(host)
+
+    return hosts
+
+
+class _Batch(object):
+    """
+    CORS changes of one container waiting to be written together.
+    """
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.operations = {}
+        self.requests = 0
+        self.done = threading.Event()
+        self.written = None
+        self.error = None
+
+    def merge(self, add, remove):
+        # The last change requested for a host wins
+        for host in add:
+            self.operations[host] = "add"
+
+        for host in remove:
+            self.operations[host] = "remove"
+
+        self.requests += 1
+
+    def apply(self):
+        add = sorted(host for host, op in self.operations.items() if op == "add")
+        remove = sorted(host for host, op in self.operations.items() if op == "remove")
+
+        try:
+            self.written = update_hosts(self.instance, add=add, remove=remove)
+        except Exception, err:
+            self.error = err
+        finally:
+            self.done.set()
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+
+        return self.written
+
+
+class WriteBatcher(object):
+    """
+    Coalesces CORS changes of the same container into a single registry
+    update and a single Swift write.
+
+    A change of a container with no write in flight is applied right away.
+    Changes requested while a write of the same container is in flight are
+    merged and applied together once it finishes; the first of them applies
+    the batch and the others wait for its result. Ordering across processes
+    comes from the registry versions, see update_hosts.
+    """
+
+    def __init__(self, stripes=64):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._write_locks = [threading.Lock() for _ in range(stripes)]
+
+    def submit(self, instance, add=(), remove=()):
+        container = instance.get("container")
+
+        with self._lock:
+            batch = self._pending.get(container)
+            leader = batch is None
+
+            if leader:
+                batch = self._pending[container] = _Batch(instance)
+
+            batch.merge(add, remove)
+
+        if not leader:
+            batch.done.wait()
+            return batch.result()
+
+        # Free unless a write of this container is in flight, changes
+        # requested meanwhile are merged into this batch
+        with self._write_locks[hash(container) % len(self._write_locks)]:
+            with self._lock:
+                del self._pending[container]
+
+            batch.apply()
+
+        metrics.incr("cors.batches")
+        metrics.incr("cors.coalesced_requests", batch.requests - 1)
+
+        return batch.result()
+
+
+batcher = WriteBatcher()
+
+
+def add_hosts(instance, hosts):
+    return batcher.submit(instance, add=hosts)
+
+
+def remove_hosts(instance, hosts):
+    return batcher.submit(instance, remove=hosts)
+
+
+def update_hosts(instance, add=(), remove=()):
+    """
+    Registers and unregisters hosts of an instance (a get_bind_info document)
+    and rewrites the container CORS header when the registered set changed,
+    or when the last write of the registry to Swift did not succeed.
+    Returns True when Swift was written.
+    """
+    name = instance.get("name")
+    container = instance.get("container")
+    add = list(add)
+    swift = None
+
+    try:
+        registered = instance.get("cors_hosts")
+
+        if registered is None:
+            # Instances bound before the registry existed: the hosts already
+            # on the container header are registered once
+            swift = _swift_client(instance)
+            registered = parse_hosts(swift.get_cors(container))
+            add.extend(registered)
+
+        # Refuses changes Swift would reject before touching the registry
+        expected = (set(registered) | set(add)) - set(remove)
+        check_size(container, render_origins(expected))
+
+        registry = _register(name, add, remove)
+
+        if registry is None:
+            registry = SwiftsuruDBClient().get_cors_registry(name)
+
+            if registry is None or _is_synced(registry):
+                metrics.incr("cors.unchanged")
+                logger.debug('CORS of <{}> unchanged'.format(container))
+                return False
+
+            # The registry changed but its Swift write failed, it is retried now
+            metrics.incr("cors.resynced")
+
+        swift = swift or _swift_client(instance)
+        _write_registry(swift, name, container, registry)
+        return True
+    except Exception:
+        # Connections that failed are not given back to the pool
+        swift = None
+        raise
+    finally:
+        if swift is not None:
+            swift.close()
+
+
+def _write_registry(swift, name, container, registry):
+    """
+    Writes the header rendered from registry, and writes again while other
+    processes changed the registry meanwhile, so a slower write of an older
+    version never stays on the container. The registry is marked as synced
+    only for the version last written.
+    """
+    db_cli = SwiftsuruDBClient()
+
+    for _ in range(conf.CORS_WRITE_ATTEMPTS):
+        version = registry.get("cors_version", 0)
+        header_value = render_origins(registry.get("cors_hosts") or [])
+        metrics.gauge("cors.header_size", encoded_size(header_value))
+
+        swift.write_cors(container, header_value)
+        metrics.incr("cors.writes")
+
+        latest = db_cli.get_cors_registry(name)
+
+        if latest is None or latest.get("cors_version", 0) == version:
+            db_cli.set_cors_synced(name, version)
+            return
+
+        metrics.incr("cors.rewrites")
+        registry = latest
+
+    # Left unsynced, the next change of the instance writes it again
+    logger.error('CORS registry of <{}> kept changing, header left unsynced'.format(container))
+
+
+def _is_synced(registry):
+    return registry.get("cors_synced_version", 0) >= registry.get("cors_version", 0)
+
+
+def check_size(container, header_value):
+    size = encoded_size(header_value)
+
+    if size > conf.CORS_MAX_HEADER_SIZE:
+        metrics.incr("cors.too_large")
+        raise CorsHeaderTooLarge(container, size)
+
+    return size
+
+
+def _register(name, add, remove):
+    """
+    Returns the registry after the update, or None if nothing changed.
+    """
+    db_cli = SwiftsuruDBClient()
+    registry = None
+
+    if add:
+        registry = db_cli.add_cors_hosts(name, add)
+
+    if remove:
+        removed = db_cli.remove_cors_hosts(name, remove)
+        registry = removed if removed is not None else registry
+
+    return registry
+
+
+def _swift_client(instance):
+    return SwiftClient(KeystoneClient(tenant=instance.get("tenant")))
@@ -1,9 +1,223 @@
 """
 Database client for Swiftsuru API
 """
+import os
+import threading
+
+from datetime import datetime
 
 import pymongo
-from swiftsuru import conf
+from bson import ObjectId
+from pymongo import monitoring
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.cache import TTLCache
+
+
+logger = utils.get_logger(__name__)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Plans change rarely, so every worker keeps them in memory for
+# PLAN_CACHE_TTL seconds. add_plan and remove_plan clear it.
+plan_cache = TTLCache(conf.PLAN_CACHE_TTL)
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    Records the duration and failures of every command sent to MongoDB
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        name = "mongodb.command.{}".format(event.command_name)
+        metrics.observe(name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        metrics.incr("mongodb.command.{}.failed".format(event.command_name))
+
+
+def get_connection():
+    """
+    Returns the MongoClient shared by every request of this process.
+
+    MongoClient keeps its own connection pool, which must not be shared
+    with forked children, so a new one is created whenever the pid changes.
+    """
+    global _client, _client_pid
+
+    pid = os.getpid()
+
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                listeners = []
+                if conf.MONGODB_COMMAND_METRICS:
+                    listeners.append(CommandMetricsListener())
+
+                _client = pymongo.MongoClient(
+                    conf.MONGODB_ENDPOINT,
+                    connect=False,
+                    maxPoolSize=conf.MONGODB_MAX_POOL_SIZE,
+                    connectTimeoutMS=conf.MONGODB_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=conf.MONGODB_SOCKET_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=conf.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                    waitQueueTimeoutMS=conf.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                    event_listeners=listeners)
+                _client_pid = pid
+
+    return _client
+
+
+def bootstrap():
+    """
+    Creates the indexes used by SwiftsuruDBClient queries and flags legacy
+    instances as live. Meant to run once when the API starts, not on every
+    request.
+
+    An index that fails to build is logged and the others are still built.
+    Reads skip instances without the "deleted" field, so a failure to flag
+    them stops the start instead.
+    """
+    db_cli = SwiftsuruDBClient()
+
+    for index, err in sorted(db_cli.ensure_indexes(background=True).items()):
+        logger.error("Fail to create MongoDB index {}: {}".format(index, err))
+
+    db_cli.mark_live_instances()
+
+
+# Fields of an instance document needed to answer a bind
+BIND_FIELDS = {"_id": 0, "name": 1, "container": 1, "plan": 1, "tenant": 1,
+               "endpoints": 1, "user": 1, "password": 1, "cors_hosts": 1}
+
+
+# Fields of the CORS registry of an instance, see swiftsuru/cors.py
+CORS_FIELDS = {"cors_hosts": 1, "cors_version": 1, "cors_synced_version": 1}
+
+
+# Fields of an instance document listed to admins, credentials left out
+LIST_FIELDS = {"_id": 0, "name": 1, "team": 1, "plan": 1, "container": 1,
+               "tenant": 1, "deleted": 1}
+
+
+ASC = pymongo.ASCENDING
+
+# Every index of the database: (collection, keys, options). Built by
+# bootstrap and by "python -m swiftsuru.manage build-indexes".
+INDEXES = [
+    ("plans", [("name", ASC)], {"unique": True}),
+    # Also serves reads of live instances by name, a partial index on the
+    # same keys would conflict with it
+    ("instances", [("name", ASC)], {"unique": True}),
+    # Reads skip deleted instances, which stay out of these indexes
+    ("instances", [("plan", ASC), ("name", ASC)], {"name": "plan_name_live",
+                                                   "partialFilterExpression": {"deleted": False}}),
+    ("instances", [("tenant", ASC)], {"name": "tenant_live",
+                                      "partialFilterExpression": {"deleted": False}}),
+    ("instances", [("deleted", ASC), ("deleted_at", ASC)], {}),
+    ("instances", [("container", ASC)], {}),
+    # Instances claimed by the status prober and the usage sweeper of one
+    # process at a time
+    ("instances", [("status_probed_at", ASC)], {"name": "status_probed_at_live",
+                                                "partialFilterExpression": {"deleted": False}}),
+    ("instances", [("usage_swept_at", ASC)], {"name": "usage_swept_at_live",
+                                              "partialFilterExpression": {"deleted": False}}),
+    # MongoDB removes tokens as soon as they expire
+    ("tokens", [("expires", ASC)], {"expireAfterSeconds": 0}),
+    ("jobs", [("status", ASC), ("created_at", ASC)], {}),
+    ("jobs", [("name", ASC), ("created_at", ASC)], {}),
+    ("warm_instances", [("plan", ASC), ("status", ASC)], {}),
+    ("warm_instances", [("status", ASC), ("created_at", ASC)], {}),
+    ("acl_permits", [("status", ASC), ("queued_at", ASC)], {}),
+]
+
+# Shape of every query sent by SwiftsuruDBClient: (method, collection,
+# query, sort). Updates, removes and counts are planned like a find with
+# the same query. "python -m swiftsuru.manage check-indexes" explains each
+# of them and fails on collection scans.
+QUERIES = [
+    ("list_plans", "plans", {}, [("name", ASC)]),
+    ("get_plan", "plans", {"name": "plan"}, None),
+    ("remove_plan", "plans", {"name": "plan"}, None),
+    ("iter_instances", "instances", {"deleted": False}, [("name", ASC)]),
+    ("iter_instances", "instances", {"deleted": False, "name": {"$gt": "marker"}}, [("name", ASC)]),
+    ("iter_instances", "instances", {"deleted": False, "plan": "plan"}, [("name", ASC)]),
+    ("iter_instances", "instances", {}, [("name", ASC)]),
+    ("get_instance", "instances", {"name": "instance", "deleted": False}, None),
+    ("get_instance", "instances", {"name": "instance"}, None),
+    ("get_bind_info", "instances", {"name": "instance", "deleted": False}, None),
+    # $match of the $lookup pipeline
+    ("_lookup_bind_info", "instances", {"name": "instance", "deleted": False}, None),
+    ("list_instances_without_location", "instances", {"tenant": None, "deleted": False}, None),
+    ("set_instance_location", "instances", {"name": "instance"}, None),
+    ("add_cors_hosts", "instances", {"name": "instance", "$or": [{"cors_hosts": {"$nin": ["host"]}}]}, None),
+    ("remove_cors_hosts", "instances", {"name": "instance", "cors_hosts": {"$in": ["host"]}}, None),
+    ("get_cors_registry", "instances", {"name": "instance", "deleted": False}, None),
+    ("set_cors_synced", "instances", {"name": "instance", "cors_version": 1}, None),
+    ("remove_instance", "instances", {"name": "instance", "deleted": False}, None),
+    ("set_instance_usage", "instances", {"name": "instance", "deleted": False}, None),
+    ("get_instance_usage", "instances", {"name": "instance", "deleted": False}, None),
+    ("set_instance_status", "instances", {"name": "instance", "deleted": False}, None),
+    ("get_instance_status", "instances", {"name": "instance", "deleted": False}, None),
+    ("claim_instances", "instances",
+     {"deleted": False,
+      "$or": [{"status_probed_at": None}, {"status_probed_at": {"$lt": datetime(2000, 1, 1)}}]},
+     [("status_probed_at", ASC)]),
+    ("claim_instances", "instances",
+     {"deleted": False,
+      "$or": [{"usage_swept_at": None}, {"usage_swept_at": {"$lt": datetime(2000, 1, 1)}}]},
+     [("usage_swept_at", ASC)]),
+    ("mark_live_instances", "instances", {"deleted": {"$exists": False}}, None),
+    ("claim_deleted_instance", "instances",
+     {"deleted": True, "deleted_at": {"$exists": True, "$lt": datetime(2000, 1, 1)},
+      "$or": [{"reaping_at": None}, {"reaping_at": {"$lt": datetime(2000, 1, 1)}}]},
+     [("deleted_at", ASC)]),
+    ("add_reap_step", "instances", {"_id": ObjectId()}, None),
+    ("archive_instance", "instances", {"_id": ObjectId()}, None),
+    ("archive_instance", "instance_names", {"_id": "instance", "container": "container"}, None),
+    ("reserve_instance_name", "instance_names", {"_id": "instance"}, None),
+    ("release_instance_name", "instance_names", {"_id": "instance", "container": "container"}, None),
+    ("get_token", "tokens", {"_id": "token"}, None),
+    ("save_token", "tokens", {"_id": "token"}, None),
+    ("remove_token", "tokens", {"_id": "token"}, None),
+    ("get_job", "jobs", {"name": "instance"}, [("created_at", pymongo.DESCENDING)]),
+    ("claim_job", "jobs",
+     {"$or": [{"status": "pending"},
+              {"status": "running", "updated_at": {"$lt": datetime(2000, 1, 1)}}]},
+     [("created_at", ASC), ("_id", ASC)]),
+    ("add_job_step", "jobs", {"_id": ObjectId()}, None),
+    ("set_job_status", "jobs", {"_id": ObjectId()}, None),
+    ("count_warm_instances", "warm_instances",
+     {"plan": "plan", "status": {"$in": ["filling", "ready"]}, "_id": {"$lt": ObjectId()}}, None),
+    ("fill_warm_instance", "warm_instances", {"_id": ObjectId()}, None),
+    ("claim_warm_instance", "warm_instances", {"plan": "plan", "status": "ready"}, [("_id", ASC)]),
+    ("remove_warm_instance", "warm_instances", {"_id": ObjectId()}, None),
+    ("claim_warm_pool", "plans",
+     {"name": "plan",
+      "$or": [{"warm_pool_filling_until": None},
+              {"warm_pool_filling_until": {"$lt": datetime(2000, 1, 1)}}]}, None),
+    ("release_warm_pool", "plans", {"name": "plan"}, None),
+    ("remove_stale_warm_instances", "warm_instances",
+     {"status": "filling", "created_at": {"$lt": datetime(2000, 1, 1)}}, None),
+    ("release_warm_instance", "warm_instances", {"_id": ObjectId(), "status": "claimed"}, None),
+    ("list_stale_claimed_warm_instances", "warm_instances",
+     {"status": "claimed", "claimed_at": {"$lt": datetime(2000, 1, 1)}}, None),
+    ("get_instance_by_container", "instances", {"container": "container"}, None),
+    ("list_acl_permits", "acl_permits", {"status": {"$nin": ["pending", "sending"]}}, [("_id", ASC)]),
+    ("queue_acl_permit", "acl_permits", {"_id": "permit"}, None),
+    ("claim_acl_permits", "acl_permits",
+     {"$or": [{"status": "pending"},
+              {"status": "sending", "sending_at": {"$lt": datetime(2000, 1, 1)}}]},
+     [("queued_at", ASC)]),
+    ("release_acl_permits", "acl_permits", {"_id": {"$in": ["permit"]}, "status": "sending"}, None),
+    ("add_acl_permit", "acl_permits", {"_id": "permit"}, None),
+]
 
 
 class SwiftsuruDBClient(object):
@@ -12,53 +226,537 @@ class SwiftsuruDBClient(object):
     """
 
     def __init__(self):
-        self._db = self.set_database()
-        self._db.plans.ensure_index("name", unique=True)
-        self._db.instances.ensure_index("name", unique=True)
+        metrics.incr("mongodb.checkouts")
+
+        with metrics.timer("mongodb.checkout"):
+            self._db = self.set_database()
+
+    def ensure_indexes(self, background=False):
+        """
+        Creates every index of INDEXES, going on when one of them fails.
+        Returns the errors by index name.
+        """
+        errors = {}
+
+        for collection, keys, options in INDEXES:
+            try:
+                self._db[collection].ensure_index(keys, background=background, **options)
+            except PyMongoError, err:
+                name = options.get("name") or "_".join("{}_{}".format(key, order) for key, order in keys)
+                errors["{}.{}".format(collection, name)] = err
+
+        return errors
+
+    def query_plan(self, collection, query, sort=None):
+        """
+        Winning plan chosen by MongoDB for a query, from explain().
+        """
+        cursor = self._db[collection].find(query)
+
+        if sort:
+            cursor = cursor.sort(sort)
+
+        return cursor.explain()["queryPlanner"]["winningPlan"]
 
     def set_connection(self):
-        return pymongo.MongoClient(conf.MONGODB_ENDPOINT)
+        return get_connection()
 
     def set_database(self):
         conn = self.set_connection()
         return conn[conf.MONGODB_DATABASE]
 
     def list_plans(self):
-        plans = self._db.plans.find().sort("name", pymongo.ASCENDING)
-        return [plan for plan in plans]
+        plans = plan_cache.get("plans")
+
+        if plans is None:
+            plans = self._db.plans.find().sort("name", pymongo.ASCENDING)
+            plans = [plan for plan in plans]
+            plan_cache.set("plans", plans)
+
+        return list(plans)
 
     def get_plan(self, name):
-        return self._db.plans.find_one({"name": name})
+        plan = plan_cache.get(("plan", name))
+
+        if plan is None:
+            plan = self._db.plans.find_one({"name": name})
+
+            if plan is not None:
+                plan_cache.set(("plan", name), plan)
+
+        return plan
 
     def add_plan(self, name, tenant, desc):
+        plan_cache.clear()
         return self._db.plans.insert({"name": name,
                                       "tenant": tenant,
                                       "description": desc})
 
     def remove_plan(self, name):
+        plan_cache.clear()
         self._db.plans.remove({"name": name})
 
     def list_instances(self):
-        instances = self._db.instances.find().sort("name", pymongo.ASCENDING)
-        return [instance for instance in instances]
+        return list(self.iter_instances(fields=None))
+
+    def iter_instances(self, plan=None, marker=None, limit=None,
+                       fields=LIST_FIELDS, batch_size=None, include_deleted=False):
+        """
+        Yields instances sorted by name, read from MongoDB in batches of
+        batch_size documents. Only instances named after marker are yielded.
+        """
+        query = {}
 
-    def get_instance(self, name):
-        return self._db.instances.find_one({"name": name})
+        if not include_deleted:
+            query["deleted"] = False
+
+        if plan:
+            query["plan"] = plan
+
+        if marker:
+            query["name"] = {"$gt": marker}
+
+        batch_size = batch_size or conf.MONGODB_BATCH_SIZE
+        cursor = self._db.instances.find(query, fields, batch_size=batch_size)
+        cursor = cursor.sort("name", pymongo.ASCENDING)
+
+        if limit:
+            cursor = cursor.limit(limit)
+
+        for instance in cursor:
+            yield instance
+
+    def get_instance(self, name, include_deleted=False):
+        """
+        Deleted instances are only found with include_deleted, until the
+        reaper archives them.
+        """
+        query = {"name": name}
+
+        if not include_deleted:
+            query["deleted"] = False
+
+        return self._db.instances.find_one(query)
 
     def get_instances_by_plan(self, plan):
-        instances = self._db.instances.find({"plan": plan}).sort("name", pymongo.ASCENDING)
-        return [instance for instance in instances]
+        return list(self.iter_instances(plan=plan, fields=None))
 
-    def add_instance(self, name, team, container, plan, user, password):
+    def add_instance(self, name, team, container, plan, user, password,
+                     tenant=None, endpoints=None):
+        """
+        Tenant and storage endpoints are copied into the instance, so a bind
+        can be answered with a single read.
+        """
         return self._db.instances.insert({"name": name,
                                           "team": team,
                                           "container": container,
                                           "plan": plan,
                                           "user": user,
-                                          "password": password})
+                                          "password": password,
+                                          "tenant": tenant,
+                                          "endpoints": endpoints,
+                                          "deleted": False})
+
+    def get_bind_info(self, name):
+        """
+        Returns the instance fields needed by a bind, including its tenant.
+        Instances created before tenant and endpoints were stored on them
+        get the tenant from the plans collection through a $lookup.
+        """
+        instance = self._db.instances.find_one({"name": name, "deleted": False}, BIND_FIELDS)
+
+        if instance and not instance.get("tenant"):
+            return self._lookup_bind_info(name)
+
+        return instance
+
+    def _lookup_bind_info(self, name):
+        fields = dict((field, 1) for field in BIND_FIELDS if field != "_id")
+        fields.update({"_id": 0, "tenant": {"$arrayElemAt": ["$plan_docs.tenant", 0]}})
+
+        pipeline = [
+            {"$match": {"name": name, "deleted": False}},
+            {"$limit": 1},
+            {"$lookup": {"from": "plans",
+                         "localField": "plan",
+                         "foreignField": "name",
+                         "as": "plan_docs"}},
+            {"$project": fields}
+        ]
+
+        for instance in self._db.instances.aggregate(pipeline):
+            return instance
+
+    def list_instances_without_location(self):
+        instances = self._db.instances.find({"tenant": None, "deleted": False}, {"name": 1, "plan": 1})
+        return [instance for instance in instances]
+
+    def set_instance_location(self, name, tenant, endpoints):
+        self._db.instances.update({"name": name},
+                                  {"$set": {"tenant": tenant,
+                                            "endpoints": endpoints}})
+
+    def add_cors_hosts(self, name, hosts):
+        """
+        Adds hosts to the CORS registry of an instance, bumping its version.
+        Returns the registry (cors_hosts and cors_version), or None when all
+        of them were already there.
+        """
+        missing = [{"cors_hosts": {"$nin": [host]}} for host in hosts]
+        return self._db.instances.find_and_modify(
+            {"name": name, "$or": missing},
+            {"$addToSet": {"cors_hosts": {"$each": list(hosts)}},
+             "$inc": {"cors_version": 1}},
+            fields=CORS_FIELDS,
+            new=True)
+
+    def remove_cors_hosts(self, name, hosts):
+        """
+        Removes hosts from the CORS registry of an instance, bumping its
+        version. Returns the registry, or None when none of them was there.
+        """
+        return self._db.instances.find_and_modify(
+            {"name": name, "cors_hosts": {"$in": list(hosts)}},
+            {"$pullAll": {"cors_hosts": list(hosts)},
+             "$inc": {"cors_version": 1}},
+            fields=CORS_FIELDS,
+            new=True)
+
+    def get_cors_registry(self, name):
+        return self._db.instances.find_one({"name": name, "deleted": False}, CORS_FIELDS)
+
+    def set_cors_synced(self, name, version):
+        """
+        Records that the container header was written from version of the
+        registry. Ignored when the registry moved on meanwhile.
+        """
+        self._db.instances.update({"name": name, "cors_version": version},
+                                  {"$set": {"cors_synced_version": version}})
 
     def remove_instance(self, name):
         """
-        We're setting the field/flag "deleted" and won't remove the instance yet
+        We're setting the field/flag "deleted" and won't remove the instance yet,
+        its containers and user are removed later by swiftsuru/reaper.py
         """
-        self._db.instances.update({"name": name}, {"$set": {"deleted": True}})
+        self._db.instances.update({"name": name, "deleted": False},
+                                  {"$set": {"deleted": True,
+                                            "deleted_at": datetime.utcnow()}})
+
+    def set_instance_usage(self, name, usage):
+        self._db.instances.update({"name": name, "deleted": False},
+                                  {"$set": {"usage": usage}})
+
+    def get_instance_usage(self, name):
+        """
+        Usage stored by swiftsuru/usage.py. Returns None for unknown instances
+        and an empty dict for instances not measured yet.
+        """
+        instance = self._db.instances.find_one({"name": name, "deleted": False},
+                                               {"_id": 0, "usage": 1})
+
+        if instance is None:
+            return None
+
+        return instance.get("usage", {})
+
+    def set_instance_status(self, name, status):
+        self._db.instances.update({"name": name, "deleted": False},
+                                  {"$set": {"status": status}})
+
+    def claim_instances(self, field, before, limit, fields=None):
+        """
+        Atomically takes up to limit live instances whose `field` is unset
+        or older than before, setting it to now so the background tasks of
+        other processes skip them. The oldest ones are taken first.
+        """
+        now = datetime.utcnow()
+        instances = []
+
+        for _ in range(limit):
+            instance = self._db.instances.find_and_modify(
+                {"deleted": False,
+                 "$or": [{field: None}, {field: {"$lt": before}}]},
+                {"$set": {field: now}},
+                fields=fields,
+                sort=[(field, pymongo.ASCENDING)],
+                new=True)
+
+            if instance is None:
+                break
+
+            instances.append(instance)
+
+        return instances
+
+    def get_instance_status(self, name):
+        """
+        Status stored by swiftsuru/status.py. Returns None for unknown
+        instances and an empty dict for instances not probed yet.
+        """
+        instance = self._db.instances.find_one({"name": name, "deleted": False},
+                                               {"_id": 0, "status": 1})
+
+        if instance is None:
+            return None
+
+        return instance.get("status", {})
+
+    def mark_live_instances(self):
+        """
+        Flags instances created before the "deleted" field was always written.
+        """
+        self._db.instances.update({"deleted": {"$exists": False}},
+                                  {"$set": {"deleted": False}},
+                                  multi=True)
+
+    def claim_deleted_instance(self, stale_before, deleted_before):
+        """
+        Takes an instance deleted before deleted_before to be reaped.
+        Instances taken before stale_before by a reaper that never finished
+        are taken again. Instances deleted before deleted_at was recorded
+        are never taken.
+        """
+        return self._db.instances.find_and_modify(
+            {"deleted": True,
+             "deleted_at": {"$exists": True, "$lt": deleted_before},
+             "$or": [{"reaping_at": None},
+                     {"reaping_at": {"$lt": stale_before}}]},
+            {"$set": {"reaping_at": datetime.utcnow()}},
+            sort=[("deleted_at", pymongo.ASCENDING)],
+            new=True)
+
+    def add_reap_step(self, instance_id, step):
+        self._db.instances.update({"_id": instance_id},
+                                  {"$addToSet": {"reap_steps": step},
+                                   "$set": {"reaping_at": datetime.utcnow()}})
+
+    def archive_instance(self, instance):
+        """
+        Moves a reaped instance, without its password, out of the instances
+        collection.
+        """
+        archived = dict((key, value) for key, value in instance.items() if key != "password")
+        archived["reaped_at"] = datetime.utcnow()
+
+        self._db.reaped_instances.insert(archived)
+        self._db.instances.remove({"_id": instance["_id"]})
+        self.release_instance_name(instance["name"], instance.get("container"))
+
+    def reserve_instance_name(self, name, container):
+        """
+        Reserves the name of an instance for the job creating `container`,
+        until the instance is reaped. Returns the container holding the
+        name, which is another one when a job took it first.
+        """
+        try:
+            self._db.instance_names.insert({"_id": name,
+                                            "container": container,
+                                            "reserved_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            pass
+
+        return self._db.instance_names.find_one({"_id": name})["container"]
+
+    def release_instance_name(self, name, container):
+        self._db.instance_names.remove({"_id": name, "container": container})
+
+    def get_token(self, key):
+        return self._db.tokens.find_one({"_id": key})
+
+    def save_token(self, key, auth_ref, expires):
+        self._db.tokens.update({"_id": key},
+                               {"$set": {"auth_ref": auth_ref,
+                                         "expires": expires}},
+                               upsert=True)
+
+    def remove_token(self, key):
+        self._db.tokens.remove({"_id": key})
+
+    def add_job(self, kind, name, params):
+        now = datetime.utcnow()
+        return self._db.jobs.insert({"kind": kind,
+                                     "name": name,
+                                     "params": params,
+                                     "status": "pending",
+                                     "steps": [],
+                                     "attempts": 0,
+                                     "error": None,
+                                     "created_at": now,
+                                     "updated_at": now})
+
+    def get_job(self, name):
+        """
+        Latest job of an instance.
+        """
+        jobs = self._db.jobs.find({"name": name}).sort("created_at", pymongo.DESCENDING).limit(1)
+
+        for job in jobs:
+            return job
+
+    def claim_job(self, stale_before):
+        """
+        Marks the oldest pending job as running and returns it. Jobs left
+        running since before stale_before belong to dead workers and are
+        claimed again.
+        """
+        return self._db.jobs.find_and_modify(
+            {"$or": [{"status": "pending"},
+                     {"status": "running", "updated_at": {"$lt": stale_before}}]},
+            {"$set": {"status": "running", "updated_at": datetime.utcnow()},
+             "$inc": {"attempts": 1}},
+            sort=[("created_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            new=True)
+
+    def add_job_step(self, job_id, step):
+        self._db.jobs.update({"_id": job_id},
+                             {"$addToSet": {"steps": step},
+                              "$set": {"updated_at": datetime.utcnow()}})
+
+    def set_job_status(self, job_id, status, error=None):
+        self._db.jobs.update({"_id": job_id},
+                             {"$set": {"status": status,
+                                       "error": error,
+                                       "updated_at": datetime.utcnow()}})
+
+    def reserve_warm_instance(self, plan, tenant):
+        """
+        Takes a slot on the warm pool of a plan, filled later with
+        fill_warm_instance. Returns the id of the slot.
+        """
+        return self._db.warm_instances.insert({"plan": plan,
+                                               "tenant": tenant,
+                                               "status": "filling",
+                                               "created_at": datetime.utcnow()})
+
+    def count_warm_instances(self, plan, before=None):
+        """
+        Slots of the warm pool of a plan, ready or being filled. With
+        before, only the slots taken before that id are counted.
+        """
+        query = {"plan": plan, "status": {"$in": ["filling", "ready"]}}
+
+        if before is not None:
+            query["_id"] = {"$lt": before}
+
+        return self._db.warm_instances.find(query).count()
+
+    def fill_warm_instance(self, slot_id, user, password, container, endpoints):
+        self._db.warm_instances.update({"_id": slot_id},
+                                       {"$set": {"status": "ready",
+                                                 "user": user,
+                                                 "password": password,
+                                                 "container": container,
+                                                 "endpoints": endpoints}})
+
+    def claim_warm_instance(self, plan):
+        """
+        Atomically takes the oldest ready instance of the warm pool of a plan.
+        """
+        return self._db.warm_instances.find_and_modify(
+            {"plan": plan, "status": "ready"},
+            {"$set": {"status": "claimed", "claimed_at": datetime.utcnow()}},
+            sort=[("_id", pymongo.ASCENDING)],
+            new=True)
+
+    def claim_warm_pool(self, plan, until):
+        """
+        Atomically takes the filling of the warm pool of a plan until
+        `until`, unless another process holds it. Returns whether it was taken.
+        """
+        now = datetime.utcnow()
+        claimed = self._db.plans.find_and_modify(
+            {"name": plan,
+             "$or": [{"warm_pool_filling_until": None},
+                     {"warm_pool_filling_until": {"$lt": now}}]},
+            {"$set": {"warm_pool_filling_until": until}},
+            fields={"name": 1})
+
+        return claimed is not None
+
+    def release_warm_pool(self, plan):
+        self._db.plans.update({"name": plan},
+                              {"$unset": {"warm_pool_filling_until": ""}})
+
+    def remove_warm_instance(self, slot_id):
+        self._db.warm_instances.remove({"_id": slot_id})
+
+    def remove_stale_warm_instances(self, before):
+        """
+        Drops slots left filling by processes that died before finishing.
+        """
+        self._db.warm_instances.remove({"status": "filling", "created_at": {"$lt": before}})
+
+    def release_warm_instance(self, slot_id):
+        """
+        Gives a claimed slot back to the warm pool.
+        """
+        self._db.warm_instances.update({"_id": slot_id, "status": "claimed"},
+                                       {"$set": {"status": "ready"},
+                                        "$unset": {"claimed_at": ""}})
+
+    def list_stale_claimed_warm_instances(self, before):
+        """
+        Slots claimed before `before` and never removed, left by requests
+        that failed after claiming them.
+        """
+        return list(self._db.warm_instances.find({"status": "claimed", "claimed_at": {"$lt": before}}))
+
+    def get_instance_by_container(self, container):
+        return self._db.instances.find_one({"container": container}, {"name": 1})
+
+    def list_acl_permits(self):
+        """
+        Keys of the ACL API permits already granted.
+        """
+        # Permits granted before they were queued on MongoDB have no status
+        permits = self._db.acl_permits.find({"status": {"$nin": ["pending", "sending"]}},
+                                            {"_id": 1}).sort("_id", pymongo.ASCENDING)
+        return [permit["_id"] for permit in permits]
+
+    def queue_acl_permit(self, key, permit):
+        """
+        Queues a permit to be sent by the PermitWorker of any process.
+        Permits already queued or granted are left untouched.
+        """
+        try:
+            self._db.acl_permits.insert(dict(permit, _id=key, status="pending",
+                                             queued_at=datetime.utcnow()))
+        except DuplicateKeyError:
+            pass
+
+    def claim_acl_permits(self, stale_before, limit):
+        """
+        Atomically takes up to limit queued permits, oldest first. Permits
+        being sent since before stale_before belong to dead processes and
+        are taken again.
+        """
+        permits = []
+
+        for _ in range(limit):
+            permit = self._db.acl_permits.find_and_modify(
+                {"$or": [{"status": "pending"},
+                         {"status": "sending", "sending_at": {"$lt": stale_before}}]},
+                {"$set": {"status": "sending", "sending_at": datetime.utcnow()}},
+                sort=[("queued_at", pymongo.ASCENDING)],
+                new=True)
+
+            if permit is None:
+                break
+
+            permits.append(permit)
+
+        return permits
+
+    def release_acl_permits(self, keys):
+        """
+        Queues again permits taken by claim_acl_permits and not granted.
+        """
+        self._db.acl_permits.update({"_id": {"$in": keys}, "status": "sending"},
+                                    {"$set": {"status": "pending"}},
+                                    multi=True)
+
+    def add_acl_permit(self, key):
+        self._db.acl_permits.update({"_id": key},
+                                    {"$set": {"status": "granted",
+                                              "granted_at": datetime.utcnow()}},
+                                    upsert=True)
@@ -0,0 +1,169 @@
+"""
+Health of the dependencies of this API process, served by
+/healthcheck?deep=1.
+
+MongoDB, Keystone and Swift are probed in background through the same
+connection pools used by requests, so a broken pool in a worker shows up
+in that worker's healthcheck. Healthchecks only read the last results.
+"""
+import threading
+import time
+
+from collections import deque
+from datetime import datetime
+
+from swiftsuru import conf, dbclient, keystone_client, metrics, utils
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.keystone_client import KeystoneClient
+from swiftsuru.scheduler import PeriodicTask
+from swiftsuru.swift_client import SwiftClient
+
+
+logger = utils.get_logger(__name__)
+
+OK = "ok"
+FAILING = "failing"
+UNKNOWN = "unknown"
+
+
+class LatencyWindow(object):
+    """
+    Latencies of the last `size` probes of a dependency.
+    """
+
+    def __init__(self, size):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, percent):
+        if not self._samples:
+            return None
+
+        samples = sorted(self._samples)
+        index = int(round(percent / 100.0 * len(samples))) - 1
+
+        return samples[max(0, min(index, len(samples) - 1))]
+
+
+_lock = threading.Lock()
+_results = {}
+_latencies = {}
+
+
+def record(name, seconds, error=None):
+    with _lock:
+        window = _latencies.setdefault(name, LatencyWindow(conf.HEALTH_LATENCY_WINDOW))
+        window.add(seconds)
+
+        _results[name] = {"status": FAILING if error else OK,
+                          "error": error,
+                          "checked_at": time.time(),
+                          "latency": {"last": seconds,
+                                      "p50": window.percentile(50),
+                                      "p99": window.percentile(99)}}
+
+
+def report():
+    """
+    Last result of every dependency. A result older than
+    HEALTH_STALE_AFTER seconds means the prober stopped and counts as failing.
+    """
+    stale_before = time.time() - conf.HEALTH_STALE_AFTER
+    dependencies = {}
+
+    with _lock:
+        for name in PROBES:
+            result = _results.get(name)
+
+            if result is None:
+                dependencies[name] = {"status": UNKNOWN}
+                continue
+
+            result = dict(result, checked_at=datetime.utcfromtimestamp(result["checked_at"]).isoformat())
+
+            if _results[name]["checked_at"] < stale_before:
+                result["status"] = FAILING
+                result["error"] = "Not probed since {}".format(result["checked_at"])
+
+            dependencies[name] = result
+
+    statuses = set(dependency["status"] for dependency in dependencies.values())
+
+    if FAILING in statuses:
+        status = FAILING
+    elif UNKNOWN in statuses:
+        status = UNKNOWN
+    else:
+        status = OK
+
+    return {"status": status, "dependencies": dependencies}
+
+
+def reset():
+    with _lock:
+        _results.clear()
+        _latencies.clear()
+
+
+def probe_mongodb():
+    dbclient.get_connection().admin.command("ping")
+
+
+def probe_keystone():
+    response = keystone_client.get_http_session().get(conf.KEYSTONE_URL,
+                                                      verify=not conf.KEYSTONE_SSL_NO_VERIFY,
+                                                      timeout=conf.HEALTH_PROBE_TIMEOUT)
+
+    if response.status_code >= 500:
+        raise Exception("Keystone answered {}".format(response.status_code))
+
+
+def probe_swift():
+    plans = SwiftsuruDBClient().list_plans()
+    tenants = sorted(set(plan.get("tenant") for plan in plans if plan.get("tenant")))
+
+    if not tenants:
+        raise Exception("No plan with a tenant to probe Swift with")
+
+    with SwiftClient(KeystoneClient(tenant=tenants[0])) as client:
+        client.conn.head_account()
+
+
+PROBES = {
+    "mongodb": probe_mongodb,
+    "keystone": probe_keystone,
+    "swift": probe_swift,
+}
+
+
+class HealthProber(PeriodicTask):
+    """
+    Probes every dependency each HEALTH_PROBE_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        super(HealthProber, self).__init__(conf.HEALTH_PROBE_INTERVAL,
+                                           conf.HEALTH_PROBE_JITTER)
+
+    def run_once(self):
+        for name in sorted(PROBES):
+            self.probe(name)
+
+    def probe(self, name):
+        start = time.time()
+
+        try:
+            PROBES[name]()
+        except Exception, err:
+            seconds = time.time() - start
+            metrics.incr("health.{}.failed".format(name))
+            logger.error("Health probe of {} failed: {}".format(name, err))
+
+            record(name, seconds, str(err) or err.__class__.__name__)
+            return
+
+        seconds = time.time() - start
+        metrics.observe("health.{}".format(name), seconds)
+        record(name, seconds)
@@ -1,7 +1,17 @@
 # -*- coding:utf-8 -*-
+import json
+import os
 import re
+import threading
 
-from swiftsuru import conf
+import requests
+from keystoneclient import access
+from keystoneclient import session as client_session
+from keystoneclient.exceptions import NotFound
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.cache import TTLCache
+from swiftsuru.dbclient import SwiftsuruDBClient
 # import logging
 
 # Mapping of V3 Catalog Endpoint_type to V2 Catalog Interfaces
@@ -18,27 +28,196 @@ else:
 
 
 # log = logging.getLogger(__name__)
+logger = utils.get_logger(__name__)
+
+
+class TokenCache(object):
+    """
+    Keeps Keystone tokens (auth_ref) keyed by (tenant, user, auth_url) and
+    hands them out until KEYSTONE_TOKEN_EXPIRY_MARGIN seconds before they
+    expire.
+
+    With KEYSTONE_TOKEN_SHARED_CACHE enabled, tokens are also stored on the
+    MongoDB "tokens" collection, so all workers reuse one token per tenant.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            auth_ref = self._tokens.get(key)
+
+        if auth_ref is not None and self._is_valid(auth_ref):
+            metrics.incr("keystone.token_cache.hit")
+            return auth_ref
+
+        if conf.KEYSTONE_TOKEN_SHARED_CACHE:
+            shared_auth_ref = self._get_shared(key)
+
+            if shared_auth_ref is not None:
+                metrics.incr("keystone.token_cache.shared_hit")
+
+                with self._lock:
+                    self._tokens[key] = shared_auth_ref
+
+                return shared_auth_ref
+
+        if auth_ref is not None:
+            metrics.incr("keystone.token_cache.refresh")
+        else:
+            metrics.incr("keystone.token_cache.miss")
+
+    def set(self, key, auth_ref):
+        with self._lock:
+            self._tokens[key] = auth_ref
+
+        if conf.KEYSTONE_TOKEN_SHARED_CACHE:
+            try:
+                SwiftsuruDBClient().save_token(self._shared_key(key),
+                                               json.dumps(auth_ref),
+                                               auth_ref.expires)
+            except Exception, err:
+                logger.error("Fail to share Keystone token: {}".format(err))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._tokens.pop(key, None)
+
+        if conf.KEYSTONE_TOKEN_SHARED_CACHE:
+            try:
+                SwiftsuruDBClient().remove_token(self._shared_key(key))
+            except Exception, err:
+                logger.error("Fail to remove shared Keystone token: {}".format(err))
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def expires_within(self, key, seconds):
+        """
+        True when there is no local token for key or it expires in less
+        than the given seconds.
+        """
+        with self._lock:
+            auth_ref = self._tokens.get(key)
+
+        return auth_ref is None or auth_ref.will_expire_soon(seconds)
+
+    def _is_valid(self, auth_ref):
+        return not auth_ref.will_expire_soon(conf.KEYSTONE_TOKEN_EXPIRY_MARGIN)
+
+    def _shared_key(self, key):
+        return "|".join(key)
+
+    def _get_shared(self, key):
+        try:
+            doc = SwiftsuruDBClient().get_token(self._shared_key(key))
+        except Exception, err:
+            logger.error("Fail to get shared Keystone token: {}".format(err))
+            return
+
+        if doc:
+            auth_ref = access.AccessInfo.factory(**json.loads(doc["auth_ref"]))
+
+            if self._is_valid(auth_ref):
+                return auth_ref
+
+
+token_cache = TokenCache()
+
+# object-store endpoints of each tenant, refreshed along with its token
+endpoint_cache = TTLCache(conf.KEYSTONE_ENDPOINT_CACHE_TTL)
+
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Returns the requests.Session shared by every KeystoneClient of this
+    process, whatever the tenant, so Keystone calls reuse pooled keep-alive
+    connections instead of opening a new TCP/TLS connection each time.
+
+    Pooled sockets must not be shared with forked children, so a new
+    session is created whenever the pid changes.
+    """
+    global _http_session, _http_session_pid
+
+    pid = os.getpid()
+
+    if _http_session is None or _http_session_pid != pid:
+        with _http_session_lock:
+            if _http_session is None or _http_session_pid != pid:
+                session = requests.Session()
+                adapter = client_session.TCPKeepAliveAdapter(
+                    pool_connections=conf.KEYSTONE_POOL_CONNECTIONS,
+                    pool_maxsize=conf.KEYSTONE_POOL_MAXSIZE,
+                    pool_block=conf.KEYSTONE_POOL_BLOCK)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+
+                _http_session = session
+                _http_session_pid = pid
+
+    return _http_session
 
 
 class KeystoneClient(object):
     """ return an authenticated keystone client """
 
-    def __init__(self, tenant):
+    def __init__(self, tenant, force_auth=False):
         self.tenant = tenant
-        self.conn = self._keystone_conn()
+        self.conn = self._keystone_conn(force_auth)
+
+    @property
+    def cache_key(self):
+        return (self.tenant, conf.KEYSTONE_USER, conf.KEYSTONE_URL)
 
-    def _keystone_conn(self):
+    def _keystone_conn(self, force_auth=False):
         endpoint = getattr(conf, 'KEYSTONE_URL')
         insecure = getattr(conf, 'KEYSTONE_SSL_NO_VERIFY', False)
 
+        # A cached auth_ref skips the password authentication
+        auth_ref = None if force_auth else token_cache.get(self.cache_key)
+
+        # Each client has its own auth, but all of them share the HTTP
+        # connection pool of the process
+        session = client_session.Session(session=get_http_session(),
+                                         verify=not insecure,
+                                         timeout=conf.KEYSTONE_TIMEOUT)
+
         conn = client.Client(username=conf.KEYSTONE_USER,
                              password=conf.KEYSTONE_PASSWORD,
                              tenant_name=self.tenant,
                              auth_url=endpoint,
-                             insecure=insecure,
-                             debug=conf.DEBUG)
+                             debug=conf.DEBUG,
+                             auth_ref=auth_ref,
+                             session=session)
+        session.auth = conn
+
+        if auth_ref is None:
+            conn.authenticate()
+            token_cache.set(self.cache_key, conn.auth_ref)
+            endpoint_cache.delete(self.tenant)
+
         return conn
 
+    def invalidate_token(self):
+        token_cache.invalidate(self.cache_key)
+        endpoint_cache.delete(self.tenant)
+
+    def reauthenticate(self):
+        """
+        Replaces a token refused by a service with a new one.
+        """
+        self.invalidate_token()
+        self.conn = self._keystone_conn(force_auth=True)
+
+        return self.conn.auth_token
+
     # def _get_keystone_endpoint(self):
     #     interface = 'internal'
 
@@ -90,6 +269,39 @@ class KeystoneClient(object):
 
         return user
 
+    def delete_user(self, name):
+        """
+        Deletes a user by name. Missing users are already deleted.
+        """
+        try:
+            user = self.conn.users.find(name=name)
+        except NotFound:
+            return False
+
+        self.conn.users.delete(user)
+        return True
+
+    def update_password(self, name, password):
+        user = self.conn.users.find(name=name)
+
+        if conf.KEYSTONE_VERSION < 3:
+            return self.conn.users.update_password(user, password)
+        else:
+            return self.conn.users.update(user, password=password)
+
+    def list_users(self, project_name):
+        """
+        Users of a project, as a dict of user name to enabled flag.
+        """
+        project = self.project_get(project_name)
+
+        if conf.KEYSTONE_VERSION < 3:
+            users = self.conn.users.list(tenant_id=project.id)
+        else:
+            users = self.conn.users.list(default_project=project.id)
+
+        return dict((user.name, getattr(user, "enabled", True)) for user in users)
+
     def add_user_role(self, user=None, project=None, role=None):
         if conf.KEYSTONE_VERSION < 3:
             return self.conn.roles.add_user_role(user, role, project)
@@ -116,5 +328,13 @@ class KeystoneClient(object):
     #     return str(endpoints['object-store'][0]['adminURL'])
 
     def get_storage_endpoints(self):
-        endpoints = self.conn.service_catalog.get_endpoints()
-        return endpoints['object-store'][0]
+        endpoints = endpoint_cache.get(self.tenant)
+
+        if endpoints is None:
+            metrics.incr("keystone.endpoint_cache.miss")
+            endpoints = self.conn.service_catalog.get_endpoints()['object-store'][0]
+            endpoint_cache.set(self.tenant, endpoints)
+        else:
+            metrics.incr("keystone.endpoint_cache.hit")
+
+        return endpoints
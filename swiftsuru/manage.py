@@ -0,0 +1,156 @@
+"""
+Maintenance commands for Swiftsuru database.
+
+Usage:
+    python -m swiftsuru.manage backfill-instances
+    python -m swiftsuru.manage refresh-endpoints
+    python -m swiftsuru.manage build-indexes
+    python -m swiftsuru.manage check-indexes
+"""
+import argparse
+
+from swiftsuru import utils
+from swiftsuru import dbclient
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.keystone_client import KeystoneClient
+
+
+logger = utils.get_logger(__name__)
+
+
+def tenant_endpoints(tenant, resolved):
+    """
+    Storage endpoints of a tenant, asking Keystone once per tenant.
+    """
+    if tenant not in resolved:
+        endpoints = KeystoneClient(tenant=tenant).get_storage_endpoints()
+        resolved[tenant] = utils.storage_endpoint_bases(endpoints)
+
+    return resolved[tenant]
+
+
+def backfill_instances():
+    """
+    Copies tenant and storage endpoints into instances created before they
+    were stored on the instance document.
+    """
+    db_cli = SwiftsuruDBClient()
+
+    tenants = dict((plan.get("name"), plan.get("tenant")) for plan in db_cli.list_plans())
+    resolved = {}
+    count = 0
+
+    for instance in db_cli.list_instances_without_location():
+        name = instance.get("name")
+        tenant = tenants.get(instance.get("plan"))
+
+        if not tenant:
+            logger.error("Instance <{}> has no valid plan, skipping".format(name))
+            continue
+
+        db_cli.set_instance_location(name, tenant, tenant_endpoints(tenant, resolved))
+        count += 1
+
+    logger.info("{} instances backfilled".format(count))
+    return count
+
+
+def refresh_endpoints():
+    """
+    Resolves again the storage endpoints copied into instances, rewriting
+    the ones changed on the Keystone catalog since they were copied.
+    """
+    db_cli = SwiftsuruDBClient()
+    resolved = {}
+    count = 0
+
+    for instance in db_cli.iter_instances(fields={"name": 1, "tenant": 1, "endpoints": 1}):
+        tenant = instance.get("tenant")
+
+        # Left to backfill-instances
+        if not tenant:
+            continue
+
+        endpoints = tenant_endpoints(tenant, resolved)
+
+        if endpoints != instance.get("endpoints"):
+            db_cli.set_instance_location(instance["name"], tenant, endpoints)
+            count += 1
+
+    logger.info("{} instances refreshed".format(count))
+    return count
+
+
+def build_indexes():
+    """
+    Builds the indexes of dbclient.INDEXES in background, without blocking
+    reads and writes of the collections being indexed.
+    """
+    errors = SwiftsuruDBClient().ensure_indexes(background=True)
+
+    for index, err in sorted(errors.items()):
+        logger.error("Fail to create index {}: {}".format(index, err))
+
+    if errors:
+        raise SystemExit("{} indexes failed".format(len(errors)))
+
+    logger.info("{} indexes ensured".format(len(dbclient.INDEXES)))
+
+
+def plan_stages(plan):
+    """
+    Names of the stages of an explain() plan, inner stages included.
+    """
+    stages = [plan.get("stage")]
+
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages.extend(plan_stages(child))
+
+    return stages
+
+
+def collection_scans():
+    """
+    Queries of dbclient.QUERIES whose winning plan scans a whole collection.
+    """
+    db_cli = SwiftsuruDBClient()
+    scans = []
+
+    for method, collection, query, sort in dbclient.QUERIES:
+        plan = db_cli.query_plan(collection, query, sort)
+
+        if "COLLSCAN" in plan_stages(plan):
+            logger.error("{} scans collection <{}>: {}".format(method, collection, query))
+            scans.append(method)
+
+    return scans
+
+
+def check_indexes():
+    scans = collection_scans()
+
+    if scans:
+        raise SystemExit("{} queries scan whole collections".format(len(scans)))
+
+    logger.info("{} queries use indexes".format(len(dbclient.QUERIES)))
+
+
+COMMANDS = {
+    "backfill-instances": backfill_instances,
+    "build-indexes": build_indexes,
+    "refresh-endpoints": refresh_endpoints,
+    "check-indexes": check_indexes,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Swiftsuru maintenance commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args(argv)
+
+    COMMANDS[args.command]()
+
+
+if __name__ == "__main__":
+    main()
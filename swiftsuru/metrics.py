@@ -0,0 +1,63 @@
+"""
+In-process counters, gauges and timings for Swiftsuru API.
+
+Values live in the memory of each worker process and are exposed by the
+/metrics route.
+"""
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+
+
+@contextmanager
+def timer(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start)
+
+
+def snapshot():
+    with _lock:
+        timings = {}
+        for name, timing in _timings.items():
+            timings[name] = dict(timing, avg=timing["total"] / timing["count"])
+
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": timings
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
@@ -0,0 +1,49 @@
+"""
+Keeps Keystone tokens and service catalogs warm for every tenant with a plan
+"""
+import random
+import time
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.keystone_client import KeystoneClient, token_cache
+from swiftsuru.scheduler import PeriodicTask
+
+
+logger = utils.get_logger(__name__)
+
+
+class TokenPrewarmer(PeriodicTask):
+    """
+    Authenticates on Keystone ahead of time for every tenant found on the
+    plans collection, and renews each token KEYSTONE_PREWARM_MARGIN seconds
+    before it expires, so binds never wait for a password authentication.
+    """
+
+    def __init__(self):
+        super(TokenPrewarmer, self).__init__(conf.KEYSTONE_PREWARM_INTERVAL,
+                                             conf.KEYSTONE_PREWARM_JITTER)
+
+    def tenants(self):
+        plans = SwiftsuruDBClient().list_plans()
+        return sorted(set(plan.get("tenant") for plan in plans if plan.get("tenant")))
+
+    def run_once(self):
+        utils.map_concurrently(self.warm, self.tenants(),
+                               conf.KEYSTONE_PREWARM_CONCURRENCY)
+
+    def warm(self, tenant):
+        key = (tenant, conf.KEYSTONE_USER, conf.KEYSTONE_URL)
+
+        if not token_cache.expires_within(key, conf.KEYSTONE_PREWARM_MARGIN):
+            return
+
+        # Spreads the authentications of a fleet restarting at once
+        time.sleep(random.uniform(0, conf.KEYSTONE_PREWARM_JITTER))
+
+        try:
+            KeystoneClient(tenant=tenant, force_auth=True)
+            metrics.incr("keystone.prewarm.refreshed")
+        except Exception, err:
+            metrics.incr("keystone.prewarm.failed")
+            logger.error("Fail to prewarm token of tenant <{}>: {}".format(tenant, err))
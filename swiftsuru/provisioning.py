@@ -0,0 +1,200 @@
+"""
+Creates service instances in background, from jobs queued on MongoDB.
+
+A job records the steps already done, so a job retried after a failure, or
+claimed again after its worker died, goes on from where it stopped.
+"""
+from datetime import datetime, timedelta
+
+from keystoneclient.exceptions import Conflict
+from pymongo.errors import DuplicateKeyError
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.keystone_client import KeystoneClient
+from swiftsuru.scheduler import PeriodicTask
+from swiftsuru.swift_client import SwiftClient
+
+
+logger = utils.get_logger(__name__)
+
+ADD_INSTANCE = "add_instance"
+
+
+def enqueue_instance(name, team, plan, tenant):
+    """
+    Queues the creation of an instance. Credentials and container name are
+    chosen now, so every attempt of the job creates the same resources.
+    """
+    username = "{}_{}".format(team, name)
+    params = {"team": team,
+              "plan": plan,
+              "tenant": tenant,
+              "user": username,
+              "password": utils.generate_password(),
+              "container": utils.generate_container_name()}
+
+    metrics.incr("provisioning.enqueued")
+    return SwiftsuruDBClient().add_job(ADD_INSTANCE, name, params)
+
+
+def job_status(job):
+    """
+    Job fields safe to show to clients, without credentials.
+    """
+    return {"name": job["name"],
+            "status": job["status"],
+            "steps": job["steps"],
+            "attempts": job["attempts"],
+            "error": job["error"],
+            "created_at": job["created_at"].isoformat(),
+            "updated_at": job["updated_at"].isoformat()}
+
+
+class Provisioner(object):
+    """
+    Runs the steps creating an instance, skipping the ones already done.
+    on_step is called with the name of every step finished.
+    """
+
+    steps = ("keystone_user", "containers", "instance")
+
+    def __init__(self, name, params, done=(), on_step=None):
+        self.name = name
+        self.params = params
+        self.done = list(done)
+        self.on_step = on_step
+        self.db_cli = SwiftsuruDBClient()
+        self._keystone = None
+
+    @property
+    def keystone(self):
+        if self._keystone is None:
+            self._keystone = KeystoneClient(tenant=self.params["tenant"])
+
+        return self._keystone
+
+    def run(self):
+        for step in self.steps:
+            if step in self.done:
+                continue
+
+            with metrics.timer("provisioning.step.{}".format(step)):
+                getattr(self, step)()
+
+            if self.on_step is not None:
+                self.on_step(step)
+
+            logger.info('Provisioning of <{}>: {} done'.format(self.name, step))
+
+    def keystone_user(self):
+        # Two jobs racing for the same name would reset the password of
+        # each other's user, so only the job holding the name goes on. The
+        # warm pool creates users without a name, never shared.
+        if self.name is not None and self.reserved_by_another_job():
+            raise Exception("Instance <{}> is being created by another job".format(self.name))
+
+        try:
+            self.keystone.create_user(name=self.params["user"],
+                                      password=self.params["password"],
+                                      project_name=self.params["tenant"],
+                                      role_name=conf.KEYSTONE_DEFAULT_ROLE,
+                                      enabled=True)
+        except Conflict:
+            # Created by an attempt that died before recording the step, so
+            # it gets the password of this job unless another instance owns it
+            self.check_not_taken("User <{}>".format(self.params["user"]))
+            self.keystone.update_password(self.params["user"], self.params["password"])
+            logger.info('User <{}> already exists, password reset'.format(self.params["user"]))
+
+    def containers(self):
+        container = self.params["container"]
+        tenant_user = "{}:{}".format(self.params["tenant"], self.params["user"])
+        headers = {
+            "X-Container-Write": "{}".format(tenant_user),
+            "X-Container-Read": ".r:*,{}".format(tenant_user)
+        }
+
+        def create(container_name):
+            with SwiftClient(self.keystone) as client:
+                client.create_container(container_name, headers)
+
+        # Container created to allow the use of undelete middleware
+        names = [container, '.trash-{}'.format(container)]
+        utils.map_concurrently(create, names, len(names))
+
+    def endpoints(self):
+        return utils.storage_endpoint_bases(self.keystone.get_storage_endpoints())
+
+    def instance(self):
+        try:
+            self.db_cli.add_instance(self.name, self.params["team"], self.params["container"],
+                                     self.params["plan"], self.params["user"],
+                                     self.params["password"],
+                                     tenant=self.params["tenant"], endpoints=self.endpoints())
+        except DuplicateKeyError:
+            # Recorded by an attempt that died before recording the step
+            self.check_not_taken("Instance <{}>".format(self.name))
+            logger.info('Instance <{}> already exists'.format(self.name))
+
+    def reserved_by_another_job(self):
+        container = self.params["container"]
+        return self.db_cli.reserve_instance_name(self.name, container) != container
+
+    def check_not_taken(self, resource):
+        """
+        Raises when an instance with this name, even deleted and not reaped
+        yet, was not created by this job.
+        """
+        existing = self.db_cli.get_instance(self.name, include_deleted=True)
+
+        if existing is not None and existing.get("container") != self.params["container"]:
+            raise Exception("{} belongs to another instance".format(resource))
+
+
+class ProvisioningWorker(PeriodicTask):
+    """
+    Claims queued jobs and runs them until the queue is empty. Failed jobs
+    go back to the queue until PROVISIONING_MAX_ATTEMPTS is reached.
+    """
+
+    def __init__(self):
+        super(ProvisioningWorker, self).__init__(conf.PROVISIONING_POLL_INTERVAL,
+                                                 conf.PROVISIONING_POLL_JITTER)
+
+    def run_once(self):
+        while True:
+            stale_before = datetime.utcnow() - timedelta(seconds=conf.PROVISIONING_STALE_AFTER)
+            job = SwiftsuruDBClient().claim_job(stale_before)
+
+            if job is None:
+                return
+
+            self.process(job)
+
+    def process(self, job):
+        db_cli = SwiftsuruDBClient()
+
+        def on_step(step):
+            db_cli.add_job_step(job["_id"], step)
+
+        try:
+            with metrics.timer("provisioning.job"):
+                Provisioner(job["name"], job["params"], job["steps"], on_step).run()
+        except Exception, err:
+            err_msg = 'Fail to provision <{}> on attempt {}: {}'.format(job["name"], job["attempts"], err)
+            logger.error(err_msg)
+
+            if job["attempts"] < conf.PROVISIONING_MAX_ATTEMPTS:
+                metrics.incr("provisioning.retried")
+                db_cli.set_job_status(job["_id"], "pending", str(err))
+            else:
+                metrics.incr("provisioning.failed")
+                db_cli.set_job_status(job["_id"], "failed", str(err))
+                # A new job can take the name again
+                db_cli.release_instance_name(job["name"], job["params"]["container"])
+
+            return
+
+        metrics.incr("provisioning.done")
+        db_cli.set_job_status(job["_id"], "done")
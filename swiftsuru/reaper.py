@@ -0,0 +1,118 @@
+"""
+Reclaims the Swift containers and Keystone users of deleted instances.
+
+remove_instance only flags an instance as deleted. The reaper takes deleted
+instances in batches, empties their data and .trash- containers with bulk
+deletes, deletes the containers and the Keystone user, and then archives
+the instance document. Every finished step is recorded on the instance, so
+an instance taken again after a failure goes on from where it stopped.
+"""
+from datetime import datetime, timedelta
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.keystone_client import KeystoneClient
+from swiftsuru.scheduler import PeriodicTask
+from swiftsuru.swift_client import SwiftClient
+
+
+logger = utils.get_logger(__name__)
+
+
+class InstanceReaper(object):
+
+    steps = ("objects", "containers", "keystone_user")
+
+    def __init__(self, instance, db_cli):
+        self.instance = instance
+        self.db_cli = db_cli
+        self.done = instance.get("reap_steps", [])
+        self.containers_names = [instance["container"], '.trash-{}'.format(instance["container"])]
+        self._keystone = None
+
+    @property
+    def keystone(self):
+        if self._keystone is None:
+            tenant = self.instance.get("tenant")
+
+            if not tenant:
+                tenant = self.db_cli.get_plan(self.instance["plan"])["tenant"]
+
+            self._keystone = KeystoneClient(tenant=tenant)
+
+        return self._keystone
+
+    def run(self):
+        for step in self.steps:
+            if step in self.done:
+                continue
+
+            with metrics.timer("reaper.step.{}".format(step)):
+                getattr(self, step)()
+
+            self.db_cli.add_reap_step(self.instance["_id"], step)
+
+        self.db_cli.archive_instance(self.instance)
+        logger.info('Instance <{}> reaped'.format(self.instance["name"]))
+
+    def objects(self):
+        def empty(container):
+            with SwiftClient(self.keystone) as client:
+                return client.empty_container(container, conf.REAPER_BULK_DELETE_SIZE)
+
+        deleted = utils.map_concurrently(empty, self.containers_names, conf.REAPER_CONCURRENCY)
+        metrics.incr("reaper.objects_deleted", sum(deleted))
+
+    def containers(self):
+        def delete(container):
+            with SwiftClient(self.keystone) as client:
+                client.delete_container(container)
+
+        utils.map_concurrently(delete, self.containers_names, conf.REAPER_CONCURRENCY)
+
+    def keystone_user(self):
+        if self.instance.get("user"):
+            self.keystone.delete_user(self.instance["user"])
+
+
+class Reaper(PeriodicTask):
+    """
+    Reaps up to REAPER_BATCH_SIZE deleted instances per run, at most
+    REAPER_CONCURRENCY of them at the same time. Instances are only reaped
+    REAPER_GRACE_PERIOD seconds after being deleted, and legacy instances
+    deleted without a deleted_at are left alone.
+    """
+
+    def __init__(self):
+        super(Reaper, self).__init__(conf.REAPER_INTERVAL, conf.REAPER_JITTER)
+
+    def claim(self, db_cli):
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=conf.REAPER_STALE_AFTER)
+        deleted_before = now - timedelta(seconds=conf.REAPER_GRACE_PERIOD)
+        instances = []
+
+        for _ in range(conf.REAPER_BATCH_SIZE):
+            instance = db_cli.claim_deleted_instance(stale_before, deleted_before)
+
+            if instance is None:
+                break
+
+            instances.append(instance)
+
+        return instances
+
+    def run_once(self):
+        db_cli = SwiftsuruDBClient()
+        instances = self.claim(db_cli)
+
+        if instances:
+            utils.map_concurrently(self.reap, instances, conf.REAPER_CONCURRENCY)
+
+    def reap(self, instance):
+        try:
+            InstanceReaper(instance, SwiftsuruDBClient()).run()
+            metrics.incr("reaper.reaped")
+        except Exception, err:
+            metrics.incr("reaper.failed")
+            logger.error('Fail to reap instance <{}>: {}'.format(instance["name"], err))
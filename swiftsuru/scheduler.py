@@ -0,0 +1,69 @@
+"""
+Background periodic tasks run inside the API processes
+"""
+import random
+import threading
+
+from swiftsuru import utils
+
+
+logger = utils.get_logger(__name__)
+
+_running = []
+
+
+class PeriodicTask(threading.Thread):
+    """
+    Daemon thread calling run_once() every `interval` seconds.
+
+    Up to `jitter` random seconds are added to every wait, so processes
+    started together don't hit the same dependency at the same time. The
+    first run is only delayed, by up to `initial_jitter` seconds, for tasks
+    asking for it.
+    """
+
+    def __init__(self, interval, jitter=0, initial_jitter=0):
+        super(PeriodicTask, self).__init__(name=self.__class__.__name__)
+        self.daemon = True
+        self.interval = interval
+        self.jitter = jitter
+        self.initial_jitter = initial_jitter
+        self._stopped = threading.Event()
+
+    def run(self):
+        first_delay = self.first_delay()
+
+        if first_delay:
+            self._stopped.wait(first_delay)
+
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception, err:
+                logger.error("{} failed: {}".format(self.name, err))
+
+            self._stopped.wait(self.next_delay())
+
+    def first_delay(self):
+        return random.uniform(0, self.initial_jitter)
+
+    def next_delay(self):
+        return self.interval + random.uniform(0, self.jitter)
+
+    def run_once(self):
+        raise NotImplementedError()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start(task):
+    task.start()
+    _running.append(task)
+
+    return task
+
+
+def stop_all():
+    while _running:
+        _running.pop().stop()
@@ -0,0 +1,107 @@
+"""
+Production entry point: serves swiftsuru.app on gunicorn preforked workers.
+
+    python -m swiftsuru.server
+
+Workers are recycled after WEB_MAX_REQUESTS requests, and a HUP signal
+reloads them gracefully, letting running requests finish within
+WEB_GRACEFUL_TIMEOUT seconds.
+
+With WEB_WORKER_CLASS=gevent each worker keeps up to WEB_WORKER_CONNECTIONS
+requests in flight on greenlets, running the same handlers. The standard
+library is patched by swiftsuru/__init__.py, before anything is imported.
+"""
+from gunicorn.app.base import BaseApplication
+
+from swiftsuru import api, conf, dbclient, tasks, utils
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.keystone_client import KeystoneClient
+from swiftsuru.swift_client import SwiftClient
+
+
+logger = utils.get_logger(__name__)
+
+
+def options():
+    return {
+        "bind": "{}:{}".format(conf.HOST, conf.PORT),
+        "workers": conf.WEB_WORKERS,
+        "threads": conf.WEB_THREADS,
+        "worker_class": conf.WEB_WORKER_CLASS,
+        "worker_connections": conf.WEB_WORKER_CONNECTIONS,
+        "max_requests": conf.WEB_MAX_REQUESTS,
+        "max_requests_jitter": conf.WEB_MAX_REQUESTS_JITTER,
+        "timeout": conf.WEB_TIMEOUT,
+        "graceful_timeout": conf.WEB_GRACEFUL_TIMEOUT,
+        "keepalive": conf.WEB_KEEPALIVE,
+        "on_starting": on_starting,
+        "post_fork": post_fork,
+        "worker_exit": worker_exit,
+    }
+
+
+def on_starting(server):
+    # Runs once on the master, before any worker is forked
+    dbclient.bootstrap()
+
+
+def post_fork(server, worker):
+    warm_pools()
+    tasks.start()
+
+
+def worker_exit(server, worker):
+    # Also registered with atexit, gunicorn workers may leave through os._exit
+    api.close_bind_pool()
+
+
+def warm_pools():
+    """
+    Opens the connections of the new worker before it accepts requests:
+    MongoDB, and Keystone and Swift for every tenant with a plan.
+    Failures are only logged, requests open whatever is missing.
+    """
+    try:
+        dbclient.get_connection().admin.command("ping")
+        plans = SwiftsuruDBClient().list_plans()
+    except Exception, err:
+        logger.error("Fail to warm MongoDB connections: {}".format(err))
+        return
+
+    tenants = sorted(set(plan.get("tenant") for plan in plans if plan.get("tenant")))
+    utils.map_concurrently(warm_tenant, tenants, conf.KEYSTONE_PREWARM_CONCURRENCY)
+
+
+def warm_tenant(tenant):
+    try:
+        keystone = KeystoneClient(tenant=tenant)
+
+        with SwiftClient(keystone) as client:
+            client.conn.head_account()
+    except Exception, err:
+        logger.error("Fail to warm connections of tenant <{}>: {}".format(tenant, err))
+
+
+class Server(BaseApplication):
+
+    def __init__(self, application, settings=None):
+        self.application = application
+        self.settings = settings or {}
+        super(Server, self).__init__()
+
+    def load_config(self):
+        for key, value in self.settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def main():
+    from swiftsuru import app
+
+    Server(app, options()).run()
+
+
+if __name__ == "__main__":
+    main()
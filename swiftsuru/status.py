@@ -0,0 +1,147 @@
+"""
+Status of instances, as answered to Tsuru by GET /resources/<name>/status.
+
+A background prober checks the Keystone user and the container of every
+instance and stores the result on MongoDB. Status requests only read it,
+kept in memory for STATUS_CACHE_TTL seconds, so Tsuru polls never reach
+Keystone or Swift.
+"""
+from datetime import datetime, timedelta
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.cache import TTLCache
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.keystone_client import KeystoneClient
+from swiftsuru.scheduler import PeriodicTask
+from swiftsuru.swift_client import SwiftClient
+
+
+logger = utils.get_logger(__name__)
+
+UP = "up"
+DOWN = "down"
+PENDING = "pending"
+MISSING = "missing"
+
+# Fields of an instance document read by the prober
+PROBE_FIELDS = {"name": 1, "container": 1, "plan": 1, "tenant": 1, "user": 1}
+
+status_cache = TTLCache(conf.STATUS_CACHE_TTL)
+
+
+def instance_status(name):
+    status = status_cache.get(name)
+
+    if status is None:
+        metrics.incr("status.cache.miss")
+        status = stored_status(name)
+        status_cache.set(name, status)
+
+    return status
+
+
+def stored_status(name):
+    """
+    Last probed status of an instance. Instances still being created, or
+    not probed yet, are pending.
+    """
+    db_cli = SwiftsuruDBClient()
+    status = db_cli.get_instance_status(name)
+
+    if status is None:
+        job = db_cli.get_job(name)
+
+        if job and job["status"] in ("pending", "running"):
+            return {"state": PENDING}
+
+        return {"state": MISSING}
+
+    return status or {"state": PENDING}
+
+
+class StatusProber(PeriodicTask):
+    """
+    Probes every instance not probed for STATUS_PROBE_INTERVAL seconds.
+
+    Users are listed once per tenant, and each instance costs one HEAD of
+    its container. Every process runs a prober, and each one claims its
+    instances in batches of STATUS_PROBE_BATCH_SIZE, so an instance is
+    probed by a single process per interval.
+    """
+
+    def __init__(self):
+        # Workers forked together spread their first probes over the jitter
+        super(StatusProber, self).__init__(conf.STATUS_PROBE_INTERVAL,
+                                           conf.STATUS_PROBE_JITTER,
+                                           initial_jitter=conf.STATUS_PROBE_JITTER)
+
+    def run_once(self):
+        db_cli = SwiftsuruDBClient()
+        # Fixed for the whole run, so instances claimed by it are not taken again
+        probed_before = datetime.utcnow() - timedelta(seconds=conf.STATUS_PROBE_INTERVAL)
+
+        while True:
+            instances = db_cli.claim_instances("status_probed_at", probed_before,
+                                               conf.STATUS_PROBE_BATCH_SIZE, PROBE_FIELDS)
+
+            if not instances:
+                return
+
+            self.probe_batch(db_cli, instances)
+
+    def probe_batch(self, db_cli, instances):
+        by_tenant = {}
+
+        for instance in instances:
+            tenant = instance.get("tenant")
+
+            if not tenant:
+                plan = db_cli.get_plan(instance.get("plan")) or {}
+                tenant = plan.get("tenant")
+
+            if not tenant:
+                logger.error("Instance <{}> has no valid plan, skipping".format(instance["name"]))
+                continue
+
+            by_tenant.setdefault(tenant, []).append(instance)
+
+        if by_tenant:
+            utils.map_concurrently(lambda tenant: self.probe_tenant(tenant, by_tenant[tenant]),
+                                   sorted(by_tenant), conf.STATUS_PROBE_CONCURRENCY)
+
+    def probe_tenant(self, tenant, instances):
+        db_cli = SwiftsuruDBClient()
+
+        try:
+            keystone = KeystoneClient(tenant=tenant)
+            users = keystone.list_users(tenant)
+        except Exception, err:
+            logger.error("Fail to list users of tenant <{}>: {}".format(tenant, err))
+            keystone, users = None, None
+
+        for instance in instances:
+            state, reason = self.probe(keystone, users, instance)
+            metrics.incr("status.probe.{}".format(state))
+
+            db_cli.set_instance_status(instance["name"], {"state": state,
+                                                          "reason": reason,
+                                                          "checked_at": datetime.utcnow()})
+
+    def probe(self, keystone, users, instance):
+        if users is None:
+            return DOWN, "Keystone is unreachable"
+
+        if instance.get("user") not in users:
+            return DOWN, "Keystone user does not exist"
+
+        if not users[instance["user"]]:
+            return DOWN, "Keystone user is disabled"
+
+        try:
+            with SwiftClient(keystone) as client:
+                if not client.container_exists(instance["container"]):
+                    return DOWN, "Container does not exist"
+        except Exception, err:
+            return DOWN, "Container is unreachable: {}".format(err)
+
+        return UP, None
@@ -1,5 +1,147 @@
+import json
+import threading
+import time
+
+from functools import wraps
+from urllib import quote
+from urlparse import urlparse
+
 import swiftclient
+from swiftclient.exceptions import ClientException
+
+from swiftsuru import metrics
+from swiftsuru.cache import TTLCache
 from swiftsuru.conf import AUTH_URL, USER, KEY
+from swiftsuru.conf import SWIFT_AUTH_CACHE_TTL, SWIFT_POOL_MAX_SIZE, SWIFT_POOL_IDLE_TIMEOUT
+
+
+class ConnectionPool(object):
+    """
+    Keeps idle swiftclient Connections per storage URL, so requests reuse
+    their keep-alive HTTP sessions instead of opening a new TLS session to
+    the Swift proxy every time.
+
+    At most `max_size` idle connections are kept per URL, and connections
+    idle for more than `idle_timeout` seconds are closed.
+    """
+
+    def __init__(self, max_size, idle_timeout):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url, token, **options):
+        conn = None
+
+        with self._lock:
+            self._evict(time.time())
+            idle = self._idle.get(url)
+
+            if idle:
+                conn, _ = idle.pop()
+
+        if conn is None:
+            metrics.incr("swift.pool.miss")
+            return swiftclient.client.Connection(preauthurl=url, preauthtoken=token, **options)
+
+        metrics.incr("swift.pool.hit")
+        conn.url = url
+        conn.token = token
+
+        return conn
+
+    def release(self, url, conn):
+        with self._lock:
+            idle = self._idle.setdefault(url, [])
+
+            if len(idle) < self.max_size:
+                idle.append((conn, time.time()))
+                return
+
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def _evict(self, now):
+        for url, idle in self._idle.items():
+            fresh = []
+
+            for conn, released_at in idle:
+                if now - released_at > self.idle_timeout:
+                    conn.close()
+                else:
+                    fresh.append((conn, released_at))
+
+            if fresh:
+                self._idle[url] = fresh
+            else:
+                del self._idle[url]
+
+
+pool = ConnectionPool(SWIFT_POOL_MAX_SIZE, SWIFT_POOL_IDLE_TIMEOUT)
+
+# Storage URL and token obtained with AUTH_URL, USER and KEY
+swift_auth = TTLCache(SWIFT_AUTH_CACHE_TTL)
+
+
+def bulk_delete(url, token, paths, http_conn=None, service_token=None):
+    """
+    Deletes objects, given as "/<container>/<object>" paths, with a single
+    request to the bulk middleware of Swift. Follows the signature of
+    swiftclient.client functions, so it can run through Connection._retry.
+    """
+    parsed, conn = http_conn
+    path = '{}?bulk-delete'.format(parsed.path)
+    headers = {'X-Auth-Token': token,
+               'Content-Type': 'text/plain',
+               'Accept': 'application/json'}
+    if service_token:
+        headers['X-Service-Token'] = service_token
+
+    body = '\n'.join(quote(p.encode('utf-8') if isinstance(p, unicode) else p) for p in paths)
+    conn.request('POST', path, body, headers)
+    resp = conn.getresponse()
+    content = resp.read()
+
+    if resp.status < 200 or resp.status >= 300:
+        raise ClientException('Bulk delete failed',
+                              http_scheme=parsed.scheme, http_host=conn.host,
+                              http_path=path, http_status=resp.status,
+                              http_reason=resp.reason,
+                              http_response_content=content)
+
+    return json.loads(content)
+
+
+def handles_auth_errors(method):
+    """
+    When Swift answers 401 a new token is swapped into the connection and
+    the call is retried once. A 404 on the account itself drops the cached
+    Keystone token and storage endpoints of the tenant, so the next request
+    reads a fresh catalog. Missing containers and objects keep them.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except ClientException, err:
+            if err.http_status == 401:
+                self._swap_token()
+                return method(self, *args, **kwargs)
+
+            if self.keystone and err.http_status == 404 and self._is_account_path(err.http_path):
+                self.keystone.invalidate_token()
+
+            raise
+
+    return wrapper
 
 
 class SwiftClient(object):
@@ -14,6 +156,11 @@ class SwiftClient(object):
     This is kind of ugly, to make it cleaner we abstract the connection for you, e.g:
         cli = SwiftClient()
         cli.create_account(<...>) # much better!
+
+    Connections come from a pool shared by the whole process. Use it as a
+    context manager, or call close(), to give the connection back:
+        with SwiftClient(keystone) as cli:
+            cli.create_container(<...>)
     """
 
     def __init__(self, keystone_conn=None):
@@ -22,16 +169,55 @@ class SwiftClient(object):
         Gets auth information for next API calls via conn.get_auth() and
         a authenticated client connection for performing actions.
         """
+        self.keystone = keystone_conn
+
         if keystone_conn:
             token = keystone_conn.conn.auth_token
             endpoints = keystone_conn.get_storage_endpoints()
-            url = endpoints['adminURL']
+            self.url = endpoints['adminURL']
+
+            self.conn = pool.acquire(self.url, token, insecure=True)
+        else:
+            auth = swift_auth.get((AUTH_URL, USER))
+
+            if auth is None:
+                auth = self._authenticate()
+
+            self.url, auth_token = auth
+            self.conn = pool.acquire(self.url, auth_token)
 
-            self.conn = swiftclient.client.Connection(preauthurl=url, preauthtoken=token, insecure=True)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Connections that failed are not given back to the pool
+        if exc_type is None:
+            self.close()
+
+    def close(self):
+        if self.conn is not None:
+            pool.release(self.url, self.conn)
+            self.conn = None
+
+    def _authenticate(self):
+        conn = swiftclient.client.Connection(authurl=AUTH_URL, user=USER, key=KEY)
+        auth = conn.get_auth()
+        swift_auth.set((AUTH_URL, USER), auth)
+
+        return auth
+
+    def _swap_token(self):
+        if self.keystone:
+            token = self.keystone.reauthenticate()
         else:
-            conn = swiftclient.client.Connection(authurl=AUTH_URL, user=USER, key=KEY)
-            auth_url, auth_token = conn.get_auth()
-            self.conn = swiftclient.client.Connection(preauthurl=auth_url, preauthtoken=auth_token)
+            self.url, token = self._authenticate()
+
+        metrics.incr("swift.token_swaps")
+        self.conn.url = self.url
+        self.conn.token = token
+
+    def _is_account_path(self, path):
+        return (path or '').rstrip('/') == urlparse(self.url).path.rstrip('/')
 
     def create_account(self, headers):
         self.conn.post_account(headers)
@@ -39,6 +225,7 @@ class SwiftClient(object):
     def remove_account(self, subject):
         self.conn.post_account({"X-Remove-Account-Meta-Subject": subject})
 
+    @handles_auth_errors
     def account_containers(self):
         """
         Returns a list of existing containers for a given account.
@@ -46,27 +233,106 @@ class SwiftClient(object):
         """
         return self.conn.get_account()[1]
 
+    @handles_auth_errors
     def create_container(self, name, headers):
         self.conn.put_container(name, headers)
 
+    @handles_auth_errors
     def remove_container(self, name, headers):
         self.conn.post_container(name, headers)
 
+    @handles_auth_errors
+    def list_objects(self, container, limit):
+        return self.conn.get_container(container, limit=limit)[1]
+
+    @handles_auth_errors
+    def empty_container(self, container, batch_size):
+        """
+        Removes every object of a container with bulk deletes of up to
+        batch_size objects. A missing container is already empty.
+        Returns how many objects were deleted.
+        """
+        deleted = 0
+
+        while True:
+            try:
+                objects = self.list_objects(container, batch_size)
+            except ClientException, err:
+                if err.http_status == 404:
+                    return deleted
+                raise
+
+            if not objects:
+                return deleted
+
+            paths = [u'/{}/{}'.format(container, obj['name']) for obj in objects]
+            result = self.conn._retry(None, bulk_delete, paths)
+
+            if result.get('Errors'):
+                raise ClientException('Bulk delete of <{}> failed: {}'.format(container, result['Errors']))
+
+            deleted += len(paths)
+
+    @handles_auth_errors
+    def delete_container(self, name):
+        try:
+            self.conn.delete_container(name)
+        except ClientException, err:
+            if err.http_status != 404:
+                raise
+
+    @handles_auth_errors
+    def container_exists(self, container):
+        try:
+            self.conn.head_container(container)
+        except ClientException, err:
+            if err.http_status == 404:
+                return False
+            raise
+
+        return True
+
+    @handles_auth_errors
+    def container_usage(self, container):
+        """
+        Bytes and objects stored on a container. A missing container is empty.
+        """
+        try:
+            headers = self.conn.head_container(container)
+        except ClientException, err:
+            if err.http_status == 404:
+                return {"bytes": 0, "objects": 0}
+            raise
+
+        return {"bytes": int(headers.get('x-container-bytes-used', 0)),
+                "objects": int(headers.get('x-container-object-count', 0))}
+
+    @handles_auth_errors
     def set_cors(self, container, url, append=True):
         if append:
-            cors_urls = self.get_cors(container)
-            url = '{} {}'.format(cors_urls, url).strip()
+            cors_urls = self.get_cors(container).split()
 
-        headers = {'X-Container-Meta-Access-Control-Allow-Origin': url}
-        self.conn.post_container(container, headers)
+            if all(origin in cors_urls for origin in url.split()):
+                return
+
+            url = '{} {}'.format(' '.join(cors_urls), url).strip()
 
+        self.write_cors(container, url)
+
+    @handles_auth_errors
     def unset_cors(self, container, url):
-        cors_urls = self.get_cors(container)
-        new_cors_urls = cors_urls.replace(url, '').strip()
+        cors_urls = self.get_cors(container).split()
+        removed = url.split()
+        new_cors_urls = ' '.join(origin for origin in cors_urls if origin not in removed)
+
+        self.write_cors(container, new_cors_urls)
 
-        headers = {'X-Container-Meta-Access-Control-Allow-Origin': new_cors_urls}
+    @handles_auth_errors
+    def write_cors(self, container, cors_urls):
+        headers = {'X-Container-Meta-Access-Control-Allow-Origin': cors_urls}
         self.conn.post_container(container, headers)
 
+    @handles_auth_errors
     def get_cors(self, container):
         headers = self.conn.head_container(container)
         cors_header = 'x-container-meta-access-control-allow-origin'
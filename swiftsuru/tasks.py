@@ -0,0 +1,41 @@
+"""
+Background tasks started once per API process
+"""
+from swiftsuru import conf, scheduler
+from swiftsuru.acl import PermitWorker
+from swiftsuru.health import HealthProber
+from swiftsuru.prewarm import TokenPrewarmer
+from swiftsuru.provisioning import ProvisioningWorker
+from swiftsuru.reaper import Reaper
+from swiftsuru.status import StatusProber
+from swiftsuru.usage import UsageSweeper
+from swiftsuru.warm_pool import WarmPoolFiller
+
+
+def start():
+    if conf.HEALTH_PROBE_ENABLED:
+        scheduler.start(HealthProber())
+
+    if conf.KEYSTONE_PREWARM_ENABLED:
+        scheduler.start(TokenPrewarmer())
+
+    # No job is queued while the service is deprecated
+    if conf.PROVISIONING_ENABLED and not conf.SERVICE_DEPRECATED:
+        for _ in range(conf.PROVISIONING_WORKERS):
+            scheduler.start(ProvisioningWorker())
+
+    # Instances are only claimed from the pool by POST /resources
+    if conf.WARM_POOL_ENABLED and not conf.SERVICE_DEPRECATED:
+        scheduler.start(WarmPoolFiller())
+
+    if conf.ENABLE_ACLAPI:
+        scheduler.start(PermitWorker())
+
+    if conf.REAPER_ENABLED:
+        scheduler.start(Reaper())
+
+    if conf.USAGE_SWEEP_ENABLED:
+        scheduler.start(UsageSweeper())
+
+    if conf.STATUS_PROBE_ENABLED:
+        scheduler.start(StatusProber())
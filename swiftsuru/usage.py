@@ -0,0 +1,113 @@
+"""
+Measures the bytes and objects stored by each instance, on its container
+and on its .trash- container, and keeps them on MongoDB, so reading the
+usage of an instance never reaches Swift.
+"""
+from datetime import datetime, timedelta
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.keystone_client import KeystoneClient
+from swiftsuru.scheduler import PeriodicTask
+from swiftsuru.swift_client import SwiftClient
+
+
+logger = utils.get_logger(__name__)
+
+# Fields of an instance document read by the sweeper
+SWEEP_FIELDS = {"name": 1, "container": 1, "plan": 1, "tenant": 1}
+
+
+def usage_status(name, usage):
+    """
+    Stored usage of an instance as answered by the API.
+    """
+    return {"name": name,
+            "bytes": usage["bytes"],
+            "objects": usage["objects"],
+            "container": usage["container"],
+            "trash": usage["trash"],
+            "updated_at": usage["updated_at"].isoformat()}
+
+
+class UsageSweeper(PeriodicTask):
+    """
+    Measures every instance not measured for USAGE_SWEEP_INTERVAL seconds.
+
+    Every process runs a sweeper, and each one claims its instances in
+    batches of USAGE_SWEEP_BATCH_SIZE, so an instance is measured by a
+    single process per interval. Up to USAGE_SWEEP_CONCURRENCY tenants of
+    a batch are swept at the same time.
+    """
+
+    def __init__(self):
+        super(UsageSweeper, self).__init__(conf.USAGE_SWEEP_INTERVAL,
+                                           conf.USAGE_SWEEP_JITTER)
+
+    def run_once(self):
+        db_cli = SwiftsuruDBClient()
+        # Fixed for the whole run, so instances claimed by it are not taken again
+        swept_before = datetime.utcnow() - timedelta(seconds=conf.USAGE_SWEEP_INTERVAL)
+
+        while True:
+            instances = db_cli.claim_instances("usage_swept_at", swept_before,
+                                               conf.USAGE_SWEEP_BATCH_SIZE, SWEEP_FIELDS)
+
+            if not instances:
+                return
+
+            self.sweep_batch(db_cli, instances)
+
+    def sweep_batch(self, db_cli, instances):
+        by_tenant = {}
+
+        for instance in instances:
+            tenant = instance.get("tenant")
+
+            if not tenant:
+                plan = db_cli.get_plan(instance.get("plan")) or {}
+                tenant = plan.get("tenant")
+
+            if not tenant:
+                logger.error("Instance <{}> has no valid plan, skipping".format(instance["name"]))
+                continue
+
+            by_tenant.setdefault(tenant, []).append(instance)
+
+        metrics.gauge("usage.pending", sum(len(instances) for instances in by_tenant.values()))
+
+        if by_tenant:
+            utils.map_concurrently(lambda tenant: self.sweep_tenant(tenant, by_tenant[tenant]),
+                                   sorted(by_tenant), conf.USAGE_SWEEP_CONCURRENCY)
+
+    def sweep_tenant(self, tenant, instances):
+        try:
+            keystone = KeystoneClient(tenant=tenant)
+        except Exception, err:
+            metrics.incr("usage.failed", len(instances))
+            logger.error("Fail to sweep usage of tenant <{}>: {}".format(tenant, err))
+            return
+
+        db_cli = SwiftsuruDBClient()
+
+        for instance in instances:
+            try:
+                with metrics.timer("usage.measure"):
+                    usage = self.measure(keystone, instance["container"])
+
+                db_cli.set_instance_usage(instance["name"], usage)
+                metrics.incr("usage.measured")
+            except Exception, err:
+                metrics.incr("usage.failed")
+                logger.error("Fail to measure usage of instance <{}>: {}".format(instance["name"], err))
+
+    def measure(self, keystone, container):
+        with SwiftClient(keystone) as client:
+            data = client.container_usage(container)
+            trash = client.container_usage('.trash-{}'.format(container))
+
+        return {"bytes": data["bytes"] + trash["bytes"],
+                "objects": data["objects"] + trash["objects"],
+                "container": data,
+                "trash": trash,
+                "updated_at": datetime.utcnow()}
@@ -4,9 +4,9 @@ Swiftsuru related services to Tsuru
 import logging
 import os
 import random
-import socket
 
-# from aclapiclient import Client, L4Opts
+from multiprocessing.pool import ThreadPool
+
 from swiftsuru import conf
 
 
@@ -14,6 +14,17 @@ def format_cors_url(host):
     return 'http://{host} https://{host}'.format(host=host)
 
 
+def storage_endpoint_bases(endpoints):
+    """
+    Keeps only the object-store URLs exported on bind.
+    """
+    return {
+        "adminURL": endpoints["adminURL"],
+        "publicURL": endpoints["publicURL"],
+        "internalURL": endpoints["internalURL"]
+    }
+
+
 def get_logger(name):
     logger = logging.getLogger(name)
     logger.addHandler(conf.LOG_HANDLER)
@@ -40,51 +51,33 @@ def generate_password(pw_length=8):
     return mypw
 
 
-def format_for_network_mask(ip):
+def map_concurrently(func, items, max_workers):
     """
-    Replaces last bit of an ip with 0.
+    Calls func for every item using at most max_workers threads.
+    Returns the results in the same order of items.
     """
-    m = ip.split(".")
-    m[-1] = "0"
-    return ".".join(m)
-
+    items = list(items)
 
-# aclcli = None
-# logger = get_logger(__name__)
+    if not items:
+        return []
 
+    pool = ThreadPool(min(max_workers, len(items)))
+    try:
+        # Pool.map raises on the first failure, while other items still run
+        results = [pool.apply_async(func, (item,)) for item in items]
 
-# def aclapi_cli():
-#     global aclcli
-#     if aclcli is None:
-#         aclcli = Client(conf.ACLAPI_USER, conf.ACLAPI_PASS, conf.ACLAPI_URL)
-#     return aclcli
+        for result in results:
+            result.wait()
 
+        return [result.get() for result in results]
+    finally:
+        pool.close()
 
-# def permit_keystone_access(unit_host):
-#     global logger
 
-#     logger.info("Permitting access to keystone host...")
-#     logger.info("Host is: {} port: {}; unit host is: {}".format(conf.KEYSTONE_HOST, conf.KEYSTONE_PORT, unit_host))
-#     l4_opts = L4Opts("eq", conf.KEYSTONE_PORT, "dest")
-#     resp = aclapi_cli().add_tcp_permit_access(
-#         desc="keystone access (swift service) for tsuru unit: {}".format(unit_host),
-#         source="{}/24".format(format_for_network_mask(unit_host)),
-#         dest="{}/32".format(socket.gethostbyname(conf.KEYSTONE_HOST)),
-#         l4_opts=l4_opts
-#     )
-#     logger.info("Response is: {} - {}".format(resp.status_code, resp.content))
-
-
-# def permit_swift_access(unit_host):
-#     global logger
-
-#     logger.info("Permitting access to swift host...")
-#     logger.info("Host is: {} port: {}; unit host is: {}".format(conf.SWIFT_API_HOST, conf.SWIFT_API_PORT, unit_host))
-#     l4_opts = L4Opts("eq", conf.SWIFT_API_PORT, "dest")
-#     resp = aclapi_cli().add_tcp_permit_access(
-#         desc="swift api access (swift service) for tsuru unit: {}".format(unit_host),
-#         source="{}/24".format(format_for_network_mask(unit_host)),
-#         dest="{}/32".format(socket.gethostbyname(conf.SWIFT_API_HOST)),
-#         l4_opts=l4_opts
-#     )
-#     logger.info("Response is: {} - {}".format(resp.status_code, resp.content))
+def format_for_network_mask(ip):
+    """
+    Replaces last bit of an ip with 0.
+    """
+    m = ip.split(".")
+    m[-1] = "0"
+    return ".".join(m)
@@ -0,0 +1,115 @@
+"""
+Keeps Keystone users and Swift containers created ahead of time for each
+plan, so adding an instance only has to claim one of them on MongoDB.
+
+The depth of the pool and how many instances are created at the same time
+come from the "warm_pool_depth" and "warm_pool_concurrency" fields of each
+plan, or from WARM_POOL_DEPTH and WARM_POOL_CONCURRENCY.
+"""
+from datetime import datetime, timedelta
+
+from swiftsuru import conf, metrics, utils
+from swiftsuru.dbclient import SwiftsuruDBClient
+from swiftsuru.provisioning import Provisioner
+from swiftsuru.scheduler import PeriodicTask
+
+
+logger = utils.get_logger(__name__)
+
+
+def pool_depth(plan):
+    return int(plan.get("warm_pool_depth", conf.WARM_POOL_DEPTH))
+
+
+def pool_concurrency(plan):
+    return int(plan.get("warm_pool_concurrency", conf.WARM_POOL_CONCURRENCY))
+
+
+def release_slot(db_cli, slot):
+    """
+    Gives a claimed slot back to the warm pool, or drops it when an
+    instance was recorded with its container anyway.
+    """
+    if db_cli.get_instance_by_container(slot["container"]):
+        db_cli.remove_warm_instance(slot["_id"])
+    else:
+        db_cli.release_warm_instance(slot["_id"])
+        metrics.incr("warm_pool.released")
+
+
+class WarmPoolFiller(PeriodicTask):
+    """
+    Tops up the warm pool of every plan with a tenant.
+
+    Every process runs a filler, but the pool of a plan is only filled by
+    the one holding it on MongoDB. Each new instance also takes a slot and
+    gives it back when there are already `depth` older slots, so the pool
+    never goes past its depth when a filler outlives its hold.
+    """
+
+    def __init__(self):
+        super(WarmPoolFiller, self).__init__(conf.WARM_POOL_INTERVAL,
+                                             conf.WARM_POOL_JITTER)
+
+    def run_once(self):
+        db_cli = SwiftsuruDBClient()
+
+        stale_before = datetime.utcnow() - timedelta(seconds=conf.WARM_POOL_STALE_AFTER)
+        db_cli.remove_stale_warm_instances(stale_before)
+
+        for slot in db_cli.list_stale_claimed_warm_instances(stale_before):
+            release_slot(db_cli, slot)
+
+        for plan in db_cli.list_plans():
+            depth = pool_depth(plan)
+
+            if depth <= 0 or not plan.get("tenant"):
+                continue
+
+            until = datetime.utcnow() + timedelta(seconds=conf.WARM_POOL_STALE_AFTER)
+
+            if not db_cli.claim_warm_pool(plan["name"], until):
+                continue
+
+            try:
+                self.top_up(db_cli, plan, depth)
+            finally:
+                db_cli.release_warm_pool(plan["name"])
+
+    def top_up(self, db_cli, plan, depth):
+        missing = depth - db_cli.count_warm_instances(plan["name"])
+        metrics.gauge("warm_pool.{}.missing".format(plan["name"]), max(missing, 0))
+
+        if missing > 0:
+            utils.map_concurrently(lambda _: self.fill(plan, depth),
+                                   range(missing), pool_concurrency(plan))
+
+    def fill(self, plan, depth):
+        db_cli = SwiftsuruDBClient()
+        slot_id = db_cli.reserve_warm_instance(plan["name"], plan["tenant"])
+
+        if db_cli.count_warm_instances(plan["name"], before=slot_id) >= depth:
+            db_cli.remove_warm_instance(slot_id)
+            return
+
+        params = {"tenant": plan["tenant"],
+                  "user": "swiftsuru_{}".format(utils.generate_container_name()),
+                  "password": utils.generate_password(),
+                  "container": utils.generate_container_name()}
+
+        try:
+            with metrics.timer("warm_pool.fill"):
+                provisioner = Provisioner(None, params)
+                provisioner.keystone_user()
+                provisioner.containers()
+                endpoints = provisioner.endpoints()
+        except Exception, err:
+            metrics.incr("warm_pool.fill_failed")
+            logger.error("Fail to fill warm pool of plan <{}>: {}".format(plan["name"], err))
+
+            db_cli.remove_warm_instance(slot_id)
+            return
+
+        db_cli.fill_warm_instance(slot_id, params["user"], params["password"],
+                                  params["container"], endpoints)
+        metrics.incr("warm_pool.filled")
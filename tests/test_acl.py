@@ -0,0 +1,131 @@
+import unittest
+
+from mock import call, patch
+
+from swiftsuru import acl
+
+
+@patch("swiftsuru.acl.conf.SWIFT_API_PORT", "35357")
+@patch("swiftsuru.acl.conf.SWIFT_API_HOST", "swift.host")
+@patch("swiftsuru.acl.conf.KEYSTONE_PORT", "5000")
+@patch("swiftsuru.acl.conf.KEYSTONE_HOST", "keystone.host")
+@patch("swiftsuru.acl.SwiftsuruDBClient")
+@patch("swiftsuru.acl.socket.gethostbyname")
+class PermitUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        acl.dns_cache.clear()
+        acl.granted.clear()
+        acl.queued.clear()
+
+    def addresses(self, host):
+        return {"keystone.host": "10.0.0.1", "swift.host": "10.0.0.2"}[host]
+
+    def test_unit_permits_are_per_network(self, gethostbyname_mock, dbclient_mock):
+        gethostbyname_mock.side_effect = self.addresses
+
+        computed = acl.unit_permits("10.4.3.2")
+
+        self.assertEqual(sorted(computed), ["10.4.3.0/24>10.0.0.1/32:5000",
+                                            "10.4.3.0/24>10.0.0.2/32:35357"])
+
+    def test_units_of_a_permitted_network_queue_nothing(self, gethostbyname_mock, dbclient_mock):
+        gethostbyname_mock.side_effect = self.addresses
+
+        self.assertEqual(acl.permit_unit("10.4.3.2"), 2)
+        self.assertEqual(acl.permit_unit("10.4.3.3"), 0)
+
+        acl.granted.set("10.4.4.0/24>10.0.0.1/32:5000", True)
+        self.assertEqual(acl.permit_unit("10.4.4.2"), 1)
+
+    def test_hosts_are_resolved_once(self, gethostbyname_mock, dbclient_mock):
+        gethostbyname_mock.side_effect = self.addresses
+
+        acl.permit_unit("10.4.3.2")
+        acl.permit_unit("10.4.5.2")
+
+        self.assertEqual(gethostbyname_mock.call_count, 2)
+
+    def test_permits_are_queued_on_mongodb(self, gethostbyname_mock, dbclient_mock):
+        gethostbyname_mock.side_effect = self.addresses
+
+        acl.permit_unit("10.4.3.2")
+
+        queue_acl_permit = dbclient_mock.return_value.queue_acl_permit
+        self.assertEqual(sorted(args[0] for args, _ in queue_acl_permit.call_args_list),
+                         ["10.4.3.0/24>10.0.0.1/32:5000", "10.4.3.0/24>10.0.0.2/32:35357"])
+        self.assertEqual(queue_acl_permit.call_args_list[0][0][1]["unit_host"], "10.4.3.2")
+
+    def test_permits_failing_to_be_queued_are_queued_again(self, gethostbyname_mock, dbclient_mock):
+        gethostbyname_mock.side_effect = self.addresses
+        dbclient_mock.return_value.queue_acl_permit.side_effect = Exception("mongodb is down")
+
+        self.assertRaises(Exception, acl.permit_unit, "10.4.3.2")
+
+        dbclient_mock.return_value.queue_acl_permit.side_effect = None
+        self.assertEqual(acl.permit_unit("10.4.3.2"), 2)
+
+
+@patch("swiftsuru.acl.L4Opts")
+@patch("swiftsuru.acl.aclapi_cli")
+@patch("swiftsuru.acl.SwiftsuruDBClient")
+class PermitWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        acl.granted.clear()
+
+    def claimed(self, dbclient_mock, *keys):
+        dbclient_mock.return_value.claim_acl_permits.return_value = [
+            {"_id": key, "name": "keystone", "source": "10.4.{}.0/24".format(i), "dest": "10.0.0.1/32",
+             "port": "5000", "unit_host": "10.4.3.2", "status": "sending"}
+            for i, key in enumerate(keys)]
+
+    def test_queued_permits_are_sent_with_one_commit(self, dbclient_mock, aclapi_cli_mock, l4_opts_mock):
+        dbclient_mock.return_value.list_acl_permits.return_value = []
+        self.claimed(dbclient_mock, "a", "b")
+
+        acl.PermitWorker().run_once()
+
+        client = aclapi_cli_mock.return_value
+        self.assertEqual(client.add_tcp_permit_access.call_count, 2)
+        client.commit.assert_called_once_with()
+        l4_opts_mock.assert_called_with("eq", "5000", "dest")
+        self.assertEqual(dbclient_mock.return_value.add_acl_permit.call_count, 2)
+        self.assertTrue(acl.granted.get("a"))
+
+    def test_permits_granted_on_mongodb_are_not_sent(self, dbclient_mock, aclapi_cli_mock, l4_opts_mock):
+        dbclient_mock.return_value.list_acl_permits.return_value = ["a"]
+        self.claimed(dbclient_mock, "a")
+
+        acl.PermitWorker().run_once()
+
+        self.assertFalse(aclapi_cli_mock.return_value.commit.called)
+        dbclient_mock.return_value.add_acl_permit.assert_called_once_with("a")
+
+    def test_failed_permits_are_queued_again(self, dbclient_mock, aclapi_cli_mock, l4_opts_mock):
+        dbclient_mock.return_value.list_acl_permits.return_value = []
+        aclapi_cli_mock.return_value.commit.side_effect = Exception("aclapi is down")
+        self.claimed(dbclient_mock, "a")
+
+        self.assertRaises(Exception, acl.PermitWorker().run_once)
+
+        dbclient_mock.return_value.release_acl_permits.assert_called_once_with(["a"])
+        self.assertFalse(dbclient_mock.return_value.add_acl_permit.called)
+        self.assertFalse(acl.granted.get("a"))
+
+    @patch("swiftsuru.acl.conf.ACLAPI_GRANTED_RELOAD_INTERVAL", 300)
+    @patch("swiftsuru.acl.time.time")
+    def test_granted_permits_are_reloaded_periodically(self, time_mock, dbclient_mock, aclapi_cli_mock, l4_opts_mock):
+        dbclient_mock.return_value.claim_acl_permits.return_value = []
+        list_acl_permits = dbclient_mock.return_value.list_acl_permits
+        list_acl_permits.return_value = []
+        worker = acl.PermitWorker()
+
+        time_mock.return_value = 1000
+        worker.run_once()
+        time_mock.return_value = 1299
+        worker.run_once()
+        time_mock.return_value = 1300
+        worker.run_once()
+
+        self.assertEqual(list_acl_permits.call_args_list, [call(), call()])
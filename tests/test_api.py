@@ -1,11 +1,13 @@
 import json
 import logging
+import threading
+import time
 import unittest
-from collections import Counter
+from datetime import datetime
 from mock import patch, Mock, call
 from bogus.server import Bogus
 
-from swiftsuru import app, conf
+from swiftsuru import app, conf, api, metrics
 
 
 class APITest(unittest.TestCase):
@@ -14,9 +16,50 @@ class APITest(unittest.TestCase):
         self.maxDiff = None
         self.client = app.test_client()
         self.content_type = "application/x-www-form-urlencoded"
+        api.bind_responses.clear()
+        api.plan_cache.clear()
+        metrics.reset()
 
         logging.disable(logging.CRITICAL)
 
+    def tearDown(self):
+        api.close_bind_pool()
+
+    def test_close_bind_pool_stops_its_threads(self):
+        pool = api.get_bind_pool()
+        self.assertEqual(pool.apply_async(lambda: 42).get(1), 42)
+
+        api.close_bind_pool()
+
+        self.assertFalse(any(worker.is_alive() for worker in pool._pool))
+        self.assertIsNot(api.get_bind_pool(), pool)
+
+    @patch("swiftsuru.api.conf.BIND_REFRESH_WORKERS", 1)
+    @patch("swiftsuru.api._bind_instance")
+    def test_stale_binds_are_refreshed_on_a_bounded_pool(self, bind_instance_mock):
+        release = threading.Event()
+        threads = set()
+
+        def slow_bind(instance_name, app_host=None):
+            threads.add(threading.current_thread())
+            release.wait(5)
+            return {"SWIFT_CONTAINER": "fresh"}, 201
+
+        bind_instance_mock.side_effect = slow_bind
+
+        with patch("swiftsuru.api.conf.BIND_LATENCY_BUDGET", 0.01):
+            for name in ("first", "second", "third"):
+                api.bind_responses.set(name, ({"SWIFT_CONTAINER": "stale"}, time.time()))
+                self.client.post("/resources/{}/bind".format(name),
+                                 data="unit-host=10.4.3.2",
+                                 content_type=self.content_type)
+
+        release.set()
+        api.close_bind_pool()
+
+        self.assertEqual(bind_instance_mock.call_count, 3)
+        self.assertEqual(len(threads), 1)
+
     def test_add_instance(self):
         data = "name=myinstance&plan=small&team=myteam"
         response = self.client.post("/resources",
@@ -44,6 +87,180 @@ class APITest(unittest.TestCase):
 
         self.assertEqual(response.status_code, 500)
 
+    @patch("swiftsuru.api.conf.SERVICE_DEPRECATED", False)
+    @patch("swiftsuru.api.provisioning.enqueue_instance")
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_add_instance_queues_provisioning_and_returns_201(self, dbclient_mock, enqueue_mock):
+        dbclient_mock.return_value.get_plan.return_value = {"name": "small", "tenant": "infra"}
+        dbclient_mock.return_value.get_instance.return_value = None
+        dbclient_mock.return_value.get_job.return_value = None
+        dbclient_mock.return_value.claim_warm_instance.return_value = None
+
+        data = "name=myinstance&plan=small&team=myteam"
+        response = self.client.post("/resources",
+                                    data=data,
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 201)
+        enqueue_mock.assert_called_once_with("myinstance", "myteam", "small", "infra")
+
+    @patch("swiftsuru.api.conf.SERVICE_DEPRECATED", False)
+    @patch("swiftsuru.api.provisioning.enqueue_instance")
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_add_instance_claims_from_warm_pool(self, dbclient_mock, enqueue_mock):
+        dbclient_mock.return_value.get_plan.return_value = {"name": "small", "tenant": "infra"}
+        dbclient_mock.return_value.get_instance.return_value = None
+        dbclient_mock.return_value.get_job.return_value = None
+        dbclient_mock.return_value.claim_warm_instance.return_value = {"_id": "slot_id",
+                                                                       "tenant": "infra",
+                                                                       "user": "swiftsuru_a1b2c3",
+                                                                       "password": "s3cr3t",
+                                                                       "container": "e2opim",
+                                                                       "endpoints": {"publicURL": "http://public"}}
+
+        data = "name=myinstance&plan=small&team=myteam"
+        response = self.client.post("/resources",
+                                    data=data,
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(enqueue_mock.called)
+        dbclient_mock.return_value.claim_warm_instance.assert_called_once_with("small")
+        dbclient_mock.return_value.add_instance.assert_called_once_with(
+            "myinstance", "myteam", "e2opim", "small", "swiftsuru_a1b2c3", "s3cr3t",
+            tenant="infra", endpoints={"publicURL": "http://public"})
+        dbclient_mock.return_value.remove_warm_instance.assert_called_once_with("slot_id")
+
+    @patch("swiftsuru.api.conf.SERVICE_DEPRECATED", False)
+    @patch("swiftsuru.api.provisioning.enqueue_instance")
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_add_instance_releases_warm_slot_on_failure(self, dbclient_mock, enqueue_mock):
+        dbclient_mock.return_value.get_plan.return_value = {"name": "small", "tenant": "infra"}
+        dbclient_mock.return_value.get_instance.return_value = None
+        dbclient_mock.return_value.get_job.return_value = None
+        dbclient_mock.return_value.get_instance_by_container.return_value = None
+        dbclient_mock.return_value.claim_warm_instance.return_value = {"_id": "slot_id",
+                                                                       "tenant": "infra",
+                                                                       "user": "swiftsuru_a1b2c3",
+                                                                       "password": "s3cr3t",
+                                                                       "container": "e2opim",
+                                                                       "endpoints": {}}
+        dbclient_mock.return_value.add_instance.side_effect = Exception("mongo is down")
+
+        data = "name=myinstance&plan=small&team=myteam"
+        response = self.client.post("/resources",
+                                    data=data,
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 500)
+        dbclient_mock.return_value.release_warm_instance.assert_called_once_with("slot_id")
+        self.assertFalse(dbclient_mock.return_value.remove_warm_instance.called)
+
+    @patch("swiftsuru.api.conf.SERVICE_DEPRECATED", False)
+    @patch("swiftsuru.api.provisioning.enqueue_instance")
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_add_instance_being_provisioned_returns_409(self, dbclient_mock, enqueue_mock):
+        dbclient_mock.return_value.get_plan.return_value = {"name": "small", "tenant": "infra"}
+        dbclient_mock.return_value.get_instance.return_value = None
+        dbclient_mock.return_value.get_job.return_value = {"status": "running"}
+
+        data = "name=myinstance&plan=small&team=myteam"
+        response = self.client.post("/resources",
+                                    data=data,
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(enqueue_mock.called)
+
+    @patch("swiftsuru.api.conf.SERVICE_DEPRECATED", False)
+    @patch("swiftsuru.api.provisioning.enqueue_instance")
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_add_instance_deleted_but_not_reaped_returns_409(self, dbclient_mock, enqueue_mock):
+        dbclient_mock.return_value.get_plan.return_value = {"name": "small", "tenant": "infra"}
+        dbclient_mock.return_value.get_instance.return_value = {"name": "myinstance", "deleted": True}
+        dbclient_mock.return_value.get_job.return_value = None
+
+        data = "name=myinstance&plan=small&team=myteam"
+        response = self.client.post("/resources",
+                                    data=data,
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 409)
+        dbclient_mock.return_value.get_instance.assert_called_once_with("myinstance", include_deleted=True)
+        self.assertFalse(enqueue_mock.called)
+
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_show_provisioning(self, dbclient_mock):
+        dbclient_mock.return_value.get_job.return_value = {"name": "myinstance",
+                                                           "status": "running",
+                                                           "steps": ["keystone_user"],
+                                                           "attempts": 1,
+                                                           "error": None,
+                                                           "created_at": datetime(2016, 1, 1),
+                                                           "updated_at": datetime(2016, 1, 1),
+                                                           "params": {"password": "s3cr3t"}}
+
+        response = self.client.get("/resources/myinstance/provisioning")
+        computed = json.loads(response.get_data())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(computed["status"], "running")
+        self.assertNotIn("s3cr3t", response.get_data())
+
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_show_provisioning_of_unknown_instance_returns_404(self, dbclient_mock):
+        dbclient_mock.return_value.get_job.return_value = None
+        dbclient_mock.return_value.get_instance.return_value = None
+
+        response = self.client.get("/resources/myinstance/provisioning")
+
+        self.assertEqual(response.status_code, 404)
+
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_show_usage_serves_stored_usage(self, dbclient_mock):
+        dbclient_mock.return_value.get_instance_usage.return_value = {
+            "bytes": 15, "objects": 3,
+            "container": {"bytes": 10, "objects": 2},
+            "trash": {"bytes": 5, "objects": 1},
+            "updated_at": datetime(2016, 1, 1)}
+
+        response = self.client.get("/resources/myinstance/usage")
+        computed = json.loads(response.get_data())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(computed["bytes"], 15)
+        self.assertEqual(computed["trash"]["objects"], 1)
+        self.assertEqual(computed["updated_at"], "2016-01-01T00:00:00")
+        dbclient_mock.return_value.get_instance_usage.assert_called_once_with("myinstance")
+
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_show_usage_not_measured_yet_returns_202(self, dbclient_mock):
+        dbclient_mock.return_value.get_instance_usage.return_value = {}
+
+        response = self.client.get("/resources/myinstance/usage")
+
+        self.assertEqual(response.status_code, 202)
+
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_show_usage_of_unknown_instance_returns_404(self, dbclient_mock):
+        dbclient_mock.return_value.get_instance_usage.return_value = None
+
+        response = self.client.get("/resources/myinstance/usage")
+
+        self.assertEqual(response.status_code, 404)
+
+    @patch("swiftsuru.api.instance_status")
+    def test_show_status_maps_states_to_tsuru_status_codes(self, instance_status_mock):
+        for state, status_code in [("up", 204), ("pending", 202), ("missing", 404), ("down", 500)]:
+            instance_status_mock.return_value = {"state": state, "reason": "Container does not exist"}
+
+            response = self.client.get("/resources/myinstance/status")
+
+            self.assertEqual(response.status_code, status_code)
+
+        self.assertEqual(response.get_data(), "Container does not exist")
+        instance_status_mock.assert_called_with("myinstance")
+
     @patch("swiftsuru.api.SwiftsuruDBClient")
     def test_remove_instance_returns_200(self, dbclient_mock):
         response = self.client.delete("/resources/my_instance")
@@ -69,11 +286,11 @@ class APITest(unittest.TestCase):
             "internalURL": "http://localhost"
         }
 
-    @patch("swiftsuru.api.SwiftClient")
+    @patch("swiftsuru.api.cors.add_hosts")
     @patch("swiftsuru.api.KeystoneClient")
     @patch("swiftsuru.api.SwiftsuruDBClient")
     @patch("swiftsuru.api.utils.conf")
-    def test_bind_app_export_swift_enviroments_and_returns_201(self, conf_mock, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+    def test_bind_app_export_swift_enviroments_and_returns_201(self, conf_mock, dbclient_mock, keystoneclient_mock, add_hosts_mock):
         bog = Bogus()
         bog.register(("/api/ipv4/acl/10.4.3.2/24", lambda: ("{}", 200)),
                      method="PUT",
@@ -81,13 +298,12 @@ class APITest(unittest.TestCase):
         url = bog.serve()
         self._mock_confs(url, conf_mock)
 
-        dbclient_mock.return_value.get_plan.return_value = {'tenant': 'tenant_name'}
-        dbclient_mock.return_value.get_instance.return_value = {"name": 'instance_name',
-                                                                "team": 'instance_team',
-                                                                "container": 'instance_container',
-                                                                "plan": 'instance_plan',
-                                                                "user": 'instance_user',
-                                                                "password": 'instance_password'}
+        dbclient_mock.return_value.get_bind_info.return_value = {"name": 'instance_name',
+                                                                 "container": 'instance_container',
+                                                                 "plan": 'instance_plan',
+                                                                 "tenant": 'tenant_name',
+                                                                 "user": 'instance_user',
+                                                                 "password": 'instance_password'}
 
         self._keystoneclient_mock(keystoneclient_mock)
 
@@ -114,18 +330,21 @@ class APITest(unittest.TestCase):
         for key in expected_keys:
             self.assertIn(key, computed.keys())
 
-    @patch("swiftsuru.api.SwiftClient.set_cors")
+        add_hosts_mock.assert_called_once_with(dbclient_mock.return_value.get_bind_info.return_value,
+                                               ["myapp.cloud.tsuru.io"])
+
+    @patch("swiftsuru.api.cors.add_hosts")
     @patch("swiftsuru.api.KeystoneClient")
     @patch("swiftsuru.api.SwiftsuruDBClient")
     @patch("swiftsuru.api.utils.conf")
-    def test_bind_app_should_set_cors(self, conf_mock, dbclient_mock, keystoneclient_mock, set_cors_mock):
-
-        dbclient_mock.return_value.get_instance.return_value = {"name": 'instance_name',
-                                                                "team": 'instance_team',
-                                                                "container": 'instance_container',
-                                                                "plan": 'instance_plan',
-                                                                "user": 'instance_user',
-                                                                "password": 'instance_password'}
+    def test_bind_app_should_set_cors(self, conf_mock, dbclient_mock, keystoneclient_mock, add_hosts_mock):
+        instance = {"name": 'instance_name',
+                    "container": 'instance_container',
+                    "plan": 'instance_plan',
+                    "tenant": 'tenant_name',
+                    "user": 'instance_user',
+                    "password": 'instance_password'}
+        dbclient_mock.return_value.get_bind_info.return_value = instance
 
         self._keystoneclient_mock(keystoneclient_mock)
 
@@ -134,10 +353,10 @@ class APITest(unittest.TestCase):
                              data=data,
                              content_type=self.content_type)
 
-        self.assertTrue(set_cors_mock.called)
-        set_cors_mock.assert_called_once_with('instance_container', 'http://myapp.cloud.tsuru.io https://myapp.cloud.tsuru.io')
+        self.assertTrue(add_hosts_mock.called)
+        add_hosts_mock.assert_called_once_with(instance, ['myapp.cloud.tsuru.io'])
 
-    @patch("swiftsuru.api.SwiftClient.set_cors")
+    @patch("swiftsuru.api.cors.add_hosts")
     @patch("swiftsuru.api.KeystoneClient")
     @patch("swiftsuru.api.SwiftsuruDBClient")
     @patch("swiftsuru.api.conf")
@@ -153,66 +372,32 @@ class APITest(unittest.TestCase):
 
         self.assertFalse(set_cors_mock.called)
 
-    # @patch("swiftsuru.api.KeystoneClient")
-    # @patch("swiftsuru.api.SwiftsuruDBClient")
-    # @patch("swiftsuru.api.utils.conf", ENABLE_ACLAPI=True)
-    # @patch("swiftsuru.api.conf", ENABLE_ACLAPI=True)
-    # def test_bind_unit_calls_aclapi_to_liberate_keystone_through_aclapiclient(self, _, conf_mock, __, keystoneclient_mock):
-    #     self._keystoneclient_mock(keystoneclient_mock)
-    #     bog = Bogus()
-    #     bog.register(("/api/ipv4/acl/10.4.3.0/24", lambda: ("{}", 200)),
-    #                  method="PUT",
-    #                  headers={"Location": "/api/jobs/1"})
-    #     url = bog.serve()
-    #     self._mock_confs(url, conf_mock)
-    #     data = "app-host=myapp.cloud.tsuru.io&unit-host=10.4.3.2"
-    #     response = self.client.post("/resources/instance_name/bind",
-    #                                 data=data,
-    #                                 content_type=self.content_type)
-
-    #     self.assertEqual(response.status_code, 201)
-    #     self.assertIn("/api/ipv4/acl/10.4.3.0/24", bog.called_paths)
-
-    # @patch("swiftsuru.api.KeystoneClient")
-    # @patch("swiftsuru.api.SwiftsuruDBClient")
-    # @patch("swiftsuru.api.utils.conf")
-    # @patch("swiftsuru.api.conf", ENABLE_ACLAPI=True)
-    # def test_bind_calls_aclapi_to_liberate_swift_through_aclapiclient(self, _, conf_mock, __, keystoneclient_mock):
-    #     self._keystoneclient_mock(keystoneclient_mock)
-    #     Bogus.called_paths = []
-    #     bog = Bogus()
-    #     bog.register(("/api/ipv4/acl/10.4.3.0/24", lambda: ("{}", 200)),
-    #                  method="PUT",
-    #                  headers={"Location": "/api/jobs/1"})
-    #     url = bog.serve()
-    #     self._mock_confs(url, conf_mock)
-    #     data = "app-host=myapp.cloud.tsuru.io&unit-host=10.4.3.2"
-    #     response = self.client.post("/resources/instance_name/bind",
-    #                                 data=data,
-    #                                 content_type=self.content_type)
-
-    #     self.assertEqual(response.status_code, 201)
-    #     self.assertIn("/api/ipv4/acl/10.4.3.0/24", bog.called_paths)
-    #     count = Counter(bog.called_paths)
-    #     self.assertEqual(count["/api/ipv4/acl/10.4.3.0/24"], 2)
-
-    # @patch("swiftsuru.api.KeystoneClient")
-    # @patch("swiftsuru.api.SwiftsuruDBClient")
-    # @patch("swiftsuru.api.conf")
-    # def test_bind_doesnt_call_aclapi_when_conf_is_false(self, conf_mock, dbclient_mock, keystoneclient_mock):
-    #     self._keystoneclient_mock(keystoneclient_mock)
-    #     Bogus.called_paths = []
-    #     bog = Bogus()
-    #     url = bog.serve()
-    #     self._mock_confs(url, conf_mock)
-    #     conf_mock.ENABLE_ACLAPI = False
-
-    #     data = "app-host=myapp.cloud.tsuru.io&unit-host=10.4.3.2"
-    #     response = self.client.post("/resources/instance_name/bind",
-    #                                 data=data,
-    #                                 content_type=self.content_type)
-    #     self.assertEqual(response.status_code, 201)
-    #     self.assertNotIn("/api/ipv4/acl/10.4.3.2/24", bog.called_paths)
+    @patch("swiftsuru.api.acl.permit_unit")
+    @patch("swiftsuru.api._bind_instance")
+    @patch("swiftsuru.api.conf.ENABLE_ACLAPI", True)
+    def test_bind_unit_queues_aclapi_permits(self, bind_instance_mock, permit_unit_mock):
+        bind_instance_mock.return_value = ({"SWIFT_CONTAINER": "instance_container"}, 201)
+        permit_unit_mock.return_value = 2
+
+        response = self.client.post("/resources/instance_name/bind",
+                                    data="unit-host=10.4.3.2",
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 201)
+        permit_unit_mock.assert_called_once_with("10.4.3.2")
+
+    @patch("swiftsuru.api.acl.permit_unit")
+    @patch("swiftsuru.api._bind_instance")
+    @patch("swiftsuru.api.conf.ENABLE_ACLAPI", False)
+    def test_bind_doesnt_call_aclapi_when_conf_is_false(self, bind_instance_mock, permit_unit_mock):
+        bind_instance_mock.return_value = ({"SWIFT_CONTAINER": "instance_container"}, 201)
+
+        response = self.client.post("/resources/instance_name/bind",
+                                    data="unit-host=10.4.3.2",
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(permit_unit_mock.called)
 
     @patch("swiftclient.client.Connection.get_auth")
     def test_unbind_returns_200(self, get_auth_mock):
@@ -220,28 +405,283 @@ class APITest(unittest.TestCase):
         response = self.client.delete("/resources/my-swift/bind", data=data, content_type=self.content_type)
         self.assertEqual(response.status_code, 200)
 
-    @patch("swiftsuru.api.KeystoneClient")
-    @patch('swiftsuru.api.SwiftClient.unset_cors')
+    @patch('swiftsuru.api.cors.remove_hosts')
     @patch("swiftsuru.api.SwiftsuruDBClient")
     @patch("swiftsuru.api.utils.conf")
-    def test_unbind_app_calls_unset_cors(self, conf_mock, dbclient_mock, unset_cors_mock, keystoneclient_mock):
-
-        dbclient_mock.return_value.get_instance.return_value = {"name": 'instance_name',
-                                                                "team": 'instance_team',
-                                                                "container": 'instance_container',
-                                                                "plan": 'instance_plan',
-                                                                "user": 'instance_user',
-                                                                "password": 'instance_password'}
-
-        self._keystoneclient_mock(keystoneclient_mock)
+    def test_unbind_app_calls_unset_cors(self, conf_mock, dbclient_mock, remove_hosts_mock):
+        instance = {"name": 'instance_name',
+                    "container": 'instance_container',
+                    "plan": 'instance_plan',
+                    "tenant": 'tenant_name',
+                    "user": 'instance_user',
+                    "password": 'instance_password'}
+        dbclient_mock.return_value.get_bind_info.return_value = instance
 
         data = "app-host=myapp.cloud.tsuru.io"
         _ = self.client.delete("/resources/instance_name/bind-app",
                                data=data,
                                content_type=self.content_type)
 
-        self.assertTrue(unset_cors_mock.called)
-        unset_cors_mock.assert_called_once_with('instance_container', u'http://myapp.cloud.tsuru.io https://myapp.cloud.tsuru.io')
+        self.assertTrue(remove_hosts_mock.called)
+        remove_hosts_mock.assert_called_once_with(instance, [u'myapp.cloud.tsuru.io'])
+
+    @patch('swiftsuru.api.cors.remove_hosts')
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_unbind_app_returns_500_when_cors_fails(self, dbclient_mock, remove_hosts_mock):
+        dbclient_mock.return_value.get_bind_info.return_value = {"name": 'instance_name'}
+        remove_hosts_mock.side_effect = Exception("Swift is down")
+
+        response = self.client.delete("/resources/instance_name/bind-app",
+                                      data="app-host=myapp.cloud.tsuru.io",
+                                      content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 500)
+
+    @patch("swiftsuru.api.KeystoneClient")
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_bind_unit_uses_endpoints_stored_on_instance(self, dbclient_mock, keystoneclient_mock):
+        dbclient_mock.return_value.get_bind_info.return_value = {"name": 'instance_name',
+                                                                 "container": 'instance_container',
+                                                                 "plan": 'instance_plan',
+                                                                 "tenant": 'tenant_name',
+                                                                 "endpoints": {"adminURL": "http://admin",
+                                                                               "publicURL": "http://public",
+                                                                               "internalURL": "http://internal"},
+                                                                 "user": 'instance_user',
+                                                                 "password": 'instance_password'}
+
+        response = self.client.post("/resources/instance_name/bind",
+                                    data="unit-host=10.4.3.2",
+                                    content_type=self.content_type)
+
+        computed = json.loads(response.get_data())
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(computed["SWIFT_PUBLIC_URL"], "http://public/instance_container")
+        self.assertEqual(computed["SWIFT_TENANT"], "tenant_name")
+        self.assertFalse(keystoneclient_mock.called)
+
+    @patch("swiftsuru.api.cors.add_hosts")
+    @patch("swiftsuru.api.KeystoneClient")
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_bind_app_updates_cors_while_fetching_endpoints(self, dbclient_mock, keystoneclient_mock, add_hosts_mock):
+        dbclient_mock.return_value.get_bind_info.return_value = {"name": 'instance_name',
+                                                                 "container": 'instance_container',
+                                                                 "tenant": 'tenant_name'}
+        cors_started = threading.Event()
+
+        def add_hosts(instance, hosts):
+            cors_started.set()
+            time.sleep(0.2)
+
+        def get_storage_endpoints():
+            # Fails the bind unless CORS is already running concurrently
+            self.assertTrue(cors_started.wait(1))
+            return {"adminURL": "http://admin",
+                    "publicURL": "http://public",
+                    "internalURL": "http://internal"}
+
+        add_hosts_mock.side_effect = add_hosts
+        keystoneclient_mock.return_value.get_storage_endpoints.side_effect = get_storage_endpoints
+
+        response = self.client.post("/resources/instance_name/bind-app",
+                                    data="app-host=myapp.cloud.tsuru.io",
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 201)
+        add_hosts_mock.assert_called_once_with(dbclient_mock.return_value.get_bind_info.return_value,
+                                               ["myapp.cloud.tsuru.io"])
+
+        timings = metrics.snapshot()["timings"]
+        self.assertGreaterEqual(timings["bind.step.cors"]["max"], 0.2)
+        self.assertIn("bind.step.endpoints", timings)
+        self.assertIn("bind.step.resolve_unit", timings)
+
+    @patch("swiftsuru.api.conf.BIND_LATENCY_BUDGET", 0.01)
+    @patch("swiftsuru.api._bind_instance")
+    def test_bind_serves_last_known_good_response_when_dependencies_are_slow(self, bind_instance_mock):
+        release = threading.Event()
+
+        def slow_bind(instance_name, app_host=None):
+            release.wait(5)
+            return {"SWIFT_CONTAINER": "fresh"}, 201
+
+        bind_instance_mock.side_effect = slow_bind
+        api.bind_responses.set("instance_name", ({"SWIFT_CONTAINER": "stale"}, time.time() - 30))
+
+        response = self.client.post("/resources/instance_name/bind",
+                                    data="unit-host=10.4.3.2",
+                                    content_type=self.content_type)
+        release.set()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.get_data()), {"SWIFT_CONTAINER": "stale"})
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"]["bind.stale_served"], 1)
+        self.assertGreaterEqual(snapshot["timings"]["bind.stale_age"]["max"], 30)
+
+        # The fresh bind keeps running in background and replaces the stale one
+        deadline = time.time() + 5
+        while api.bind_responses.get("instance_name")[0] != {"SWIFT_CONTAINER": "fresh"}:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    @patch("swiftsuru.api._bind_instance")
+    def test_bind_refreshes_cached_response_within_budget(self, bind_instance_mock):
+        bind_instance_mock.return_value = ({"SWIFT_CONTAINER": "fresh"}, 201)
+        api.bind_responses.set("instance_name", ({"SWIFT_CONTAINER": "stale"}, time.time()))
+
+        response = self.client.post("/resources/instance_name/bind",
+                                    data="unit-host=10.4.3.2",
+                                    content_type=self.content_type)
+
+        self.assertEqual(json.loads(response.get_data()), {"SWIFT_CONTAINER": "fresh"})
+        self.assertEqual(api.bind_responses.get("instance_name")[0], {"SWIFT_CONTAINER": "fresh"})
+
+    @patch("swiftsuru.api._bind_instance")
+    def test_bind_of_missing_instance_drops_cached_response(self, bind_instance_mock):
+        bind_instance_mock.return_value = ("Instance not found", 500)
+        api.bind_responses.set("instance_name", ({"SWIFT_CONTAINER": "stale"}, time.time()))
+
+        response = self.client.post("/resources/instance_name/bind",
+                                    data="unit-host=10.4.3.2",
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertIsNone(api.bind_responses.get("instance_name"))
+
+    @patch("swiftsuru.api.cors.add_hosts")
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_bind_apps_updates_cors_once_for_every_host(self, dbclient_mock, add_hosts_mock):
+        instance = {"name": 'instance_name',
+                    "container": 'instance_container',
+                    "tenant": 'tenant_name',
+                    "endpoints": {"adminURL": "http://admin",
+                                  "publicURL": "http://public",
+                                  "internalURL": "http://internal"}}
+        dbclient_mock.return_value.get_bind_info.return_value = instance
+
+        response = self.client.post("/resources/instance_name/bind-app/batch",
+                                    data="app-host=b.io&app-host=a.io&app-host=b.io",
+                                    content_type=self.content_type)
+
+        computed = json.loads(response.get_data())
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(computed["env"]["SWIFT_PUBLIC_URL"], "http://public/instance_container")
+        self.assertEqual(computed["results"], [{"app-host": "a.io", "status": 201},
+                                               {"app-host": "b.io", "status": 201}])
+        add_hosts_mock.assert_called_once_with(instance, ["a.io", "b.io"])
+        self.assertEqual(dbclient_mock.return_value.get_bind_info.call_count, 1)
+
+    @patch("swiftsuru.api.cors.add_hosts")
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_bind_apps_reports_cors_failure_on_every_host(self, dbclient_mock, add_hosts_mock):
+        dbclient_mock.return_value.get_bind_info.return_value = {"container": 'instance_container',
+                                                                 "endpoints": {"adminURL": "http://admin",
+                                                                               "publicURL": "http://public",
+                                                                               "internalURL": "http://internal"}}
+        add_hosts_mock.side_effect = Exception("swift is down")
+
+        response = self.client.post("/resources/instance_name/bind-app/batch",
+                                    data="app-host=a.io",
+                                    content_type=self.content_type)
+
+        computed = json.loads(response.get_data())
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(computed["results"], [{"app-host": "a.io", "status": 500, "error": "swift is down"}])
+
+    def test_bind_apps_without_hosts_returns_400(self):
+        response = self.client.post("/resources/instance_name/bind-app/batch",
+                                    data="",
+                                    content_type=self.content_type)
+
+        self.assertEqual(response.status_code, 400)
+
+    @patch("swiftsuru.api._bind_instance")
+    def test_bind_units_binds_instance_once(self, bind_instance_mock):
+        bind_instance_mock.return_value = ({"SWIFT_CONTAINER": "instance_container"}, 201)
+
+        response = self.client.post("/resources/instance_name/bind/batch",
+                                    data="unit-host=10.0.0.2&unit-host=10.0.0.1",
+                                    content_type=self.content_type)
+
+        computed = json.loads(response.get_data())
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(computed["env"], {"SWIFT_CONTAINER": "instance_container"})
+        self.assertEqual([r["unit-host"] for r in computed["results"]], ["10.0.0.1", "10.0.0.2"])
+        bind_instance_mock.assert_called_once_with("instance_name", None)
+
+    @patch('swiftsuru.api.cors.remove_hosts')
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_unbind_apps_removes_every_host_at_once(self, dbclient_mock, remove_hosts_mock):
+        instance = {"name": 'instance_name', "container": 'instance_container'}
+        dbclient_mock.return_value.get_bind_info.return_value = instance
+
+        response = self.client.delete("/resources/instance_name/bind-app/batch",
+                                      data="app-host=a.io&app-host=b.io",
+                                      content_type=self.content_type)
+
+        computed = json.loads(response.get_data())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["status"] for r in computed["results"]], [200, 200])
+        remove_hosts_mock.assert_called_once_with(instance, ["a.io", "b.io"])
+
+    @patch("swiftsuru.api._bind_instance")
+    def test_identical_concurrent_binds_share_one_execution(self, bind_instance_mock):
+        release = threading.Event()
+
+        def slow_bind(instance_name, app_host=None):
+            release.wait(5)
+            return {"SWIFT_CONTAINER": "instance_container"}, 201
+
+        bind_instance_mock.side_effect = slow_bind
+        results = []
+
+        def bind():
+            results.append(api._fresh_bind("instance_name"))
+
+        threads = [threading.Thread(target=bind) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+
+        while api.bind_flights._flights.get(("instance_name", None)) is None or \
+                api.bind_flights._flights[("instance_name", None)].followers < 2:
+            release.wait(0.01)
+
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(bind_instance_mock.call_count, 1)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(metrics.snapshot()["counters"]["bind.coalesced"], 2)
+
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_export_instances_streams_ndjson(self, dbclient_mock):
+        dbclient_mock.return_value.iter_instances.return_value = iter([{"name": "a", "plan": "Infra"},
+                                                                       {"name": "b", "plan": "Infra"}])
+
+        response = self.client.get("/admin/instances?marker=0&limit=2&plan=Infra")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in response.get_data().splitlines()]
+        self.assertEqual([line["name"] for line in lines], ["a", "b"])
+        dbclient_mock.return_value.iter_instances.assert_called_once_with(plan="Infra", marker="0", limit=2)
+
+    @patch("swiftsuru.api.conf.ADMIN_LIST_LIMIT", 10)
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_export_instances_limit_is_capped(self, dbclient_mock):
+        dbclient_mock.return_value.iter_instances.return_value = iter([])
+
+        self.client.get("/admin/instances?limit=5000")
+
+        dbclient_mock.return_value.iter_instances.assert_called_once_with(plan=None, marker=None, limit=10)
 
     def test_healthcheck(self):
         response = self.client.get("/healthcheck")
@@ -250,6 +690,29 @@ class APITest(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(content, 'WORKING')
 
+    @patch("swiftsuru.api.health.report")
+    def test_healthcheck_does_not_read_probes(self, report_mock):
+        self.client.get("/healthcheck")
+
+        self.assertFalse(report_mock.called)
+
+    @patch("swiftsuru.api.health.report")
+    def test_deep_healthcheck_answers_last_probes(self, report_mock):
+        report_mock.return_value = {"status": "ok", "dependencies": {"mongodb": {"status": "ok"}}}
+
+        response = self.client.get("/healthcheck?deep=1")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data()), report_mock.return_value)
+
+    @patch("swiftsuru.api.health.report")
+    def test_deep_healthcheck_fails_with_failing_dependencies(self, report_mock):
+        report_mock.return_value = {"status": "failing", "dependencies": {"mongodb": {"status": "failing"}}}
+
+        response = self.client.get("/healthcheck?deep=1")
+
+        self.assertEqual(response.status_code, 503)
+
     @patch("swiftsuru.api.SwiftsuruDBClient")
     def test_list_plan(self, dbclient_mock):
         dbclient_mock.return_value.list_plans.return_value = [{'name': 'Infra',
@@ -261,3 +724,43 @@ class APITest(unittest.TestCase):
         expected = [{u'name': u'Infra', u'description': u'Tenant para Infra'}]
         computed = json.loads(response.get_data())
         self.assertEqual(computed, expected)
+
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_list_plan_is_served_from_cache(self, dbclient_mock):
+        dbclient_mock.return_value.list_plans.return_value = [{'name': 'Infra',
+                                                               'description': 'Tenant para Infra'}]
+
+        self.client.get("/resources/plans")
+        response = self.client.get("/resources/plans")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dbclient_mock.return_value.list_plans.call_count, 1)
+
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_list_plan_returns_304_when_etag_matches(self, dbclient_mock):
+        dbclient_mock.return_value.list_plans.return_value = [{'name': 'Infra',
+                                                               'description': 'Tenant para Infra'}]
+
+        response = self.client.get("/resources/plans")
+        etag = response.headers["ETag"]
+
+        response = self.client.get("/resources/plans", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), "")
+
+    @patch("swiftsuru.api.SwiftsuruDBClient")
+    def test_list_plan_returns_200_when_etag_differs(self, dbclient_mock):
+        dbclient_mock.return_value.list_plans.return_value = []
+
+        response = self.client.get("/resources/plans", headers={"If-None-Match": '"old"'})
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_returns_json_snapshot(self):
+        response = self.client.get("/metrics")
+        computed = json.loads(response.get_data())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("counters", computed)
+        self.assertIn("timings", computed)
@@ -0,0 +1,88 @@
+import threading
+import unittest
+
+from mock import patch
+
+from swiftsuru.cache import TTLCache, SingleFlight
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def test_get_returns_value_before_expiration(self):
+        cache = TTLCache(ttl=10)
+        cache.set("key", "value")
+
+        self.assertEqual(cache.get("key"), "value")
+
+    @patch("swiftsuru.cache.time.time")
+    def test_get_returns_default_after_expiration(self, time_mock):
+        time_mock.return_value = 100
+        cache = TTLCache(ttl=10)
+        cache.set("key", "value")
+
+        time_mock.return_value = 110
+        self.assertEqual(cache.get("key", "default"), "default")
+        self.assertEqual(len(cache), 0)
+
+    @patch("swiftsuru.cache.time.time")
+    def test_entries_without_ttl_never_expire(self, time_mock):
+        time_mock.return_value = 100
+        cache = TTLCache()
+        cache.set("key", "value")
+
+        time_mock.return_value = 10 ** 9
+        self.assertEqual(cache.get("key"), "value")
+
+    def test_delete_and_clear(self):
+        cache = TTLCache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        cache.delete("a")
+        self.assertIsNone(cache.get("a"))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return "done"
+
+        def call():
+            results.append(flights.do("key", work))
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        while not calls:
+            release.wait(0.01)
+
+        follower = threading.Thread(target=call)
+        follower.start()
+        while not flights._flights["key"].followers:
+            release.wait(0.01)
+
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("done", False), ("done", True)])
+
+    def test_errors_are_raised_and_key_is_released(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError("boom")
+
+        self.assertRaises(ValueError, flights.do, "key", fail)
+        self.assertEqual(flights.do("key", lambda: 1), (1, False))
@@ -0,0 +1,19 @@
+import unittest
+
+from mock import patch
+
+from swiftsuru import conf
+
+
+class FlagTest(unittest.TestCase):
+
+    def test_unset_flag_is_the_default(self):
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertFalse(conf.flag("SOME_FLAG"))
+            self.assertTrue(conf.flag("SOME_FLAG", True))
+
+    def test_flag_is_parsed_as_a_boolean(self):
+        for value, expected in [("1", True), ("true", True), ("Yes", True), ("on", True),
+                                ("0", False), ("False", False), ("no", False), ("", False)]:
+            with patch.dict("os.environ", {"SOME_FLAG": value}):
+                self.assertEqual(conf.flag("SOME_FLAG", True), expected, value)
@@ -0,0 +1,236 @@
+import threading
+import time
+import unittest
+
+from mock import call, patch
+
+from swiftsuru import cors
+
+
+class RenderAndParseTest(unittest.TestCase):
+
+    def test_render_origins_sorts_and_dedupes_hosts(self):
+        computed = cors.render_origins(["b.io", "a.io", "b.io"])
+        expected = "http://a.io https://a.io http://b.io https://b.io"
+
+        self.assertEqual(computed, expected)
+
+    def test_parse_hosts_drops_schemes_and_duplicates(self):
+        computed = cors.parse_hosts("http://a.io https://a.io  http://b.io")
+
+        self.assertEqual(computed, ["a.io", "b.io"])
+
+    def test_allow_all_origin_is_kept(self):
+        hosts = cors.parse_hosts("*")
+
+        self.assertEqual(hosts, ["*"])
+        self.assertEqual(cors.render_origins(hosts + ["a.io"]), "* http://a.io https://a.io")
+
+
+class CompactionTest(unittest.TestCase):
+
+    def test_single_scheme_renders_one_origin_per_host(self):
+        computed = cors.compact_origins(["A.apps.io", "b.apps.io", "a.apps.io"], ["https"])
+
+        self.assertEqual(computed, ["https://a.apps.io", "https://b.apps.io"])
+
+    def test_sibling_hosts_are_not_collapsed(self):
+        computed = cors.compact_hosts(["b.apps.io", "a.apps.io", "c.io"])
+
+        self.assertEqual(computed, ["a.apps.io", "b.apps.io", "c.io"])
+
+    @patch("swiftsuru.cors.conf.CORS_SCHEMES", ["https"])
+    def test_schemes_default_to_the_configured_ones(self):
+        self.assertEqual(cors.render_origins(["a.io"]), "https://a.io")
+
+    def test_encoded_size(self):
+        self.assertEqual(cors.encoded_size(cors.render_origins(["a.io"])), 24)
+
+
+@patch("swiftsuru.cors.SwiftClient")
+@patch("swiftsuru.cors.SwiftsuruDBClient")
+class HeaderSizeTest(unittest.TestCase):
+
+    @patch("swiftsuru.cors.conf.CORS_MAX_HEADER_SIZE", 30)
+    def test_too_large_header_is_refused_before_registering(self, dbclient_mock, swiftclient_mock):
+        instance = {"name": "myswift", "container": "e2opim", "cors_hosts": ["a.io"]}
+
+        with self.assertRaises(cors.CorsHeaderTooLarge) as ctx:
+            cors.update_hosts(instance, add=["b.io"])
+
+        self.assertEqual(ctx.exception.size, 49)
+        self.assertFalse(dbclient_mock.return_value.add_cors_hosts.called)
+        self.assertFalse(swiftclient_mock.return_value.write_cors.called)
+
+
+@patch("swiftsuru.cors.SwiftClient")
+@patch("swiftsuru.cors.KeystoneClient")
+@patch("swiftsuru.cors.SwiftsuruDBClient")
+class UpdateHostsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.instance = {"name": "myswift", "container": "e2opim",
+                         "tenant": "infra", "cors_hosts": ["a.io"]}
+
+    def test_new_host_is_registered_and_written(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        registry = {"cors_hosts": ["a.io", "b.io"], "cors_version": 2}
+        dbclient_mock.return_value.add_cors_hosts.return_value = registry
+        dbclient_mock.return_value.get_cors_registry.return_value = registry
+
+        written = cors.add_hosts(self.instance, ["b.io"])
+
+        self.assertTrue(written)
+        dbclient_mock.return_value.add_cors_hosts.assert_called_once_with("myswift", ["b.io"])
+        swiftclient_mock.return_value.write_cors.assert_called_once_with(
+            "e2opim", "http://a.io https://a.io http://b.io https://b.io")
+        self.assertFalse(swiftclient_mock.return_value.get_cors.called)
+        swiftclient_mock.return_value.close.assert_called_once_with()
+        dbclient_mock.return_value.set_cors_synced.assert_called_once_with("myswift", 2)
+
+    def test_header_is_rewritten_when_another_process_changed_the_registry(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        dbclient_mock.return_value.add_cors_hosts.return_value = {"cors_hosts": ["a.io", "b.io"],
+                                                                  "cors_version": 2}
+        dbclient_mock.return_value.get_cors_registry.return_value = {"cors_hosts": ["a.io", "b.io", "c.io"],
+                                                                     "cors_version": 3}
+
+        cors.add_hosts(self.instance, ["b.io"])
+
+        self.assertEqual(swiftclient_mock.return_value.write_cors.call_args_list[-1][0],
+                         ("e2opim", "http://a.io https://a.io http://b.io https://b.io http://c.io https://c.io"))
+        self.assertEqual(swiftclient_mock.return_value.write_cors.call_count, 2)
+        dbclient_mock.return_value.set_cors_synced.assert_called_once_with("myswift", 3)
+
+    @patch("swiftsuru.cors.conf.CORS_WRITE_ATTEMPTS", 2)
+    def test_registry_changing_on_every_write_is_left_unsynced(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        dbclient_mock.return_value.add_cors_hosts.return_value = {"cors_hosts": ["a.io"], "cors_version": 1}
+        dbclient_mock.return_value.get_cors_registry.side_effect = [{"cors_hosts": ["a.io"], "cors_version": 2},
+                                                                    {"cors_hosts": ["a.io"], "cors_version": 3}]
+
+        cors.add_hosts(self.instance, ["a.io"])
+
+        self.assertEqual(swiftclient_mock.return_value.write_cors.call_count, 2)
+        self.assertFalse(dbclient_mock.return_value.set_cors_synced.called)
+
+    def test_failed_write_is_retried_by_the_next_change(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        dbclient_mock.return_value.add_cors_hosts.side_effect = [{"cors_hosts": ["a.io", "b.io"],
+                                                                  "cors_version": 2}, None]
+        dbclient_mock.return_value.get_cors_registry.return_value = {"cors_hosts": ["a.io", "b.io"],
+                                                                     "cors_version": 2,
+                                                                     "cors_synced_version": 1}
+        swiftclient_mock.return_value.write_cors.side_effect = [Exception("Swift is down"), None]
+
+        self.assertRaises(Exception, cors.add_hosts, self.instance, ["b.io"])
+        self.assertFalse(dbclient_mock.return_value.set_cors_synced.called)
+        self.assertFalse(swiftclient_mock.return_value.close.called)
+
+        self.assertTrue(cors.add_hosts(self.instance, ["b.io"]))
+        self.assertEqual(swiftclient_mock.return_value.write_cors.call_count, 2)
+        dbclient_mock.return_value.set_cors_synced.assert_called_once_with("myswift", 2)
+
+    def test_registered_host_costs_no_swift_call(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        dbclient_mock.return_value.add_cors_hosts.return_value = None
+        dbclient_mock.return_value.get_cors_registry.return_value = {"cors_hosts": ["a.io"],
+                                                                     "cors_version": 1,
+                                                                     "cors_synced_version": 1}
+
+        written = cors.add_hosts(self.instance, ["a.io"])
+
+        self.assertFalse(written)
+        self.assertFalse(swiftclient_mock.called)
+        self.assertFalse(keystoneclient_mock.called)
+
+    def test_removed_host_is_written(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        dbclient_mock.return_value.remove_cors_hosts.return_value = {"cors_hosts": [], "cors_version": 3}
+        dbclient_mock.return_value.get_cors_registry.return_value = {"cors_hosts": [], "cors_version": 3}
+
+        written = cors.remove_hosts(self.instance, ["a.io"])
+
+        self.assertTrue(written)
+        swiftclient_mock.return_value.write_cors.assert_called_once_with("e2opim", "")
+
+    def test_legacy_instance_registers_hosts_from_container_header(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        del self.instance["cors_hosts"]
+        swiftclient_mock.return_value.get_cors.return_value = "http://old.io https://old.io"
+        registry = {"cors_hosts": ["b.io", "old.io"], "cors_version": 1}
+        dbclient_mock.return_value.add_cors_hosts.return_value = registry
+        dbclient_mock.return_value.get_cors_registry.return_value = registry
+
+        cors.add_hosts(self.instance, ["b.io"])
+
+        dbclient_mock.return_value.add_cors_hosts.assert_called_once_with("myswift", ["b.io", "old.io"])
+        swiftclient_mock.return_value.write_cors.assert_called_once_with(
+            "e2opim", "http://b.io https://b.io http://old.io https://old.io")
+        self.assertEqual(swiftclient_mock.call_count, 1)
+
+
+class WriteBatcherTest(unittest.TestCase):
+
+    @patch("swiftsuru.cors.update_hosts")
+    def test_lone_change_is_applied_right_away(self, update_hosts_mock):
+        update_hosts_mock.return_value = True
+        batcher = cors.WriteBatcher()
+
+        self.assertTrue(batcher.submit({"container": "e2opim"}, add=["a.io"]))
+        update_hosts_mock.assert_called_once_with({"container": "e2opim"}, add=["a.io"], remove=[])
+
+    @patch("swiftsuru.cors.update_hosts")
+    def test_changes_requested_during_a_write_are_written_once(self, update_hosts_mock):
+        writing, release = threading.Event(), threading.Event()
+
+        def update_hosts(instance, add, remove):
+            writing.set()
+            release.wait(5)
+            return True
+
+        update_hosts_mock.side_effect = update_hosts
+        batcher = cors.WriteBatcher()
+        instance = {"name": "myswift", "container": "e2opim"}
+        results = []
+
+        def bind(host):
+            results.append(batcher.submit(instance, add=[host]))
+
+        first = threading.Thread(target=bind, args=("a.io",))
+        first.start()
+        writing.wait(5)
+
+        threads = [threading.Thread(target=bind, args=(host,)) for host in ["b.io", "c.io"]]
+        for thread in threads:
+            thread.start()
+        while batcher._pending.get("e2opim") is None or batcher._pending["e2opim"].requests < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in [first] + threads:
+            thread.join(5)
+
+        self.assertEqual(update_hosts_mock.call_args_list,
+                         [call(instance, add=["a.io"], remove=[]),
+                          call(instance, add=["b.io", "c.io"], remove=[])])
+        self.assertEqual(results, [True, True, True])
+
+    @patch("swiftsuru.cors.update_hosts")
+    def test_last_change_of_a_host_wins(self, update_hosts_mock):
+        batch = cors._Batch({"container": "e2opim"})
+        batch.merge(["a.io", "b.io"], [])
+        batch.merge([], ["a.io"])
+
+        batch.apply()
+
+        update_hosts_mock.assert_called_once_with({"container": "e2opim"}, add=["b.io"], remove=["a.io"])
+
+    @patch("swiftsuru.cors.update_hosts")
+    def test_errors_are_raised_to_every_request(self, update_hosts_mock):
+        update_hosts_mock.side_effect = Exception("Swift is down")
+        batcher = cors.WriteBatcher()
+
+        with self.assertRaises(Exception):
+            batcher.submit({"container": "e2opim"}, add=["a.io"])
+
+    @patch("swiftsuru.cors.update_hosts")
+    def test_containers_are_batched_separately(self, update_hosts_mock):
+        batcher = cors.WriteBatcher()
+
+        batcher.submit({"container": "one"}, add=["a.io"])
+        batcher.submit({"container": "two"}, add=["a.io"])
+
+        self.assertEqual(update_hosts_mock.call_count, 2)
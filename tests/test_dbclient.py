@@ -1,24 +1,31 @@
 
+import inspect
 import ming
 import unittest
 
+from datetime import datetime, timedelta
+
 from mock import patch, Mock
-from swiftsuru.dbclient import SwiftsuruDBClient
+from pymongo.errors import OperationFailure
+from swiftsuru import dbclient
+from swiftsuru.dbclient import SwiftsuruDBClient, plan_cache
 
 
 class SwiftsuruDBClientTest(unittest.TestCase):
 
     def setUp(self):
+        plan_cache.clear()
         fake_mongo = ming.create_datastore('mim://')
 
         patch("swiftsuru.dbclient.SwiftsuruDBClient.set_connection",
               Mock(return_value=fake_mongo.conn)).start()
 
         self.db = SwiftsuruDBClient()
+        self.db.ensure_indexes()
 
     def tearDown(self):
-        self.db._db.drop_collection("plans")
-        self.db._db.drop_collection("instances")
+        for collection in self.db._db.collection_names():
+            self.db._db.drop_collection(collection)
         patch.stopall()
 
     def test_list_plans_returns_a_list(self):
@@ -37,6 +44,26 @@ class SwiftsuruDBClientTest(unittest.TestCase):
         self.db.remove_plan("PlanName")
         self.assertEqual(len(self.db.list_plans()), 0)
 
+    def test_list_plans_is_cached(self):
+        self.db.add_plan("PlanName", "plan_tenant", "Plan Description")
+        self.db.list_plans()
+
+        self.db._db.plans.remove({})
+        self.assertEqual(len(self.db.list_plans()), 1)
+
+    def test_get_plan_is_cached(self):
+        self.db.add_plan("PlanName", "plan_tenant", "Plan Description")
+        self.db.get_plan("PlanName")
+
+        self.db._db.plans.remove({})
+        self.assertEqual(self.db.get_plan("PlanName").get("tenant"), "plan_tenant")
+
+    def test_add_plan_invalidates_cache(self):
+        self.assertEqual(len(self.db.list_plans()), 0)
+
+        self.db.add_plan("PlanName", "plan_tenant", "Plan Description")
+        self.assertEqual(len(self.db.list_plans()), 1)
+
     def test_list_instances_returns_a_list(self):
         assert isinstance(self.db.list_instances(), list)
 
@@ -46,6 +73,76 @@ class SwiftsuruDBClientTest(unittest.TestCase):
         instance = self.db.get_instance("myswift")
         self.assertEqual(instance.get("container"), "e2opim")
 
+    def test_add_instance_stores_tenant_and_endpoints(self):
+        endpoints = {"adminURL": "http://admin", "publicURL": "http://public", "internalURL": "http://internal"}
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass",
+                             tenant="infra_tenant", endpoints=endpoints)
+
+        instance = self.db.get_bind_info("myswift")
+        self.assertEqual(instance.get("tenant"), "infra_tenant")
+        self.assertEqual(instance.get("endpoints"), endpoints)
+        self.assertNotIn("team", instance)
+
+    def test_get_bind_info_of_an_unknown_instance(self):
+        self.assertIsNone(self.db.get_bind_info("unknown"))
+
+    def test_get_bind_info_looks_up_plan_of_instances_without_tenant(self):
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+        expected = {"name": "myswift", "tenant": "infra_tenant"}
+
+        with patch.object(self.db, "_db") as db_mock:
+            db_mock.instances.find_one.return_value = {"name": "myswift", "tenant": None}
+            db_mock.instances.aggregate.return_value = iter([expected])
+
+            computed = self.db.get_bind_info("myswift")
+
+            pipeline = db_mock.instances.aggregate.call_args[0][0]
+
+        self.assertEqual(computed, expected)
+        self.assertEqual(pipeline[2]["$lookup"]["from"], "plans")
+
+    def test_list_and_set_instance_location(self):
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+        self.assertEqual(len(self.db.list_instances_without_location()), 1)
+
+        self.db.set_instance_location("myswift", "infra_tenant", {"adminURL": "http://admin"})
+
+        self.assertEqual(len(self.db.list_instances_without_location()), 0)
+        self.assertEqual(self.db.get_instance("myswift").get("tenant"), "infra_tenant")
+
+    def test_add_cors_hosts_returns_registry(self):
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+
+        registry = self.db.add_cors_hosts("myswift", ["a.io"])
+        self.assertEqual((registry["cors_hosts"], registry["cors_version"]), (["a.io"], 1))
+
+        registry = self.db.add_cors_hosts("myswift", ["a.io", "b.io"])
+        self.assertEqual((registry["cors_hosts"], registry["cors_version"]), (["a.io", "b.io"], 2))
+
+    def test_add_cors_hosts_already_registered_returns_none(self):
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+        self.db.add_cors_hosts("myswift", ["a.io"])
+
+        self.assertIsNone(self.db.add_cors_hosts("myswift", ["a.io"]))
+
+    def test_remove_cors_hosts(self):
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+        self.db.add_cors_hosts("myswift", ["a.io", "b.io"])
+
+        self.assertEqual(self.db.remove_cors_hosts("myswift", ["a.io"])["cors_hosts"], ["b.io"])
+        self.assertIsNone(self.db.remove_cors_hosts("myswift", ["a.io"]))
+
+    def test_cors_synced_only_for_current_version(self):
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+        self.db.add_cors_hosts("myswift", ["a.io"])
+        self.db.add_cors_hosts("myswift", ["b.io"])
+
+        self.db.set_cors_synced("myswift", 1)
+        self.assertNotIn("cors_synced_version", self.db.get_cors_registry("myswift"))
+
+        self.db.set_cors_synced("myswift", 2)
+        self.assertEqual(self.db.get_cors_registry("myswift")["cors_synced_version"], 2)
+
     def test_get_instances_by_plan(self):
         self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
 
@@ -55,9 +152,324 @@ class SwiftsuruDBClientTest(unittest.TestCase):
         instance = instances[0]
         self.assertEqual(instance.get("container"), "e2opim")
 
+    def test_iter_instances_pages_by_name_without_credentials(self):
+        for name in ["c", "a", "d", "b"]:
+            self.db.add_instance(name, "storm", "e2opim", "Infra", "storm", "stormpass")
+
+        first = list(self.db.iter_instances(limit=2))
+        second = list(self.db.iter_instances(marker=first[-1]["name"], limit=2))
+
+        self.assertEqual([i["name"] for i in first], ["a", "b"])
+        self.assertEqual([i["name"] for i in second], ["c", "d"])
+        self.assertNotIn("password", first[0])
+        self.assertNotIn("user", first[0])
+
+    def test_iter_instances_of_a_plan(self):
+        self.db.add_instance("a", "storm", "e2opim", "Infra", "storm", "stormpass")
+        self.db.add_instance("b", "storm", "e2opim", "Media", "storm", "stormpass")
+
+        computed = [i["name"] for i in self.db.iter_instances(plan="Media")]
+
+        self.assertEqual(computed, ["b"])
+
     def test_remove_instance(self):
         self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
         self.db.remove_instance("myswift")
 
-        instance = self.db.get_instance("myswift")
+        self.assertIsNone(self.db.get_instance("myswift"))
+        self.assertIsNone(self.db.get_bind_info("myswift"))
+
+        instance = self.db._db.instances.find_one({"name": "myswift"})
         self.assertEqual(instance.get("deleted"), True)
+        self.assertIn("deleted_at", instance)
+
+    def test_get_deleted_instance(self):
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+        self.db.remove_instance("myswift")
+
+        self.assertIsNone(self.db.get_instance("myswift"))
+        self.assertEqual(self.db.get_instance("myswift", include_deleted=True)["container"], "e2opim")
+
+    def test_mark_live_instances_flags_legacy_instances(self):
+        self.db._db.instances.insert({"name": "legacy", "container": "e2opim"})
+        self.assertIsNone(self.db.get_instance("legacy"))
+
+        self.db.mark_live_instances()
+
+        self.assertEqual(self.db.get_instance("legacy")["container"], "e2opim")
+
+    def test_deleted_instance_is_claimed_archived_and_removed(self):
+        stale_before = datetime.utcnow() - timedelta(seconds=300)
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+        self.assertIsNone(self.db.claim_deleted_instance(datetime.utcnow(), datetime.utcnow()))
+
+        self.db.remove_instance("myswift")
+        self.assertIsNone(self.db.claim_deleted_instance(stale_before, stale_before))
+        instance = self.db.claim_deleted_instance(stale_before, datetime.utcnow() + timedelta(seconds=1))
+
+        self.assertEqual(instance["name"], "myswift")
+        self.assertIsNone(self.db.claim_deleted_instance(stale_before, datetime.utcnow() + timedelta(seconds=1)))
+
+        self.db.add_reap_step(instance["_id"], "objects")
+        self.db.archive_instance(instance)
+
+        self.assertIsNone(self.db._db.instances.find_one({"name": "myswift"}))
+        archived = self.db._db.reaped_instances.find_one({"name": "myswift"})
+        self.assertNotIn("password", archived)
+
+    def test_instance_name_is_reserved_by_one_container_until_reaped(self):
+        self.assertEqual(self.db.reserve_instance_name("myswift", "e2opim"), "e2opim")
+        self.assertEqual(self.db.reserve_instance_name("myswift", "other"), "e2opim")
+        self.assertEqual(self.db.reserve_instance_name("myswift", "e2opim"), "e2opim")
+
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+        self.db.archive_instance(self.db.get_instance("myswift"))
+
+        self.assertEqual(self.db.reserve_instance_name("myswift", "other"), "other")
+
+    def test_legacy_deleted_instance_is_never_claimed(self):
+        self.db._db.instances.insert({"name": "legacy", "container": "e2opim", "deleted": True})
+
+        self.assertIsNone(self.db.claim_deleted_instance(datetime.utcnow(), datetime.utcnow() + timedelta(days=1)))
+
+    def test_claim_instances_takes_each_instance_once_per_interval(self):
+        for name in ["one", "two", "three"]:
+            self.db.add_instance(name, "storm", "c_" + name, "Infra", "storm", "stormpass")
+        self.db.remove_instance("three")
+        before = datetime.utcnow()
+
+        first = self.db.claim_instances("status_probed_at", before, 1, {"name": 1})
+        second = self.db.claim_instances("status_probed_at", before, 5, {"name": 1})
+
+        self.assertEqual(len(first), 1)
+        self.assertEqual(sorted(i["name"] for i in first + second), ["one", "two"])
+        self.assertEqual(self.db.claim_instances("status_probed_at", before, 5), [])
+
+        later = datetime.utcnow() + timedelta(seconds=1)
+        again = self.db.claim_instances("status_probed_at", later, 2, {"name": 1})
+        self.assertEqual(sorted(i["name"] for i in again), ["one", "two"])
+
+    def test_set_and_get_instance_usage(self):
+        self.db.add_instance("myswift", "team", "container", "plan", "user", "pass")
+        self.assertEqual(self.db.get_instance_usage("myswift"), {})
+
+        self.db.set_instance_usage("myswift", {"bytes": 15, "objects": 3})
+
+        self.assertEqual(self.db.get_instance_usage("myswift"), {"bytes": 15, "objects": 3})
+        self.assertIsNone(self.db.get_instance_usage("unknown"))
+
+    def test_set_and_get_instance_status(self):
+        self.db.add_instance("myswift", "team", "container", "plan", "user", "pass")
+        self.assertEqual(self.db.get_instance_status("myswift"), {})
+
+        self.db.set_instance_status("myswift", {"state": "up"})
+
+        self.assertEqual(self.db.get_instance_status("myswift"), {"state": "up"})
+        self.assertIsNone(self.db.get_instance_status("unknown"))
+
+    def test_ensure_indexes_creates_unique_name_indexes(self):
+        self.db.ensure_indexes()
+
+        self.assertIn("name", self.db._db.plans.index_information())
+        self.assertIn("name", self.db._db.instances.index_information())
+
+    def test_ensure_indexes_creates_every_declared_index(self):
+        self.db.ensure_indexes(background=True)
+
+        instance_indexes = self.db._db.instances.index_information()
+        for name in ["plan_name_live", "tenant_live", "deleted_deleted_at"]:
+            self.assertIn(name, instance_indexes)
+
+        self.assertEqual(instance_indexes["plan_name_live"]["partialFilterExpression"], {"deleted": False})
+        self.assertTrue(instance_indexes["plan_name_live"]["background"])
+        self.assertIn("status_created_at", self.db._db.warm_instances.index_information())
+
+    def test_ensure_indexes_goes_on_after_a_failed_index(self):
+        ensure_index = self.db._db.instances.ensure_index
+
+        def failing(keys, **kwargs):
+            if kwargs.get("name") == "plan_name_live":
+                raise OperationFailure("Index with name: plan_name_live already exists")
+            return ensure_index(keys, **kwargs)
+
+        with patch.object(self.db._db.instances, "ensure_index", side_effect=failing):
+            errors = self.db.ensure_indexes()
+
+        self.assertEqual(list(errors), ["instances.plan_name_live"])
+
+    @patch("swiftsuru.dbclient.SwiftsuruDBClient.ensure_indexes")
+    def test_bootstrap_flags_legacy_instances_even_when_an_index_fails(self, ensure_indexes_mock):
+        ensure_indexes_mock.return_value = {"instances.tenant_live": Exception("conflict")}
+        self.db._db.instances.insert({"name": "legacy", "container": "e2opim"})
+
+        dbclient.bootstrap()
+
+        self.assertEqual(self.db.get_instance("legacy")["container"], "e2opim")
+
+    @patch("swiftsuru.dbclient.SwiftsuruDBClient.mark_live_instances")
+    def test_bootstrap_fails_when_legacy_instances_are_not_flagged(self, mark_live_instances_mock):
+        mark_live_instances_mock.side_effect = Exception("mongo is down")
+
+        self.assertRaises(Exception, dbclient.bootstrap)
+
+    def test_every_query_has_its_plan_checked(self):
+        # Methods that only insert, or read through other methods
+        no_query = set(["ensure_indexes", "query_plan", "set_connection", "set_database",
+                        "list_instances", "get_instances_by_plan",
+                        "add_plan", "add_instance", "add_job", "reserve_warm_instance"])
+        methods = set(name for name, _ in inspect.getmembers(SwiftsuruDBClient, inspect.ismethod)
+                      if not name.startswith("__"))
+
+        self.assertEqual(methods - no_query, set(query[0] for query in dbclient.QUERIES))
+
+    def test_claim_job_takes_oldest_pending_job_once(self):
+        self.db.add_job("add_instance", "first", {})
+        self.db.add_job("add_instance", "second", {})
+
+        job = self.db.claim_job(datetime.utcnow() - timedelta(seconds=300))
+
+        self.assertEqual(job["name"], "first")
+        self.assertEqual(job["status"], "running")
+        self.assertEqual(job["attempts"], 1)
+        self.assertEqual(self.db.claim_job(datetime.utcnow() - timedelta(seconds=300))["name"], "second")
+        self.assertIsNone(self.db.claim_job(datetime.utcnow() - timedelta(seconds=300)))
+
+    def test_claim_job_takes_back_stale_running_job(self):
+        self.db.add_job("add_instance", "myinstance", {})
+        self.db.claim_job(datetime.utcnow())
+
+        job = self.db.claim_job(datetime.utcnow() + timedelta(seconds=1))
+
+        self.assertEqual(job["attempts"], 2)
+
+    def test_job_steps_and_status(self):
+        job_id = self.db.add_job("add_instance", "myinstance", {})
+
+        self.db.add_job_step(job_id, "keystone_user")
+        self.db.add_job_step(job_id, "keystone_user")
+        self.db.set_job_status(job_id, "failed", "boom")
+
+        job = self.db.get_job("myinstance")
+        self.assertEqual(job["steps"], ["keystone_user"])
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "boom")
+
+    def test_warm_instance_is_claimed_once(self):
+        slot_id = self.db.reserve_warm_instance("small", "infra")
+        self.assertIsNone(self.db.claim_warm_instance("small"))
+
+        self.db.fill_warm_instance(slot_id, "swiftsuru_a1b2c3", "s3cr3t", "e2opim", {})
+
+        warm = self.db.claim_warm_instance("small")
+        self.assertEqual(warm["container"], "e2opim")
+        self.assertIsNone(self.db.claim_warm_instance("small"))
+        self.assertEqual(self.db.count_warm_instances("small"), 0)
+
+    def test_stale_claimed_warm_instance_is_released(self):
+        slot_id = self.db.reserve_warm_instance("small", "infra")
+        self.db.fill_warm_instance(slot_id, "swiftsuru_a1b2c3", "s3cr3t", "e2opim", {})
+        self.db.claim_warm_instance("small")
+
+        self.assertEqual(self.db.list_stale_claimed_warm_instances(datetime.utcnow() - timedelta(seconds=60)), [])
+        stale = self.db.list_stale_claimed_warm_instances(datetime.utcnow() + timedelta(seconds=60))
+        self.assertEqual([slot["_id"] for slot in stale], [slot_id])
+
+        self.db.release_warm_instance(slot_id)
+
+        self.assertEqual(self.db.claim_warm_instance("small")["container"], "e2opim")
+
+    def test_get_instance_by_container(self):
+        self.db.add_instance("myswift", "storm", "e2opim", "Infra", "storm", "stormpass")
+
+        self.assertEqual(self.db.get_instance_by_container("e2opim")["name"], "myswift")
+        self.assertIsNone(self.db.get_instance_by_container("a1b2c3"))
+
+    def test_count_warm_instances_before_a_slot(self):
+        first = self.db.reserve_warm_instance("small", "infra")
+        second = self.db.reserve_warm_instance("small", "infra")
+
+        self.assertEqual(self.db.count_warm_instances("small"), 2)
+        self.assertEqual(self.db.count_warm_instances("small", before=first), 0)
+        self.assertEqual(self.db.count_warm_instances("small", before=second), 1)
+
+    def test_warm_pool_of_a_plan_is_filled_by_one_process_at_a_time(self):
+        self.db.add_plan("small", "infra", "small plan")
+        until = datetime.utcnow() + timedelta(seconds=300)
+
+        self.assertTrue(self.db.claim_warm_pool("small", until))
+        self.assertFalse(self.db.claim_warm_pool("small", until))
+
+        self.db.release_warm_pool("small")
+        self.assertTrue(self.db.claim_warm_pool("small", until))
+
+    def test_warm_pool_held_by_a_dead_process_is_claimed_again(self):
+        self.db.add_plan("small", "infra", "small plan")
+
+        self.assertTrue(self.db.claim_warm_pool("small", datetime.utcnow() - timedelta(seconds=1)))
+        self.assertTrue(self.db.claim_warm_pool("small", datetime.utcnow() + timedelta(seconds=300)))
+
+    def test_add_and_list_acl_permits(self):
+        self.db.add_acl_permit("10.4.3.0/24>10.0.0.1/32:5000")
+        self.db.add_acl_permit("10.4.3.0/24>10.0.0.1/32:5000")
+
+        self.assertEqual(self.db.list_acl_permits(), ["10.4.3.0/24>10.0.0.1/32:5000"])
+
+    def test_queued_acl_permits_are_claimed_once_until_released(self):
+        self.db.queue_acl_permit("a", {"source": "10.4.3.0/24"})
+        self.db.queue_acl_permit("b", {"source": "10.4.4.0/24"})
+        self.db.add_acl_permit("b")
+        self.db.queue_acl_permit("b", {"source": "10.4.4.0/24"})
+        stale_before = datetime.utcnow() - timedelta(seconds=300)
+
+        claimed = self.db.claim_acl_permits(stale_before, 10)
+
+        self.assertEqual([permit["_id"] for permit in claimed], ["a"])
+        self.assertEqual(claimed[0]["source"], "10.4.3.0/24")
+        self.assertEqual(self.db.claim_acl_permits(stale_before, 10), [])
+        self.assertEqual(self.db.list_acl_permits(), ["b"])
+
+        self.db.release_acl_permits(["a"])
+
+        self.assertEqual([permit["_id"] for permit in self.db.claim_acl_permits(stale_before, 10)], ["a"])
+
+    def test_save_get_and_remove_a_token(self):
+        self.db.save_token("tenant|user|url", "{}", None)
+        self.assertEqual(self.db.get_token("tenant|user|url").get("auth_ref"), "{}")
+
+        self.db.remove_token("tenant|user|url")
+        self.assertIsNone(self.db.get_token("tenant|user|url"))
+
+
+class GetConnectionTest(unittest.TestCase):
+
+    def tearDown(self):
+        dbclient._client = None
+        dbclient._client_pid = None
+
+    @patch("swiftsuru.dbclient.pymongo.MongoClient")
+    def test_get_connection_reuses_the_client_on_the_same_process(self, mongo_client_mock):
+        conn1 = dbclient.get_connection()
+        conn2 = dbclient.get_connection()
+
+        self.assertIs(conn1, conn2)
+        self.assertEqual(mongo_client_mock.call_count, 1)
+
+    @patch("swiftsuru.dbclient.os.getpid")
+    @patch("swiftsuru.dbclient.pymongo.MongoClient")
+    def test_get_connection_creates_a_new_client_after_fork(self, mongo_client_mock, getpid_mock):
+        getpid_mock.return_value = 100
+        dbclient.get_connection()
+
+        getpid_mock.return_value = 101
+        dbclient.get_connection()
+
+        self.assertEqual(mongo_client_mock.call_count, 2)
+
+    @patch("swiftsuru.dbclient.pymongo.MongoClient")
+    def test_get_connection_uses_pool_settings_from_conf(self, mongo_client_mock):
+        with patch("swiftsuru.dbclient.conf.MONGODB_MAX_POOL_SIZE", 7):
+            dbclient.get_connection()
+
+        _, kwargs = mongo_client_mock.call_args
+        self.assertEqual(kwargs["maxPoolSize"], 7)
+        self.assertFalse(kwargs["connect"])
@@ -0,0 +1,97 @@
+import unittest
+
+from mock import patch
+
+from swiftsuru import health
+from swiftsuru.health import HealthProber, LatencyWindow
+
+
+class LatencyWindowTest(unittest.TestCase):
+
+    def test_percentiles_of_the_last_samples(self):
+        window = LatencyWindow(100)
+
+        for ms in range(1, 201):
+            window.add(ms / 1000.0)
+
+        self.assertEqual(window.percentile(50), 0.15)
+        self.assertEqual(window.percentile(99), 0.199)
+
+    def test_percentile_without_samples(self):
+        self.assertIsNone(LatencyWindow(10).percentile(50))
+
+
+class HealthProberTest(unittest.TestCase):
+
+    def setUp(self):
+        health.reset()
+
+    def tearDown(self):
+        health.reset()
+
+    def test_report_before_any_probe_is_unknown(self):
+        report = health.report()
+
+        self.assertEqual(report["status"], health.UNKNOWN)
+        self.assertEqual(report["dependencies"]["mongodb"], {"status": health.UNKNOWN})
+
+    def test_report_has_status_and_latency_of_every_dependency(self):
+        probes = {"mongodb": lambda: None, "keystone": lambda: None, "swift": lambda: None}
+
+        with patch.dict(health.PROBES, probes):
+            HealthProber().run_once()
+            HealthProber().run_once()
+
+        report = health.report()
+
+        self.assertEqual(report["status"], health.OK)
+        self.assertEqual(sorted(report["dependencies"]), ["keystone", "mongodb", "swift"])
+        latency = report["dependencies"]["swift"]["latency"]
+        self.assertEqual(sorted(latency), ["last", "p50", "p99"])
+
+    def test_failing_dependency_fails_the_report(self):
+        def broken():
+            raise Exception("pool is broken")
+
+        probes = {"mongodb": broken, "keystone": lambda: None, "swift": lambda: None}
+
+        with patch.dict(health.PROBES, probes):
+            HealthProber().run_once()
+
+        report = health.report()
+
+        self.assertEqual(report["status"], health.FAILING)
+        self.assertEqual(report["dependencies"]["mongodb"]["error"], "pool is broken")
+        self.assertEqual(report["dependencies"]["keystone"]["status"], health.OK)
+
+    @patch("swiftsuru.health.conf.HEALTH_STALE_AFTER", 60)
+    @patch("swiftsuru.health.time.time")
+    def test_results_not_refreshed_are_failing(self, time_mock):
+        time_mock.return_value = 1000
+        for name in health.PROBES:
+            health.record(name, 0.01)
+
+        time_mock.return_value = 1100
+        report = health.report()
+
+        self.assertEqual(report["status"], health.FAILING)
+        self.assertIn("Not probed since", report["dependencies"]["swift"]["error"])
+
+    @patch("swiftsuru.health.keystone_client.get_http_session")
+    def test_keystone_probe_fails_on_server_errors(self, get_http_session_mock):
+        get_http_session_mock.return_value.get.return_value.status_code = 503
+
+        self.assertRaises(Exception, health.probe_keystone)
+
+        get_http_session_mock.return_value.get.return_value.status_code = 300
+        health.probe_keystone()
+
+    @patch("swiftsuru.health.conf.KEYSTONE_SSL_NO_VERIFY", True)
+    @patch("swiftsuru.health.keystone_client.get_http_session")
+    def test_keystone_probe_respects_ssl_no_verify(self, get_http_session_mock):
+        get_http_session_mock.return_value.get.return_value.status_code = 200
+
+        health.probe_keystone()
+
+        _, kwargs = get_http_session_mock.return_value.get.call_args
+        self.assertFalse(kwargs["verify"])
@@ -0,0 +1,264 @@
+import datetime
+import json
+import unittest
+
+from keystoneclient import access
+from keystoneclient.exceptions import NotFound
+from mock import patch, Mock
+
+from swiftsuru import keystone_client, metrics
+from swiftsuru.keystone_client import KeystoneClient, token_cache, endpoint_cache
+
+
+def build_auth_ref(expires_in=3600, token_id="t0k3n"):
+    expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
+    body = {
+        "access": {
+            "token": {"id": token_id,
+                      "expires": expires.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                      "tenant": {"id": "tenant_id", "name": "tenant_name"}},
+            "user": {"id": "user_id", "name": "user"},
+            "serviceCatalog": [{
+                "type": "object-store",
+                "name": "swift",
+                "endpoints": [{"adminURL": "http://localhost:35357",
+                               "publicURL": "http://localhost",
+                               "internalURL": "http://localhost"}]
+            }]
+        }
+    }
+    return access.AccessInfo.factory(body=body)
+
+
+class KeystoneClientTokenCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        endpoint_cache.clear()
+        metrics.reset()
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_first_client_authenticates_and_caches_token(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+
+        KeystoneClient(tenant="tenant_name")
+
+        _, kwargs = client_mock.call_args
+        self.assertIsNone(kwargs["auth_ref"])
+        self.assertEqual(metrics.snapshot()["counters"]["keystone.token_cache.miss"], 1)
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_next_client_reuses_cached_token(self, client_mock):
+        auth_ref = build_auth_ref()
+        client_mock.return_value.auth_ref = auth_ref
+
+        KeystoneClient(tenant="tenant_name")
+        KeystoneClient(tenant="tenant_name")
+
+        _, kwargs = client_mock.call_args
+        self.assertIs(kwargs["auth_ref"], auth_ref)
+        self.assertEqual(metrics.snapshot()["counters"]["keystone.token_cache.hit"], 1)
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_tokens_are_cached_per_tenant(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+
+        KeystoneClient(tenant="tenant_name")
+        KeystoneClient(tenant="other_tenant")
+
+        _, kwargs = client_mock.call_args
+        self.assertIsNone(kwargs["auth_ref"])
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_token_about_to_expire_is_refreshed(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref(expires_in=60)
+
+        KeystoneClient(tenant="tenant_name")
+        KeystoneClient(tenant="tenant_name")
+
+        _, kwargs = client_mock.call_args
+        self.assertIsNone(kwargs["auth_ref"])
+        self.assertEqual(metrics.snapshot()["counters"]["keystone.token_cache.refresh"], 1)
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_invalidate_token_forces_authentication(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+
+        keystone = KeystoneClient(tenant="tenant_name")
+        keystone.invalidate_token()
+        KeystoneClient(tenant="tenant_name")
+
+        _, kwargs = client_mock.call_args
+        self.assertIsNone(kwargs["auth_ref"])
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_reauthenticate_returns_a_new_token(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+        keystone = KeystoneClient(tenant="tenant_name")
+
+        client_mock.return_value.auth_token = "new_token"
+        token = keystone.reauthenticate()
+
+        _, kwargs = client_mock.call_args
+        self.assertIsNone(kwargs["auth_ref"])
+        self.assertEqual(token, "new_token")
+
+    @patch("swiftsuru.keystone_client.SwiftsuruDBClient")
+    @patch("swiftsuru.keystone_client.client.Client")
+    @patch("swiftsuru.keystone_client.conf.KEYSTONE_TOKEN_SHARED_CACHE", True)
+    def test_shared_token_is_used_when_local_cache_misses(self, client_mock, dbclient_mock):
+        auth_ref = build_auth_ref(token_id="shared")
+        dbclient_mock.return_value.get_token.return_value = {"auth_ref": json.dumps(auth_ref)}
+
+        KeystoneClient(tenant="tenant_name")
+
+        _, kwargs = client_mock.call_args
+        self.assertEqual(kwargs["auth_ref"].auth_token, "shared")
+        self.assertEqual(metrics.snapshot()["counters"]["keystone.token_cache.shared_hit"], 1)
+
+    @patch("swiftsuru.keystone_client.SwiftsuruDBClient")
+    @patch("swiftsuru.keystone_client.client.Client")
+    @patch("swiftsuru.keystone_client.conf.KEYSTONE_TOKEN_SHARED_CACHE", True)
+    def test_new_token_is_shared(self, client_mock, dbclient_mock):
+        dbclient_mock.return_value.get_token.return_value = None
+        client_mock.return_value.auth_ref = build_auth_ref()
+
+        KeystoneClient(tenant="tenant_name")
+
+        args, _ = dbclient_mock.return_value.save_token.call_args
+        self.assertEqual(args[0], "tenant_name|user|https://127.0.0.1:5000/v2.0")
+
+
+class KeystoneClientEndpointCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        endpoint_cache.clear()
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_storage_endpoints_are_parsed_once_per_tenant(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+        get_endpoints = client_mock.return_value.service_catalog.get_endpoints
+        get_endpoints.return_value = {"object-store": [{"adminURL": "http://localhost:35357"}]}
+
+        KeystoneClient(tenant="tenant_name").get_storage_endpoints()
+        endpoints = KeystoneClient(tenant="tenant_name").get_storage_endpoints()
+
+        self.assertEqual(endpoints, {"adminURL": "http://localhost:35357"})
+        self.assertEqual(get_endpoints.call_count, 1)
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_invalidate_token_drops_storage_endpoints(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+        get_endpoints = client_mock.return_value.service_catalog.get_endpoints
+        get_endpoints.return_value = {"object-store": [{"adminURL": "http://localhost:35357"}]}
+
+        keystone = KeystoneClient(tenant="tenant_name")
+        keystone.get_storage_endpoints()
+        keystone.invalidate_token()
+        keystone.get_storage_endpoints()
+
+        self.assertEqual(get_endpoints.call_count, 2)
+
+
+class KeystoneClientSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        endpoint_cache.clear()
+
+    def tearDown(self):
+        keystone_client._http_session = None
+        keystone_client._http_session_pid = None
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_clients_of_different_tenants_share_http_session(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+
+        KeystoneClient(tenant="tenant_name")
+        _, first_kwargs = client_mock.call_args
+        KeystoneClient(tenant="other_tenant")
+        _, second_kwargs = client_mock.call_args
+
+        self.assertIsNot(first_kwargs["session"], second_kwargs["session"])
+        self.assertIs(first_kwargs["session"].session, second_kwargs["session"].session)
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_session_authenticates_with_its_own_client(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+
+        keystone = KeystoneClient(tenant="tenant_name")
+
+        _, kwargs = client_mock.call_args
+        self.assertIs(kwargs["session"].auth, keystone.conn)
+        keystone.conn.authenticate.assert_called_once_with()
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_cached_token_does_not_authenticate(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+        KeystoneClient(tenant="tenant_name")
+        client_mock.return_value.authenticate.reset_mock()
+
+        KeystoneClient(tenant="tenant_name")
+
+        self.assertFalse(client_mock.return_value.authenticate.called)
+
+    def test_http_session_pools_connections_with_conf_limits(self):
+        with patch("swiftsuru.keystone_client.conf.KEYSTONE_POOL_MAXSIZE", 7):
+            session = keystone_client.get_http_session()
+
+        adapter = session.get_adapter("https://keystone")
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertIs(keystone_client.get_http_session(), session)
+
+    @patch("swiftsuru.keystone_client.os.getpid")
+    def test_http_session_is_recreated_after_fork(self, getpid_mock):
+        getpid_mock.return_value = 100
+        session = keystone_client.get_http_session()
+
+        getpid_mock.return_value = 101
+        self.assertIsNot(keystone_client.get_http_session(), session)
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_delete_user_by_name(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+        users = client_mock.return_value.users
+
+        self.assertTrue(KeystoneClient(tenant="tenant_name").delete_user("storm"))
+
+        users.find.assert_called_once_with(name="storm")
+        users.delete.assert_called_once_with(users.find.return_value)
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_delete_missing_user(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+        users = client_mock.return_value.users
+        users.find.side_effect = NotFound()
+
+        self.assertFalse(KeystoneClient(tenant="tenant_name").delete_user("storm"))
+        self.assertFalse(users.delete.called)
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_update_password_by_name(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+        users = client_mock.return_value.users
+
+        with patch("swiftsuru.keystone_client.conf.KEYSTONE_VERSION", 2):
+            KeystoneClient(tenant="tenant_name").update_password("storm", "n3w")
+
+        users.find.assert_called_once_with(name="storm")
+        users.update_password.assert_called_once_with(users.find.return_value, "n3w")
+
+    @patch("swiftsuru.keystone_client.client.Client")
+    def test_list_users_of_a_project(self, client_mock):
+        client_mock.return_value.auth_ref = build_auth_ref()
+        storm, rogue = Mock(enabled=True), Mock(enabled=False)
+        storm.name, rogue.name = "storm", "rogue"
+        client_mock.return_value.users.list.return_value = [storm, rogue]
+
+        with patch("swiftsuru.keystone_client.conf.KEYSTONE_VERSION", 2):
+            users = KeystoneClient(tenant="tenant_name").list_users("tenant_name")
+
+        self.assertEqual(users, {"storm": True, "rogue": False})
+        project = client_mock.return_value.tenants.find.return_value
+        client_mock.return_value.users.list.assert_called_once_with(tenant_id=project.id)
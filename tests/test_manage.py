@@ -0,0 +1,106 @@
+import unittest
+
+from mock import patch, call
+
+from swiftsuru import manage
+
+
+class BackfillInstancesTest(unittest.TestCase):
+
+    @patch("swiftsuru.manage.KeystoneClient")
+    @patch("swiftsuru.manage.SwiftsuruDBClient")
+    def test_backfill_sets_tenant_and_endpoints_on_instances(self, dbclient_mock, keystoneclient_mock):
+        db_cli = dbclient_mock.return_value
+        db_cli.list_plans.return_value = [{"name": "Infra", "tenant": "infra_tenant"}]
+        db_cli.list_instances_without_location.return_value = [{"name": "one", "plan": "Infra"},
+                                                               {"name": "two", "plan": "Infra"},
+                                                               {"name": "three", "plan": "Gone"}]
+        keystoneclient_mock.return_value.get_storage_endpoints.return_value = {
+            "adminURL": "http://admin",
+            "publicURL": "http://public",
+            "internalURL": "http://internal",
+            "region": "RegionOne"
+        }
+
+        count = manage.backfill_instances()
+
+        endpoints = {"adminURL": "http://admin", "publicURL": "http://public", "internalURL": "http://internal"}
+        db_cli.set_instance_location.assert_has_calls([call("one", "infra_tenant", endpoints),
+                                                       call("two", "infra_tenant", endpoints)])
+        self.assertEqual(count, 2)
+        keystoneclient_mock.assert_called_once_with(tenant="infra_tenant")
+
+    @patch("swiftsuru.manage.KeystoneClient")
+    @patch("swiftsuru.manage.SwiftsuruDBClient")
+    def test_refresh_rewrites_changed_endpoints(self, dbclient_mock, keystoneclient_mock):
+        endpoints = {"adminURL": "http://admin", "publicURL": "http://public", "internalURL": "http://internal"}
+        db_cli = dbclient_mock.return_value
+        db_cli.iter_instances.return_value = [{"name": "one", "tenant": "infra_tenant", "endpoints": endpoints},
+                                              {"name": "two", "tenant": "infra_tenant", "endpoints": {}},
+                                              {"name": "legacy"}]
+        keystoneclient_mock.return_value.get_storage_endpoints.return_value = dict(endpoints, region="RegionOne")
+
+        count = manage.refresh_endpoints()
+
+        db_cli.set_instance_location.assert_called_once_with("two", "infra_tenant", endpoints)
+        self.assertEqual(count, 1)
+        keystoneclient_mock.assert_called_once_with(tenant="infra_tenant")
+
+    @patch("swiftsuru.manage.backfill_instances")
+    def test_main_runs_command(self, backfill_mock):
+        with patch.dict(manage.COMMANDS, {"backfill-instances": backfill_mock}):
+            manage.main(["backfill-instances"])
+
+        backfill_mock.assert_called_once_with()
+
+
+class IndexesTest(unittest.TestCase):
+
+    @patch("swiftsuru.manage.SwiftsuruDBClient")
+    def test_build_indexes_runs_in_background(self, dbclient_mock):
+        dbclient_mock.return_value.ensure_indexes.return_value = {}
+
+        manage.build_indexes()
+
+        dbclient_mock.return_value.ensure_indexes.assert_called_once_with(background=True)
+
+    @patch("swiftsuru.manage.SwiftsuruDBClient")
+    def test_build_indexes_fails_when_an_index_fails(self, dbclient_mock):
+        dbclient_mock.return_value.ensure_indexes.return_value = {"instances.tenant_live": Exception("conflict")}
+
+        self.assertRaises(SystemExit, manage.build_indexes)
+
+    def test_plan_stages_walks_inner_stages(self):
+        plan = {"stage": "SORT",
+                "inputStage": {"stage": "SUBPLAN",
+                               "inputStage": {"stage": "OR",
+                                              "inputStages": [{"stage": "IXSCAN"},
+                                                              {"stage": "COLLSCAN"}]}}}
+
+        self.assertEqual(manage.plan_stages(plan), ["SORT", "SUBPLAN", "OR", "IXSCAN", "COLLSCAN"])
+
+    @patch("swiftsuru.manage.SwiftsuruDBClient")
+    def test_collection_scans_lists_queries_without_index(self, dbclient_mock):
+        queries = [("get_plan", "plans", {"name": "plan"}, None),
+                   ("list_acl_permits", "acl_permits", {}, None)]
+        dbclient_mock.return_value.query_plan.side_effect = [
+            {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+            {"stage": "COLLSCAN"}]
+
+        with patch("swiftsuru.manage.dbclient.QUERIES", queries):
+            self.assertEqual(manage.collection_scans(), ["list_acl_permits"])
+
+        dbclient_mock.return_value.query_plan.assert_has_calls([call("plans", {"name": "plan"}, None),
+                                                                call("acl_permits", {}, None)])
+
+    @patch("swiftsuru.manage.collection_scans")
+    def test_check_indexes_fails_on_collection_scans(self, collection_scans_mock):
+        collection_scans_mock.return_value = ["list_acl_permits"]
+
+        self.assertRaises(SystemExit, manage.check_indexes)
+
+    @patch("swiftsuru.manage.collection_scans")
+    def test_check_indexes_passes_without_collection_scans(self, collection_scans_mock):
+        collection_scans_mock.return_value = []
+
+        manage.check_indexes()
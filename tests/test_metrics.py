@@ -0,0 +1,36 @@
+import unittest
+
+from swiftsuru import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_incr_accumulates_counter(self):
+        metrics.incr("hits")
+        metrics.incr("hits", 2)
+
+        self.assertEqual(metrics.snapshot()["counters"]["hits"], 3)
+
+    def test_observe_keeps_count_total_max_and_avg(self):
+        metrics.observe("call", 1.0)
+        metrics.observe("call", 3.0)
+
+        computed = metrics.snapshot()["timings"]["call"]
+        expected = {"count": 2, "total": 4.0, "max": 3.0, "avg": 2.0}
+
+        self.assertEqual(computed, expected)
+
+    def test_timer_observes_block_duration(self):
+        with metrics.timer("block"):
+            pass
+
+        self.assertEqual(metrics.snapshot()["timings"]["block"]["count"], 1)
+
+    def test_gauge_keeps_last_value(self):
+        metrics.gauge("size", 1)
+        metrics.gauge("size", 5)
+
+        self.assertEqual(metrics.snapshot()["gauges"]["size"], 5)
@@ -0,0 +1,57 @@
+import unittest
+
+from mock import patch, call
+
+from swiftsuru.keystone_client import token_cache
+from swiftsuru.prewarm import TokenPrewarmer
+from tests.test_keystone_client import build_auth_ref
+
+
+@patch("swiftsuru.prewarm.conf.KEYSTONE_PREWARM_JITTER", 0)
+class TokenPrewarmerTest(unittest.TestCase):
+
+    def setUp(self):
+        token_cache.clear()
+
+    @patch("swiftsuru.prewarm.SwiftsuruDBClient")
+    def test_tenants_are_unique_and_taken_from_plans(self, dbclient_mock):
+        dbclient_mock.return_value.list_plans.return_value = [{"name": "a", "tenant": "infra"},
+                                                              {"name": "b", "tenant": "infra"},
+                                                              {"name": "c", "tenant": "media"},
+                                                              {"name": "d"}]
+
+        self.assertEqual(TokenPrewarmer().tenants(), ["infra", "media"])
+
+    @patch("swiftsuru.prewarm.KeystoneClient")
+    def test_warm_authenticates_tenant_without_token(self, keystoneclient_mock):
+        TokenPrewarmer().warm("infra")
+
+        keystoneclient_mock.assert_called_once_with(tenant="infra", force_auth=True)
+
+    @patch("swiftsuru.prewarm.KeystoneClient")
+    def test_warm_renews_token_close_to_expire(self, keystoneclient_mock):
+        token_cache.set(("infra", "user", "https://127.0.0.1:5000/v2.0"), build_auth_ref(expires_in=600))
+
+        TokenPrewarmer().warm("infra")
+
+        self.assertTrue(keystoneclient_mock.called)
+
+    @patch("swiftsuru.prewarm.KeystoneClient")
+    def test_warm_keeps_fresh_token(self, keystoneclient_mock):
+        token_cache.set(("infra", "user", "https://127.0.0.1:5000/v2.0"), build_auth_ref(expires_in=3600))
+
+        TokenPrewarmer().warm("infra")
+
+        self.assertFalse(keystoneclient_mock.called)
+
+    @patch("swiftsuru.prewarm.KeystoneClient")
+    @patch("swiftsuru.prewarm.SwiftsuruDBClient")
+    def test_run_once_warms_every_tenant(self, dbclient_mock, keystoneclient_mock):
+        dbclient_mock.return_value.list_plans.return_value = [{"name": "a", "tenant": "infra"},
+                                                              {"name": "c", "tenant": "media"}]
+
+        TokenPrewarmer().run_once()
+
+        keystoneclient_mock.assert_has_calls([call(tenant="infra", force_auth=True),
+                                              call(tenant="media", force_auth=True)],
+                                             any_order=True)
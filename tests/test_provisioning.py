@@ -0,0 +1,179 @@
+import unittest
+
+from datetime import datetime
+
+from keystoneclient.exceptions import Conflict
+from mock import patch, call
+from pymongo.errors import DuplicateKeyError
+
+from swiftsuru import provisioning
+
+
+def build_job(steps=None, attempts=1):
+    return {"_id": "job_id",
+            "name": "myinstance",
+            "status": "running",
+            "steps": steps or [],
+            "attempts": attempts,
+            "error": None,
+            "created_at": datetime(2016, 1, 1),
+            "updated_at": datetime(2016, 1, 1),
+            "params": {"team": "myteam",
+                       "plan": "small",
+                       "tenant": "infra",
+                       "user": "myteam_myinstance",
+                       "password": "s3cr3t",
+                       "container": "e2opim"}}
+
+
+@patch("swiftsuru.provisioning.SwiftClient")
+@patch("swiftsuru.provisioning.KeystoneClient")
+@patch("swiftsuru.provisioning.SwiftsuruDBClient")
+class ProvisionerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reserved = "e2opim"
+
+    def reserve(self, dbclient_mock):
+        dbclient_mock.return_value.reserve_instance_name.return_value = self.reserved
+
+    def test_run_creates_user_containers_and_instance(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        self.reserve(dbclient_mock)
+        keystoneclient_mock.return_value.get_storage_endpoints.return_value = {
+            "adminURL": "http://admin/v1/AUTH_infra",
+            "publicURL": "http://public/v1/AUTH_infra",
+            "internalURL": "http://internal/v1/AUTH_infra"}
+        # Child mocks are created before containers are created concurrently
+        create_container = swiftclient_mock.return_value.__enter__.return_value.create_container
+
+        job = build_job()
+        provisioning.Provisioner(job["name"], job["params"],
+                                 on_step=dbclient_mock.return_value.add_job_step).run()
+
+        keystoneclient_mock.assert_called_once_with(tenant="infra")
+        dbclient_mock.return_value.reserve_instance_name.assert_called_once_with("myinstance", "e2opim")
+        self.assertTrue(keystoneclient_mock.return_value.create_user.called)
+
+        self.assertEqual(sorted(args[0] for args, _ in create_container.call_args_list),
+                         [".trash-e2opim", "e2opim"])
+
+        _, kwargs = dbclient_mock.return_value.add_instance.call_args
+        self.assertEqual(kwargs["tenant"], "infra")
+        self.assertEqual(dbclient_mock.return_value.add_job_step.call_args_list,
+                         [call("keystone_user"), call("containers"), call("instance")])
+
+    def test_run_skips_steps_already_done(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        job = build_job()
+        provisioning.Provisioner(job["name"], job["params"], ["keystone_user", "containers"]).run()
+
+        self.assertFalse(keystoneclient_mock.return_value.create_user.called)
+        self.assertFalse(swiftclient_mock.called)
+        self.assertTrue(dbclient_mock.return_value.add_instance.called)
+
+    def test_existing_user_gets_the_password_of_the_job(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        self.reserve(dbclient_mock)
+        keystoneclient_mock.return_value.create_user.side_effect = Conflict()
+        dbclient_mock.return_value.get_instance.return_value = None
+
+        job = build_job()
+        provisioning.Provisioner(job["name"], job["params"], ["containers", "instance"],
+                                 dbclient_mock.return_value.add_job_step).run()
+
+        keystoneclient_mock.return_value.update_password.assert_called_once_with("myteam_myinstance", "s3cr3t")
+        dbclient_mock.return_value.add_job_step.assert_called_once_with("keystone_user")
+
+    def test_user_of_another_instance_fails_the_step(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        self.reserve(dbclient_mock)
+        keystoneclient_mock.return_value.create_user.side_effect = Conflict()
+        dbclient_mock.return_value.get_instance.return_value = {"name": "myinstance", "container": "old",
+                                                                "deleted": True}
+
+        job = build_job()
+        provisioner = provisioning.Provisioner(job["name"], job["params"], ["containers", "instance"],
+                                               dbclient_mock.return_value.add_job_step)
+
+        self.assertRaises(Exception, provisioner.run)
+        dbclient_mock.return_value.get_instance.assert_called_once_with("myinstance", include_deleted=True)
+        self.assertFalse(keystoneclient_mock.return_value.update_password.called)
+        self.assertFalse(dbclient_mock.return_value.add_job_step.called)
+
+    def test_name_reserved_by_another_job_fails_the_step(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        self.reserved = "other"
+        self.reserve(dbclient_mock)
+
+        job = build_job()
+        provisioner = provisioning.Provisioner(job["name"], job["params"], ["containers", "instance"],
+                                               dbclient_mock.return_value.add_job_step)
+
+        self.assertRaises(Exception, provisioner.run)
+        self.assertFalse(keystoneclient_mock.return_value.create_user.called)
+        self.assertFalse(keystoneclient_mock.return_value.update_password.called)
+
+    def test_users_without_instance_reserve_no_name(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        provisioning.Provisioner(None, build_job()["params"]).keystone_user()
+
+        self.assertFalse(dbclient_mock.return_value.reserve_instance_name.called)
+        self.assertTrue(keystoneclient_mock.return_value.create_user.called)
+
+    def test_instance_recorded_by_a_previous_attempt_is_not_an_error(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        dbclient_mock.return_value.add_instance.side_effect = DuplicateKeyError("E11000")
+        dbclient_mock.return_value.get_instance.return_value = {"name": "myinstance", "container": "e2opim"}
+
+        job = build_job()
+        provisioning.Provisioner(job["name"], job["params"], ["keystone_user", "containers"],
+                                 dbclient_mock.return_value.add_job_step).run()
+
+        dbclient_mock.return_value.add_job_step.assert_called_once_with("instance")
+
+    def test_instance_of_another_job_fails_the_step(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        dbclient_mock.return_value.add_instance.side_effect = DuplicateKeyError("E11000")
+        dbclient_mock.return_value.get_instance.return_value = {"name": "myinstance", "container": "old",
+                                                                "deleted": True}
+
+        job = build_job()
+        provisioner = provisioning.Provisioner(job["name"], job["params"], ["keystone_user", "containers"],
+                                               dbclient_mock.return_value.add_job_step)
+
+        self.assertRaises(Exception, provisioner.run)
+        self.assertFalse(dbclient_mock.return_value.add_job_step.called)
+
+
+@patch("swiftsuru.provisioning.Provisioner")
+@patch("swiftsuru.provisioning.SwiftsuruDBClient")
+class ProvisioningWorkerTest(unittest.TestCase):
+
+    def test_run_once_processes_jobs_until_queue_is_empty(self, dbclient_mock, provisioner_mock):
+        dbclient_mock.return_value.claim_job.side_effect = [build_job(), build_job(), None]
+
+        provisioning.ProvisioningWorker().run_once()
+
+        self.assertEqual(provisioner_mock.return_value.run.call_count, 2)
+        self.assertEqual(provisioner_mock.call_args[0][:3], ("myinstance", build_job()["params"], []))
+        dbclient_mock.return_value.set_job_status.assert_called_with("job_id", "done")
+
+    @patch("swiftsuru.provisioning.conf.PROVISIONING_MAX_ATTEMPTS", 3)
+    def test_failed_job_is_retried(self, dbclient_mock, provisioner_mock):
+        provisioner_mock.return_value.run.side_effect = Exception("keystone is down")
+
+        provisioning.ProvisioningWorker().process(build_job(attempts=1))
+
+        dbclient_mock.return_value.set_job_status.assert_called_once_with("job_id", "pending", "keystone is down")
+
+    @patch("swiftsuru.provisioning.conf.PROVISIONING_MAX_ATTEMPTS", 3)
+    def test_job_fails_after_max_attempts(self, dbclient_mock, provisioner_mock):
+        provisioner_mock.return_value.run.side_effect = Exception("keystone is down")
+
+        provisioning.ProvisioningWorker().process(build_job(attempts=3))
+
+        dbclient_mock.return_value.set_job_status.assert_called_once_with("job_id", "failed", "keystone is down")
+        dbclient_mock.return_value.release_instance_name.assert_called_once_with("myinstance", "e2opim")
+
+
+class JobStatusTest(unittest.TestCase):
+
+    def test_job_status_hides_credentials(self):
+        computed = provisioning.job_status(build_job(steps=["keystone_user"]))
+
+        self.assertNotIn("params", computed)
+        self.assertEqual(computed["steps"], ["keystone_user"])
+        self.assertEqual(computed["created_at"], "2016-01-01T00:00:00")
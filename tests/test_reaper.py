@@ -0,0 +1,96 @@
+import unittest
+
+from datetime import datetime
+
+from mock import patch, call
+
+from swiftsuru.reaper import InstanceReaper, Reaper
+
+
+def build_instance(steps=None):
+    return {"_id": "instance_id",
+            "name": "myswift",
+            "container": "e2opim",
+            "plan": "Infra",
+            "tenant": "infra",
+            "user": "storm",
+            "deleted": True,
+            "reap_steps": steps or []}
+
+
+# Mock call counts are not thread safe
+@patch("swiftsuru.reaper.conf.REAPER_CONCURRENCY", 1)
+@patch("swiftsuru.reaper.conf.REAPER_BULK_DELETE_SIZE", 100)
+@patch("swiftsuru.reaper.SwiftClient")
+@patch("swiftsuru.reaper.KeystoneClient")
+@patch("swiftsuru.reaper.SwiftsuruDBClient")
+class InstanceReaperTest(unittest.TestCase):
+
+    def test_run_empties_and_deletes_containers_and_user(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        client = swiftclient_mock.return_value.__enter__.return_value
+        client.empty_container.return_value = 3
+        db_cli = dbclient_mock.return_value
+
+        InstanceReaper(build_instance(), db_cli).run()
+
+        self.assertEqual(sorted(client.empty_container.call_args_list),
+                         [call(".trash-e2opim", 100), call("e2opim", 100)])
+        self.assertEqual(sorted(client.delete_container.call_args_list),
+                         [call(".trash-e2opim"), call("e2opim")])
+        keystoneclient_mock.assert_called_once_with(tenant="infra")
+        keystoneclient_mock.return_value.delete_user.assert_called_once_with("storm")
+        self.assertEqual(db_cli.add_reap_step.call_args_list,
+                         [call("instance_id", "objects"),
+                          call("instance_id", "containers"),
+                          call("instance_id", "keystone_user")])
+        db_cli.archive_instance.assert_called_once_with(build_instance())
+
+    def test_run_resumes_after_last_step_done(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        db_cli = dbclient_mock.return_value
+
+        InstanceReaper(build_instance(steps=["objects", "containers"]), db_cli).run()
+
+        self.assertFalse(swiftclient_mock.called)
+        keystoneclient_mock.return_value.delete_user.assert_called_once_with("storm")
+
+    def test_failed_step_keeps_instance(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        client = swiftclient_mock.return_value.__enter__.return_value
+        client.delete_container.side_effect = Exception("swift is down")
+        db_cli = dbclient_mock.return_value
+
+        self.assertRaises(Exception, InstanceReaper(build_instance(), db_cli).run)
+
+        db_cli.add_reap_step.assert_called_once_with("instance_id", "objects")
+        self.assertFalse(db_cli.archive_instance.called)
+
+
+@patch("swiftsuru.reaper.conf.REAPER_CONCURRENCY", 1)
+@patch("swiftsuru.reaper.InstanceReaper")
+@patch("swiftsuru.reaper.SwiftsuruDBClient")
+class ReaperTest(unittest.TestCase):
+
+    @patch("swiftsuru.reaper.conf.REAPER_BATCH_SIZE", 2)
+    def test_run_once_reaps_a_batch(self, dbclient_mock, instance_reaper_mock):
+        dbclient_mock.return_value.claim_deleted_instance.side_effect = [build_instance(), build_instance(), build_instance()]
+
+        Reaper().run_once()
+
+        self.assertEqual(dbclient_mock.return_value.claim_deleted_instance.call_count, 2)
+        self.assertEqual(instance_reaper_mock.return_value.run.call_count, 2)
+
+    @patch("swiftsuru.reaper.conf.REAPER_GRACE_PERIOD", 3600)
+    def test_run_once_only_claims_instances_past_the_grace_period(self, dbclient_mock, instance_reaper_mock):
+        dbclient_mock.return_value.claim_deleted_instance.return_value = None
+
+        Reaper().run_once()
+
+        stale_before, deleted_before = dbclient_mock.return_value.claim_deleted_instance.call_args[0]
+        self.assertAlmostEqual((datetime.utcnow() - deleted_before).total_seconds(), 3600, delta=5)
+
+    def test_failure_of_an_instance_does_not_stop_the_batch(self, dbclient_mock, instance_reaper_mock):
+        dbclient_mock.return_value.claim_deleted_instance.side_effect = [build_instance(), build_instance(), None]
+        instance_reaper_mock.return_value.run.side_effect = [Exception("keystone is down"), None]
+
+        Reaper().run_once()
+
+        self.assertEqual(instance_reaper_mock.return_value.run.call_count, 2)
@@ -0,0 +1,49 @@
+import threading
+import unittest
+
+from swiftsuru import scheduler
+
+
+class CountingTask(scheduler.PeriodicTask):
+
+    def __init__(self, runs):
+        super(CountingTask, self).__init__(interval=0)
+        self.runs = runs
+        self.calls = 0
+        self.done = threading.Event()
+
+    def run_once(self):
+        self.calls += 1
+
+        if self.calls == self.runs:
+            self.stop()
+            self.done.set()
+
+        if self.calls == 1:
+            raise Exception("errors should not stop the task")
+
+
+class PeriodicTaskTest(unittest.TestCase):
+
+    def test_task_keeps_running_until_stopped(self):
+        task = scheduler.start(CountingTask(runs=3))
+        task.done.wait(5)
+        task.join(5)
+
+        self.assertEqual(task.calls, 3)
+        scheduler.stop_all()
+
+    def test_next_delay_adds_jitter_to_interval(self):
+        task = scheduler.PeriodicTask(interval=10, jitter=5)
+
+        self.assertTrue(10 <= task.next_delay() <= 15)
+
+    def test_first_run_is_not_delayed_by_default(self):
+        task = scheduler.PeriodicTask(interval=10, jitter=5)
+
+        self.assertEqual(task.first_delay(), 0)
+
+    def test_first_delay_is_up_to_initial_jitter(self):
+        task = scheduler.PeriodicTask(interval=10, jitter=5, initial_jitter=60)
+
+        self.assertTrue(0 <= task.first_delay() <= 60)
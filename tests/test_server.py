@@ -0,0 +1,75 @@
+import unittest
+
+from mock import patch, call
+
+from swiftsuru import server
+
+
+class ServerTest(unittest.TestCase):
+
+    @patch("swiftsuru.server.conf")
+    def test_options_are_taken_from_conf(self, conf_mock):
+        conf_mock.HOST = "0.0.0.0"
+        conf_mock.PORT = 8888
+        conf_mock.WEB_WORKERS = 3
+        conf_mock.WEB_THREADS = 16
+        conf_mock.WEB_MAX_REQUESTS = 1000
+
+        computed = server.options()
+
+        self.assertEqual(computed["bind"], "0.0.0.0:8888")
+        self.assertEqual(computed["workers"], 3)
+        self.assertEqual(computed["threads"], 16)
+        self.assertEqual(computed["max_requests"], 1000)
+        self.assertEqual(computed["post_fork"], server.post_fork)
+        self.assertEqual(computed["worker_exit"], server.worker_exit)
+
+    @patch("swiftsuru.server.conf")
+    def test_gevent_worker_options(self, conf_mock):
+        conf_mock.WEB_WORKER_CLASS = "gevent"
+        conf_mock.WEB_WORKER_CONNECTIONS = 500
+
+        computed = server.options()
+
+        self.assertEqual(computed["worker_class"], "gevent")
+        self.assertEqual(computed["worker_connections"], 500)
+
+    @patch("swiftsuru.server.api.close_bind_pool")
+    def test_worker_exit_closes_bind_pool(self, close_bind_pool_mock):
+        server.worker_exit(None, None)
+
+        close_bind_pool_mock.assert_called_once_with()
+
+    def test_server_loads_given_settings(self):
+        app = object()
+        computed = server.Server(app, {"workers": 5, "max_requests": 10})
+
+        self.assertEqual(computed.cfg.workers, 5)
+        self.assertEqual(computed.cfg.max_requests, 10)
+        self.assertIs(computed.load(), app)
+
+    @patch("swiftsuru.server.conf.KEYSTONE_PREWARM_CONCURRENCY", 1)
+    @patch("swiftsuru.server.SwiftClient")
+    @patch("swiftsuru.server.KeystoneClient")
+    @patch("swiftsuru.server.SwiftsuruDBClient")
+    @patch("swiftsuru.server.dbclient.get_connection")
+    def test_warm_pools_connects_every_tenant(self, get_connection_mock, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        dbclient_mock.return_value.list_plans.return_value = [{"name": "a", "tenant": "infra"},
+                                                              {"name": "b", "tenant": "infra"},
+                                                              {"name": "c", "tenant": "media"}]
+
+        server.warm_pools()
+
+        get_connection_mock.return_value.admin.command.assert_called_once_with("ping")
+        self.assertEqual(sorted(keystoneclient_mock.call_args_list),
+                         [call(tenant="infra"), call(tenant="media")])
+        self.assertEqual(swiftclient_mock.return_value.__enter__.return_value.conn.head_account.call_count, 2)
+
+    @patch("swiftsuru.server.KeystoneClient")
+    @patch("swiftsuru.server.dbclient.get_connection")
+    def test_warm_pools_survives_mongodb_failure(self, get_connection_mock, keystoneclient_mock):
+        get_connection_mock.return_value.admin.command.side_effect = Exception("down")
+
+        server.warm_pools()
+
+        self.assertFalse(keystoneclient_mock.called)
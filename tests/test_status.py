@@ -0,0 +1,105 @@
+import unittest
+
+from datetime import datetime
+
+from mock import patch
+
+from swiftsuru import status
+from swiftsuru.status import StatusProber, instance_status, status_cache
+
+
+def build_instance(name, user="storm", tenant="infra"):
+    return {"name": name, "container": "c_{}".format(name), "plan": "Infra",
+            "tenant": tenant, "user": user}
+
+
+@patch("swiftsuru.status.SwiftsuruDBClient")
+class InstanceStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        status_cache.clear()
+
+    def test_status_is_read_once_and_cached(self, dbclient_mock):
+        dbclient_mock.return_value.get_instance_status.return_value = {"state": "up"}
+
+        self.assertEqual(instance_status("myswift")["state"], "up")
+        self.assertEqual(instance_status("myswift")["state"], "up")
+
+        dbclient_mock.return_value.get_instance_status.assert_called_once_with("myswift")
+
+    def test_instance_not_probed_yet_is_pending(self, dbclient_mock):
+        dbclient_mock.return_value.get_instance_status.return_value = {}
+
+        self.assertEqual(instance_status("myswift")["state"], status.PENDING)
+
+    def test_instance_being_provisioned_is_pending(self, dbclient_mock):
+        dbclient_mock.return_value.get_instance_status.return_value = None
+        dbclient_mock.return_value.get_job.return_value = {"status": "running"}
+
+        self.assertEqual(instance_status("myswift")["state"], status.PENDING)
+
+    def test_unknown_instance_is_missing(self, dbclient_mock):
+        dbclient_mock.return_value.get_instance_status.return_value = None
+        dbclient_mock.return_value.get_job.return_value = {"status": "failed"}
+
+        self.assertEqual(instance_status("myswift")["state"], status.MISSING)
+
+
+# Mock call counts are not thread safe
+@patch("swiftsuru.status.conf.STATUS_PROBE_CONCURRENCY", 1)
+@patch("swiftsuru.status.SwiftClient")
+@patch("swiftsuru.status.KeystoneClient")
+@patch("swiftsuru.status.SwiftsuruDBClient")
+class StatusProberTest(unittest.TestCase):
+
+    def stored_states(self, db_cli):
+        return dict((name, (value["state"], value["reason"]))
+                    for name, value in [c[0] for c in db_cli.set_instance_status.call_args_list])
+
+    def test_probe_combines_keystone_user_and_container(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        db_cli = dbclient_mock.return_value
+        db_cli.claim_instances.side_effect = [[build_instance("ok"),
+                                               build_instance("no_user", user="gone"),
+                                               build_instance("disabled", user="disabled"),
+                                               build_instance("no_container")], []]
+        keystoneclient_mock.return_value.list_users.return_value = {"storm": True, "disabled": False}
+        client = swiftclient_mock.return_value.__enter__.return_value
+        client.container_exists.side_effect = lambda container: container != "c_no_container"
+
+        StatusProber().run_once()
+
+        self.assertEqual(self.stored_states(db_cli),
+                         {"ok": ("up", None),
+                          "no_user": ("down", "Keystone user does not exist"),
+                          "disabled": ("down", "Keystone user is disabled"),
+                          "no_container": ("down", "Container does not exist")})
+        keystoneclient_mock.return_value.list_users.assert_called_once_with("infra")
+
+    def test_unreachable_keystone_sets_instances_down(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        db_cli = dbclient_mock.return_value
+        db_cli.claim_instances.side_effect = [[build_instance("one")], []]
+        keystoneclient_mock.side_effect = Exception("keystone is down")
+
+        StatusProber().run_once()
+
+        self.assertEqual(self.stored_states(db_cli), {"one": ("down", "Keystone is unreachable")})
+        self.assertFalse(swiftclient_mock.called)
+
+    def test_first_probe_is_spread_over_the_jitter(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        self.assertEqual(StatusProber().initial_jitter, status.conf.STATUS_PROBE_JITTER)
+
+    @patch("swiftsuru.status.conf.STATUS_PROBE_BATCH_SIZE", 2)
+    def test_instances_are_claimed_in_batches(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        db_cli = dbclient_mock.return_value
+        db_cli.claim_instances.side_effect = [[build_instance("one"), build_instance("two")],
+                                              [build_instance("three")], []]
+        keystoneclient_mock.return_value.list_users.return_value = {"storm": True}
+        swiftclient_mock.return_value.__enter__.return_value.container_exists.return_value = True
+
+        StatusProber().run_once()
+
+        self.assertEqual(sorted(self.stored_states(db_cli)), ["one", "three", "two"])
+        self.assertEqual(db_cli.claim_instances.call_count, 3)
+        field, probed_before, limit, fields = db_cli.claim_instances.call_args[0]
+        self.assertEqual((field, limit), ("status_probed_at", 2))
+        self.assertLess(probed_before, datetime.utcnow())
@@ -1,11 +1,13 @@
 import unittest
 
-from mock import patch, call
+from mock import patch, call, Mock
+from swiftclient.exceptions import ClientException
 from collections import namedtuple
 
 from bogus.server import Bogus
 
-from swiftsuru.swift_client import SwiftClient
+from swiftsuru import swift_client
+from swiftsuru.swift_client import SwiftClient, ConnectionPool
 from swiftsuru.conf import AUTH_URL, USER, KEY
 
 
@@ -15,6 +17,8 @@ class SwiftClientTest(unittest.TestCase):
         self.url = "swifturl.com/AUTH_user"
         self.token = "AUTH_tk65ade122e45449f2aefdffcf72a30bd7"
         Bogus.called_paths = []
+        swift_client.pool.clear()
+        swift_client.swift_auth.clear()
 
     @patch("swiftsuru.swift_client.swiftclient")
     def test_init_should_obtain_token(self, swiftclient):
@@ -90,6 +94,81 @@ class SwiftClientTest(unittest.TestCase):
             cli.remove_container("my_container", {"X-Container-Meta-something": "some metadata"})
             self.assertIn("/v1/AUTH_user/my_container", b.called_paths)
 
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection._retry")
+    @patch("swiftclient.client.Connection.get_container")
+    def test_empty_container_bulk_deletes_every_listing(self, get_container_mock, retry_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+        get_container_mock.side_effect = [({}, [{"name": "a.txt"}, {"name": u"\xe7.txt"}]),
+                                          ({}, [{"name": "c.txt"}]),
+                                          ({}, [])]
+        retry_mock.return_value = {"Number Deleted": 2, "Errors": []}
+
+        deleted = SwiftClient().empty_container("my_container", 2)
+
+        self.assertEqual(deleted, 3)
+        get_container_mock.assert_called_with("my_container", limit=2)
+        self.assertEqual(retry_mock.call_args_list,
+                         [call(None, swift_client.bulk_delete, [u"/my_container/a.txt", u"/my_container/\xe7.txt"]),
+                          call(None, swift_client.bulk_delete, [u"/my_container/c.txt"])])
+
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection.get_container")
+    def test_empty_container_of_a_missing_container(self, get_container_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+        get_container_mock.side_effect = ClientException("Not Found", http_status=404)
+
+        self.assertEqual(SwiftClient().empty_container("my_container", 100), 0)
+
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection._retry")
+    @patch("swiftclient.client.Connection.get_container")
+    def test_empty_container_raises_on_bulk_delete_errors(self, get_container_mock, retry_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+        get_container_mock.return_value = ({}, [{"name": "a.txt"}])
+        retry_mock.return_value = {"Number Deleted": 0, "Errors": [["/my_container/a.txt", "409 Conflict"]]}
+
+        self.assertRaises(ClientException, SwiftClient().empty_container, "my_container", 100)
+
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection.delete_container")
+    def test_delete_container_ignores_missing_container(self, delete_container_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+        delete_container_mock.side_effect = ClientException("Not Found", http_status=404)
+
+        SwiftClient().delete_container("my_container")
+
+        delete_container_mock.assert_called_once_with("my_container")
+
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection.head_container")
+    def test_container_exists(self, head_container_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+
+        self.assertTrue(SwiftClient().container_exists("my_container"))
+
+        head_container_mock.side_effect = ClientException("Not Found", http_status=404)
+        self.assertFalse(SwiftClient().container_exists("my_container"))
+
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection.head_container")
+    def test_container_usage_reads_container_headers(self, head_container_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+        head_container_mock.return_value = {"x-container-bytes-used": "2048",
+                                            "x-container-object-count": "4"}
+
+        usage = SwiftClient().container_usage("my_container")
+
+        self.assertEqual(usage, {"bytes": 2048, "objects": 4})
+
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection.head_container")
+    def test_container_usage_of_a_missing_container(self, head_container_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+        head_container_mock.side_effect = ClientException("Not Found", http_status=404)
+
+        self.assertEqual(SwiftClient().container_usage("my_container"), {"bytes": 0, "objects": 0})
+
     @patch("swiftclient.client.Connection.get_auth")
     def test_set_cors_http_request(self, get_auth_mock):
         b = Bogus()
@@ -128,6 +207,33 @@ class SwiftClientTest(unittest.TestCase):
         expected_header = {'X-Container-Meta-Access-Control-Allow-Origin': 'http://somehost http://myhost'}
         post_container_mock.assert_called_once_with('mycontainer', expected_header)
 
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection.head_container")
+    @patch("swiftclient.client.Connection.post_container")
+    def test_set_cors_does_not_post_when_url_is_already_present(self, post_container_mock, head_container_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+        head_container_mock.return_value = {
+            'x-container-meta-access-control-allow-origin': 'http://myhost https://myhost'
+        }
+
+        cli = SwiftClient()
+        cli.set_cors('mycontainer', 'http://myhost https://myhost')
+
+        self.assertFalse(post_container_mock.called)
+
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection.head_container")
+    @patch("swiftclient.client.Connection.post_container")
+    def test_write_cors_posts_without_reading_header(self, post_container_mock, head_container_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+
+        cli = SwiftClient()
+        cli.write_cors('mycontainer', 'http://myhost')
+
+        expected_header = {'X-Container-Meta-Access-Control-Allow-Origin': 'http://myhost'}
+        post_container_mock.assert_called_once_with('mycontainer', expected_header)
+        self.assertFalse(head_container_mock.called)
+
     @patch("swiftclient.client.Connection.get_auth")
     @patch("swiftclient.client.Connection.head_container")
     def test_get_cors_of_a_container(self, head_container_mock, get_auth_mock):
@@ -170,3 +276,172 @@ class SwiftClientTest(unittest.TestCase):
 
         expected_header = {'X-Container-Meta-Access-Control-Allow-Origin': 'https://otherhost http://thirdhost'}
         post_container_mock.assert_called_once_with('mycontainer', expected_header)
+
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection.head_container")
+    @patch("swiftclient.client.Connection.post_container")
+    def test_unset_cors_removes_only_whole_origins(self, post_container_mock, head_container_mock, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+        head_container_mock.return_value = {
+            'x-container-meta-access-control-allow-origin': 'http://somehost.io http://host.io'
+        }
+
+        cli = SwiftClient()
+        cli.unset_cors('mycontainer', 'http://host.io')
+
+        expected_header = {'X-Container-Meta-Access-Control-Allow-Origin': 'http://somehost.io'}
+        post_container_mock.assert_called_once_with('mycontainer', expected_header)
+
+    @patch("swiftclient.client.Connection.head_container")
+    def test_unauthorized_response_swaps_keystone_token_and_retries(self, head_container_mock):
+        keystone = Mock()
+        keystone.get_storage_endpoints.return_value = {"adminURL": "http://somehost/v1/AUTH_user"}
+        keystone.reauthenticate.return_value = "new_token"
+        head_container_mock.side_effect = [ClientException("Unauthorized", http_status=401),
+                                           {'x-container-meta-access-control-allow-origin': 'http://somehost'}]
+
+        cli = SwiftClient(keystone)
+        computed_cors = cli.get_cors('mycontainer')
+
+        self.assertEqual(computed_cors, 'http://somehost')
+        self.assertEqual(cli.conn.token, "new_token")
+        self.assertEqual(cli.conn.url, "http://somehost/v1/AUTH_user")
+
+    @patch("swiftclient.client.Connection.get_auth")
+    @patch("swiftclient.client.Connection.head_container")
+    def test_unauthorized_response_authenticates_again_without_keystone(self, head_container_mock, get_auth_mock):
+        get_auth_mock.side_effect = [("http://somehost/v1/AUTH_user", "old_token"),
+                                     ("http://somehost/v1/AUTH_user", "new_token")]
+        head_container_mock.side_effect = [ClientException("Unauthorized", http_status=401), {}]
+
+        cli = SwiftClient()
+        cli.get_cors('mycontainer')
+
+        self.assertEqual(cli.conn.token, "new_token")
+        self.assertEqual(swift_client.swift_auth.get((swift_client.AUTH_URL, swift_client.USER))[1], "new_token")
+
+    @patch("swiftclient.client.Connection.get_account")
+    def test_account_not_found_invalidates_keystone_cache(self, get_account_mock):
+        keystone = Mock()
+        keystone.get_storage_endpoints.return_value = {"adminURL": "http://somehost/v1/AUTH_user"}
+        get_account_mock.side_effect = ClientException("Not Found", http_status=404,
+                                                       http_path="/v1/AUTH_user")
+
+        cli = SwiftClient(keystone)
+
+        with self.assertRaises(ClientException):
+            cli.account_containers()
+
+        keystone.invalidate_token.assert_called_once_with()
+
+    @patch("swiftclient.client.Connection.head_container")
+    def test_container_not_found_keeps_keystone_cache(self, head_container_mock):
+        keystone = Mock()
+        keystone.get_storage_endpoints.return_value = {"adminURL": "http://somehost/v1/AUTH_user"}
+        head_container_mock.side_effect = ClientException("Not Found", http_status=404,
+                                                          http_path="/v1/AUTH_user/mycontainer")
+
+        cli = SwiftClient(keystone)
+
+        with self.assertRaises(ClientException):
+            cli.get_cors('mycontainer')
+
+        self.assertFalse(keystone.invalidate_token.called)
+
+    @patch("swiftclient.client.Connection.head_container")
+    def test_server_error_keeps_keystone_cache(self, head_container_mock):
+        keystone = Mock()
+        keystone.get_storage_endpoints.return_value = {"adminURL": "http://somehost/v1/AUTH_user"}
+        head_container_mock.side_effect = ClientException("Error", http_status=500)
+
+        cli = SwiftClient(keystone)
+
+        with self.assertRaises(ClientException):
+            cli.get_cors('mycontainer')
+
+        self.assertFalse(keystone.invalidate_token.called)
+
+    @patch("swiftclient.client.Connection.get_auth")
+    def test_authentication_is_reused_by_next_clients(self, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+
+        SwiftClient().close()
+        SwiftClient().close()
+
+        self.assertEqual(get_auth_mock.call_count, 1)
+
+    @patch("swiftclient.client.Connection.get_auth")
+    def test_closed_client_gives_connection_back_to_pool(self, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+
+        with SwiftClient() as cli:
+            conn = cli.conn
+
+        self.assertIs(SwiftClient().conn, conn)
+
+    @patch("swiftclient.client.Connection.get_auth")
+    def test_failed_client_does_not_give_connection_back(self, get_auth_mock):
+        get_auth_mock.return_value = ("http://somehost/v1/AUTH_user", "AUTH_t0k3n")
+
+        try:
+            with SwiftClient() as cli:
+                conn = cli.conn
+                raise ClientException("Error", http_status=500)
+        except ClientException:
+            pass
+
+        self.assertIsNot(SwiftClient().conn, conn)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    @patch("swiftsuru.swift_client.swiftclient")
+    def test_acquire_creates_connection_with_url_and_token(self, swiftclient_mock):
+        ConnectionPool(2, 60).acquire("http://somehost", "t0k3n", insecure=True)
+
+        swiftclient_mock.client.Connection.assert_called_once_with(preauthurl="http://somehost",
+                                                                   preauthtoken="t0k3n",
+                                                                   insecure=True)
+
+    @patch("swiftsuru.swift_client.swiftclient")
+    def test_released_connection_is_reused_with_new_token(self, swiftclient_mock):
+        pool = ConnectionPool(2, 60)
+        conn = pool.acquire("http://somehost", "t0k3n")
+        pool.release("http://somehost", conn)
+
+        reused = pool.acquire("http://somehost", "other_t0k3n")
+
+        self.assertIs(reused, conn)
+        self.assertEqual(reused.token, "other_t0k3n")
+
+    @patch("swiftsuru.swift_client.swiftclient")
+    def test_connections_are_kept_per_url(self, swiftclient_mock):
+        swiftclient_mock.client.Connection.side_effect = lambda **kwargs: Mock()
+        pool = ConnectionPool(2, 60)
+        conn = pool.acquire("http://somehost", "t0k3n")
+        pool.release("http://somehost", conn)
+
+        self.assertIsNot(pool.acquire("http://otherhost", "t0k3n"), conn)
+
+    def test_release_closes_connections_above_max_size(self):
+        pool = ConnectionPool(1, 60)
+        conn1, conn2 = Mock(), Mock()
+
+        pool.release("http://somehost", conn1)
+        pool.release("http://somehost", conn2)
+
+        conn2.close.assert_called_once_with()
+        self.assertFalse(conn1.close.called)
+
+    @patch("swiftsuru.swift_client.swiftclient")
+    @patch("swiftsuru.swift_client.time.time")
+    def test_idle_connections_are_evicted(self, time_mock, swiftclient_mock):
+        pool = ConnectionPool(2, 60)
+        conn = Mock()
+
+        time_mock.return_value = 100
+        pool.release("http://somehost", conn)
+
+        time_mock.return_value = 161
+        self.assertIsNot(pool.acquire("http://somehost", "t0k3n"), conn)
+        conn.close.assert_called_once_with()
@@ -0,0 +1,76 @@
+import unittest
+
+from datetime import datetime
+
+from mock import patch, call
+
+from swiftsuru.usage import UsageSweeper
+
+
+def build_instance(name, tenant="infra"):
+    return {"name": name, "container": "c_{}".format(name), "plan": "Infra", "tenant": tenant}
+
+
+# Mock call counts are not thread safe
+@patch("swiftsuru.usage.conf.USAGE_SWEEP_CONCURRENCY", 1)
+@patch("swiftsuru.usage.conf.USAGE_SWEEP_INTERVAL", 900)
+@patch("swiftsuru.usage.SwiftClient")
+@patch("swiftsuru.usage.KeystoneClient")
+@patch("swiftsuru.usage.SwiftsuruDBClient")
+class UsageSweeperTest(unittest.TestCase):
+
+    def test_measures_container_and_trash_container(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        db_cli = dbclient_mock.return_value
+        db_cli.claim_instances.side_effect = [[build_instance("one")], []]
+        client = swiftclient_mock.return_value.__enter__.return_value
+        client.container_usage.side_effect = [{"bytes": 10, "objects": 2}, {"bytes": 5, "objects": 1}]
+
+        UsageSweeper().run_once()
+
+        self.assertEqual(client.container_usage.call_args_list, [call("c_one"), call(".trash-c_one")])
+        name, usage = db_cli.set_instance_usage.call_args[0]
+        self.assertEqual(name, "one")
+        self.assertEqual(usage["bytes"], 15)
+        self.assertEqual(usage["objects"], 3)
+        self.assertEqual(usage["trash"], {"bytes": 5, "objects": 1})
+
+    @patch("swiftsuru.usage.conf.USAGE_SWEEP_BATCH_SIZE", 1)
+    def test_instances_are_claimed_in_batches(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        db_cli = dbclient_mock.return_value
+        db_cli.claim_instances.side_effect = [[build_instance("one")], [build_instance("two")], []]
+        client = swiftclient_mock.return_value.__enter__.return_value
+        client.container_usage.return_value = {"bytes": 0, "objects": 0}
+
+        UsageSweeper().run_once()
+
+        self.assertEqual([c[0][0] for c in db_cli.set_instance_usage.call_args_list], ["one", "two"])
+        field, swept_before, limit, fields = db_cli.claim_instances.call_args[0]
+        self.assertEqual((field, limit), ("usage_swept_at", 1))
+        self.assertAlmostEqual((datetime.utcnow() - swept_before).total_seconds(), 900, delta=5)
+
+    def test_instances_are_grouped_by_tenant(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        db_cli = dbclient_mock.return_value
+        db_cli.claim_instances.side_effect = [[build_instance("one", tenant="infra"),
+                                               build_instance("two", tenant="infra"),
+                                               build_instance("three", tenant=None)], []]
+        db_cli.get_plan.return_value = {"name": "Infra", "tenant": "other"}
+        client = swiftclient_mock.return_value.__enter__.return_value
+        client.container_usage.return_value = {"bytes": 0, "objects": 0}
+
+        UsageSweeper().run_once()
+
+        self.assertEqual(sorted(keystoneclient_mock.call_args_list),
+                         [call(tenant="infra"), call(tenant="other")])
+        self.assertEqual(db_cli.set_instance_usage.call_count, 3)
+
+    def test_failure_of_an_instance_does_not_stop_the_sweep(self, dbclient_mock, keystoneclient_mock, swiftclient_mock):
+        db_cli = dbclient_mock.return_value
+        db_cli.claim_instances.side_effect = [[build_instance("one"), build_instance("two")], []]
+        client = swiftclient_mock.return_value.__enter__.return_value
+        client.container_usage.side_effect = [Exception("swift is down"),
+                                              {"bytes": 1, "objects": 1}, {"bytes": 0, "objects": 0}]
+
+        UsageSweeper().run_once()
+
+        db_cli.set_instance_usage.assert_called_once()
+        self.assertEqual(db_cli.set_instance_usage.call_args[0][0], "two")
@@ -0,0 +1,82 @@
+import unittest
+
+from mock import patch
+
+from swiftsuru.warm_pool import WarmPoolFiller
+
+
+@patch("swiftsuru.warm_pool.Provisioner")
+@patch("swiftsuru.warm_pool.SwiftsuruDBClient")
+class WarmPoolFillerTest(unittest.TestCase):
+
+    @patch("swiftsuru.warm_pool.conf.WARM_POOL_DEPTH", 0)
+    def test_run_once_fills_missing_instances_of_each_plan(self, dbclient_mock, provisioner_mock):
+        dbclient_mock.return_value.list_plans.return_value = [
+            {"name": "small", "tenant": "infra", "warm_pool_depth": 3},
+            {"name": "big", "tenant": "media"}]
+        dbclient_mock.return_value.count_warm_instances.return_value = 1
+        dbclient_mock.return_value.claim_warm_pool.return_value = True
+
+        with patch.object(WarmPoolFiller, "fill") as fill_mock:
+            WarmPoolFiller().run_once()
+
+        self.assertEqual(fill_mock.call_count, 2)
+        fill_mock.assert_called_with({"name": "small", "tenant": "infra", "warm_pool_depth": 3}, 3)
+        dbclient_mock.return_value.release_warm_pool.assert_called_once_with("small")
+
+    def test_run_once_skips_plans_filled_by_another_process(self, dbclient_mock, provisioner_mock):
+        dbclient_mock.return_value.list_plans.return_value = [
+            {"name": "small", "tenant": "infra", "warm_pool_depth": 3}]
+        dbclient_mock.return_value.claim_warm_pool.return_value = False
+
+        with patch.object(WarmPoolFiller, "fill") as fill_mock:
+            WarmPoolFiller().run_once()
+
+        self.assertFalse(fill_mock.called)
+        self.assertFalse(dbclient_mock.return_value.count_warm_instances.called)
+        self.assertFalse(dbclient_mock.return_value.release_warm_pool.called)
+
+    def test_run_once_releases_stale_claimed_slots(self, dbclient_mock, provisioner_mock):
+        dbclient_mock.return_value.list_plans.return_value = []
+        dbclient_mock.return_value.list_stale_claimed_warm_instances.return_value = [
+            {"_id": "free", "container": "e2opim"},
+            {"_id": "used", "container": "a1b2c3"}]
+        dbclient_mock.return_value.get_instance_by_container.side_effect = [None, {"name": "myswift"}]
+
+        WarmPoolFiller().run_once()
+
+        dbclient_mock.return_value.release_warm_instance.assert_called_once_with("free")
+        dbclient_mock.return_value.remove_warm_instance.assert_called_once_with("used")
+
+    def test_fill_creates_user_and_containers(self, dbclient_mock, provisioner_mock):
+        dbclient_mock.return_value.reserve_warm_instance.return_value = "slot_id"
+        dbclient_mock.return_value.count_warm_instances.return_value = 0
+        provisioner_mock.return_value.endpoints.return_value = {"publicURL": "http://public"}
+
+        WarmPoolFiller().fill({"name": "small", "tenant": "infra"}, 2)
+
+        self.assertTrue(provisioner_mock.return_value.keystone_user.called)
+        self.assertTrue(provisioner_mock.return_value.containers.called)
+
+        args, _ = dbclient_mock.return_value.fill_warm_instance.call_args
+        self.assertEqual(args[0], "slot_id")
+        self.assertEqual(args[4], {"publicURL": "http://public"})
+
+    def test_fill_gives_slot_back_when_pool_is_full(self, dbclient_mock, provisioner_mock):
+        dbclient_mock.return_value.reserve_warm_instance.return_value = "slot_id"
+        dbclient_mock.return_value.count_warm_instances.return_value = 2
+
+        WarmPoolFiller().fill({"name": "small", "tenant": "infra"}, 2)
+
+        self.assertFalse(provisioner_mock.called)
+        dbclient_mock.return_value.remove_warm_instance.assert_called_once_with("slot_id")
+
+    def test_fill_gives_slot_back_on_failure(self, dbclient_mock, provisioner_mock):
+        dbclient_mock.return_value.reserve_warm_instance.return_value = "slot_id"
+        dbclient_mock.return_value.count_warm_instances.return_value = 0
+        provisioner_mock.return_value.containers.side_effect = Exception("swift is down")
+
+        WarmPoolFiller().fill({"name": "small", "tenant": "infra"}, 2)
+
+        dbclient_mock.return_value.remove_warm_instance.assert_called_once_with("slot_id")
+        self.assertFalse(dbclient_mock.return_value.fill_warm_instance.called)